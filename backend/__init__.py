@@ -5,6 +5,17 @@ from dotenv import load_dotenv
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Connection pool of the Database helpers: maximum number of open connections, number
+# of idle connections kept open, and seconds to wait for a free connection.
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", 5))
+DATABASE_POOL_MIN_IDLE = int(os.getenv("DATABASE_POOL_MIN_IDLE", 0))
+DATABASE_POOL_MAX_IDLE = int(os.getenv("DATABASE_POOL_MAX_IDLE", 5))
+DATABASE_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DATABASE_POOL_ACQUIRE_TIMEOUT", 30))
+
+# Directory where the SQL scripts transpiled for the configured database are cached.
+# Set it to an empty string to disable the on-disk cache.
+SQL_TRANSPILE_CACHE_DIR = os.getenv("SQL_TRANSPILE_CACHE_DIR", ".sql_cache")
+
 # Private key used to generate the JWT tokens for secure authentication
 SECRET_KEY = os.getenv("SECRET_KEY", "default_unsecure_key")
 
@@ -1,13 +1,20 @@
+from backend.api_plugins.batch.batch import batch_routes
 from backend.api_plugins.insecure_authentication.insecure_authentication import (
     insecure_authentication_routes,
 )
+from backend.api_plugins.readiness.readiness import readiness_routes
 from backend.api_plugins.secure_authentication.secure_authentication import (
     authentication_routes,
 )
 from backend.api_plugins.sessions.sessions import session_routes
+from backend.api_plugins.tenancy.tenancy import tenant_dependency, with_tenant
 
 __all__ = [
+    "batch_routes",
     "insecure_authentication_routes",
     "authentication_routes",
+    "readiness_routes",
     "session_routes",
+    "tenant_dependency",
+    "with_tenant",
 ]
@@ -0,0 +1,48 @@
+import json
+from typing import Optional, Sequence
+
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+from backend.api_plugins.tenancy.tenancy import with_tenant
+from backend.model import InvokeRequest
+from backend.rag_components.batch import BatchAnswerer
+
+
+def batch_routes(
+    app: FastAPI | APIRouter,
+    rag,
+    *,
+    dependencies: Optional[Sequence[Depends]] = None,
+):
+    @app.post("/invoke/batch", dependencies=dependencies)
+    async def invoke_batch(
+        request: InvokeRequest, http_request: Request
+    ) -> StreamingResponse:
+        """Answers a batch of questions, streamed back as newline-delimited JSON.
+
+        Each line is `{"index": i, "output": answer}` or `{"index": i, "error":
+        message}`, where `i` is the position of the question in the batch. Lines are
+        sent in the order answers complete. `config.max_concurrency` caps the number
+        of questions answered at the same time.
+
+        The documents of a question are retrieved among those whose metadata match
+        its `filter`, and `config.configurable.filter`, when given. They are
+        retrieved from the indexes of the tenant of the request, when the route
+        depends on `tenant_dependency`.
+        """
+        inputs = request.input if isinstance(request.input, list) else [request.input]
+        if not inputs:
+            raise HTTPException(status_code=400, detail="The batch is empty")
+
+        config = with_tenant(dict(request.config), http_request)
+        max_concurrency = config.pop("max_concurrency", None)
+        answerer = BatchAnswerer(rag, max_concurrency=max_concurrency)
+
+        async def stream_answers():
+            questions = [item.question for item in inputs]
+            filters = [item.filter for item in inputs]
+            async for result in answerer.astream(questions, config, filters):
+                yield json.dumps(result) + "\n"
+
+        return StreamingResponse(stream_answers(), media_type="application/x-ndjson")
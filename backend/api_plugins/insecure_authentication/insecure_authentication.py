@@ -18,31 +18,31 @@ def insecure_authentication_routes(app):
 
     async def get_current_user(email: str) -> User:
         email = email.replace("Bearer ", "")
-        user = get_user(email)
+        user = await get_user(email)
         return user
 
     @app.post("/user/signup")
     async def signup(email: str) -> dict:
         user = User(email=email)
-        if user_exists(user.email):
+        if await user_exists(user.email):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"User {user.email} already registered",
             )
-        create_user(user)
+        await create_user(user)
         return {"email": user.email}
 
     @app.delete("/user/")
     async def del_user(current_user: User = Depends(get_current_user)) -> dict:
         email = current_user.email
         try:
-            user = get_user(email)
+            user = await get_user(email)
             if user is None:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail=f"User {email} not found",
                 )
-            delete_user(email)
+            await delete_user(email)
             return {"detail": f"User {email} deleted"}
         except Exception:
             raise HTTPException(
@@ -52,7 +52,7 @@ def insecure_authentication_routes(app):
 
     @app.post("/user/login")
     async def login(email: str) -> dict:
-        user = get_user(email)
+        user = await get_user(email)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
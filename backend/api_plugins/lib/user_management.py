@@ -1,3 +1,4 @@
+import asyncio
 from datetime import datetime, timedelta
 from typing import Optional
 
@@ -6,7 +7,7 @@ from jose import jwt
 from pydantic import BaseModel
 
 from backend import ALGORITHM, SECRET_KEY
-from backend.database import Database
+from backend.database import AsyncDatabase
 
 
 class UnsecureUser(BaseModel):
@@ -24,40 +25,47 @@ class User(BaseModel):
         return cls(email=unsecure_user.email, hashed_password=hashed_password)
 
 
-def create_user(user: User) -> None:
-    with Database() as connection:
-        connection.execute(
+async def create_user(user: User) -> None:
+    async with AsyncDatabase() as connection:
+        await connection.execute(
             "INSERT INTO users (email, password) VALUES (?, ?)",
             (user.email, user.hashed_password),
         )
 
 
-def user_exists(email: str) -> bool:
-    with Database() as connection:
-        result = connection.fetchone("SELECT 1 FROM users WHERE email = ?", (email,))
+async def user_exists(email: str) -> bool:
+    async with AsyncDatabase() as connection:
+        result = await connection.fetchone(
+            "SELECT 1 FROM users WHERE email = ?", (email,)
+        )
         return bool(result)
 
 
-def get_user(email: str) -> Optional[User]:
-    with Database() as connection:
-        user_row = connection.fetchone("SELECT * FROM users WHERE email = ?", (email,))
+async def get_user(email: str) -> Optional[User]:
+    async with AsyncDatabase() as connection:
+        user_row = await connection.fetchone(
+            "SELECT * FROM users WHERE email = ?", (email,)
+        )
         if user_row:
             return User(email=user_row[0], hashed_password=user_row[1])
         return None
 
 
-def delete_user(email: str) -> None:
-    with Database() as connection:
-        connection.execute("DELETE FROM users WHERE email = ?", (email,))
+async def delete_user(email: str) -> None:
+    async with AsyncDatabase() as connection:
+        await connection.execute("DELETE FROM users WHERE email = ?", (email,))
 
 
-def authenticate_user(username: str, password: bytes) -> bool | User:
-    user = get_user(username)
+async def authenticate_user(username: str, password: bytes) -> bool | User:
+    user = await get_user(username)
     if not user:
         return False
 
-    if argon2.verify_password(
-        user.hashed_password.encode("utf-8"), password.encode("utf-8")
+    # Password hashing is CPU bound, it runs off the event loop
+    if await asyncio.to_thread(
+        argon2.verify_password,
+        user.hashed_password.encode("utf-8"),
+        password.encode("utf-8"),
     ):
         return user
 
@@ -0,0 +1,21 @@
+from fastapi import APIRouter, FastAPI
+from fastapi.responses import JSONResponse
+
+
+def readiness_routes(app: FastAPI | APIRouter, rag):
+    @app.get("/ready")
+    async def ready() -> JSONResponse:
+        """Reports whether the RAG components are loaded, for readiness probes.
+
+        Responds 503 until queries can be answered without waiting for a component
+        to load, with the status, load time and error of every component.
+        """
+        is_ready = rag.is_ready
+        return JSONResponse(
+            {
+                "ready": is_ready,
+                "startup_mode": rag.config.startup.mode,
+                "components": rag.components.status(),
+            },
+            status_code=200 if is_ready else 503,
+        )
@@ -1,3 +1,4 @@
+import asyncio
 from pathlib import Path
 from typing import List
 
@@ -40,7 +41,7 @@ def authentication_routes(app, dependencies=List[Depends]):
             if email is None:
                 raise credentials_exception
 
-            user = get_user(email)
+            user = await get_user(email)
             if user is None:
                 raise credentials_exception
             return user
@@ -54,27 +55,28 @@ def authentication_routes(app, dependencies=List[Depends]):
                 status_code=status.HTTP_403_FORBIDDEN, detail="Signup is disabled"
             )
 
-        user = User.from_unsecure_user(user)
-        if user_exists(user.email):
+        # Password hashing is CPU bound, it runs off the event loop
+        user = await asyncio.to_thread(User.from_unsecure_user, user)
+        if await user_exists(user.email):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"User {user.email} already registered",
             )
 
-        create_user(user)
+        await create_user(user)
         return {"email": user.email}
 
     @app.delete("/user/")
     async def del_user(current_user: User = Depends(get_current_user)) -> dict:
         email = current_user.email
         try:
-            user = get_user(email)
+            user = await get_user(email)
             if user is None:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail=f"User {email} not found",
                 )
-            delete_user(email)
+            await delete_user(email)
             return {"detail": f"User {email} deleted"}
         except Exception:
             raise HTTPException(
@@ -84,7 +86,7 @@ def authentication_routes(app, dependencies=List[Depends]):
 
     @app.post("/user/login")
     async def login(form_data: OAuth2PasswordRequestForm = Depends()) -> dict:
-        user = authenticate_user(form_data.username, form_data.password)
+        user = await authenticate_user(form_data.username, form_data.password)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -1,13 +1,36 @@
+import base64
+import hashlib
 import json
+import re
 from datetime import datetime
 from pathlib import Path
 from typing import Optional, Sequence
 from uuid import uuid4
 
-from fastapi import APIRouter, Depends, FastAPI, Response
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 
 from backend.api_plugins.lib.user_management import User
 
+# Number of sessions returned by /session/list when no limit is given, and the
+# maximum limit accepted
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Number of messages returned by /session/{session_id} when no limit is given, and
+# the maximum limit accepted
+DEFAULT_HISTORY_PAGE_SIZE = 100
+MAX_HISTORY_PAGE_SIZE = 1000
+
+# Number of messages read from the database at once by /session/{session_id}/stream
+STREAM_BATCH_SIZE = 500
+
+# Number of sessions whose summary is computed per query when backfilling
+BACKFILL_BATCH_SIZE = 500
+
+# Opaque part of an entity tag of a header, with its quotes but without `W/`
+ENTITY_TAG_PATTERN = re.compile(r'(?:W/)?("[^"]*")')
+
 
 def session_routes(
     app: FastAPI | APIRouter,
@@ -15,11 +38,15 @@ def session_routes(
     authentication: Depends = None,
     dependencies: Optional[Sequence[Depends]] = None,
 ):
-    from backend.database import Database
-    from backend.model import Message
+    from backend.database import AsyncDatabase, Database
+    from backend.rag_components.chat_message_history import wait_for_history_writes
 
     with Database() as connection:
         connection.run_script(Path(__file__).parent / "sessions_tables.sql")
+        connection.create_index(
+            "session", "idx_session_user_id_timestamp", ["user_id", "timestamp", "id"]
+        )
+        backfill_session_summaries(connection)
 
     @app.post("/session/new")
     async def chat_new(
@@ -28,78 +55,263 @@ def session_routes(
         chat_id = str(uuid4())
         timestamp = datetime.utcnow().isoformat()
         user_id = current_user.email if current_user else "unauthenticated"
-        with Database() as connection:
-            connection.execute(
+        async with AsyncDatabase() as connection:
+            await connection.execute(
                 "INSERT INTO session (id, timestamp, user_id) VALUES (?, ?, ?)",
                 (chat_id, timestamp, user_id),
             )
+            await connection.execute(
+                "INSERT INTO session_summary (session_id, last_activity, message_count)"
+                " VALUES (?, ?, 0)",
+                (chat_id, timestamp),
+            )
         return {"session_id": chat_id}
 
     @app.get("/session/list")
     async def chat_list(
-        current_user: User = authentication, dependencies=dependencies
-    ) -> list[dict]:
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        cursor: Optional[str] = None,
+        current_user: User = authentication,
+        dependencies=dependencies,
+    ) -> dict:
+        """Lists the sessions of the user, most recent first.
+
+        Pass the `next_cursor` of a page as `cursor` to get the next one, it is `None`
+        on the last page.
+        """
         user_email = current_user.email if current_user else "unauthenticated"
-        chats = []
-        with Database() as connection:
-            # Check if message_history table exists (first time running the app will not
-            # have this table created yet)
-            message_history_exists = connection.fetchone(
-                "SELECT name FROM sqlite_master WHERE type='table' AND"
-                " name='message_history'"
-            )
-            if message_history_exists:
-                # Join session with message_history and get the first message
-                result = connection.execute(
-                    "SELECT s.id, s.timestamp, mh.message FROM session s LEFT JOIN"
-                    " (SELECT *, ROW_NUMBER() OVER (PARTITION BY session_id ORDER BY"
-                    " timestamp ASC) as rn FROM message_history) mh ON s.id ="
-                    " mh.session_id AND mh.rn = 1 WHERE s.user_id = ? ORDER BY"
-                    " s.timestamp DESC",
-                    (user_email,),
-                )
-                for row in result:
-                    # Extract the first message content if available
-                    first_message_content = (
-                        json.loads(row[2])["data"]["content"] if row[2] else ""
-                    )
-                    chat = {
-                        "id": row[0],
-                        "timestamp": row[1],
-                        "first_message": first_message_content,
-                    }
-                    chats.append(chat)
-        return chats
+        query = (
+            "SELECT s.id, s.timestamp, ss.first_message, ss.last_activity,"
+            " ss.message_count FROM session s LEFT JOIN session_summary ss ON"
+            " ss.session_id = s.id WHERE s.user_id = ?"
+        )
+        params = (user_email,)
+        if cursor:
+            timestamp, chat_id = decode_cursor(cursor)
+            query += " AND (s.timestamp < ? OR (s.timestamp = ? AND s.id < ?))"
+            params += (timestamp, timestamp, chat_id)
+        query += " ORDER BY s.timestamp DESC, s.id DESC LIMIT ?"
+        params += (limit + 1,)  # One more row tells whether there is a next page
+
+        async with AsyncDatabase() as connection:
+            rows = await connection.fetchall(query, params)
+
+        chats = [
+            {
+                "id": row[0],
+                "timestamp": str(row[1]),
+                "first_message": row[2] or "",
+                "last_activity": str(row[3]) if row[3] else None,
+                "message_count": row[4] or 0,
+            }
+            for row in rows[:limit]
+        ]
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = encode_cursor(chats[-1]["timestamp"], chats[-1]["id"])
+        return {"sessions": chats, "next_cursor": next_cursor}
 
     @app.get("/session/{session_id}")
     async def chat(
-        session_id: str, current_user: User = authentication, dependencies=dependencies
+        session_id: str,
+        request: Request,
+        response: Response,
+        limit: int = Query(DEFAULT_HISTORY_PAGE_SIZE, ge=1, le=MAX_HISTORY_PAGE_SIZE),
+        before: Optional[str] = None,
+        current_user: User = authentication,
+        dependencies=dependencies,
     ) -> dict:
-        messages: list[Message] = []
-        with Database() as connection:
-            result = connection.execute(
-                "SELECT id, timestamp, session_id, message FROM message_history WHERE"
-                " session_id = ? ORDER BY timestamp ASC",
+        """Returns the `limit` most recent messages of a session, oldest first.
+
+        Pass the `next_cursor` of a page as `before` to get the messages that precede
+        it, it is `None` once the first message is reached. Responses carry an ETag
+        that changes whenever messages are added to the session, send it back in
+        `If-None-Match` to get a 304 when the history did not change.
+        """
+        await wait_for_history_writes(session_id)
+        query = (
+            "SELECT id, timestamp, session_id, message FROM message_history WHERE"
+            " session_id = ?"
+        )
+        params = (session_id,)
+        if before:
+            timestamp, message_id = decode_cursor(before)
+            if not message_id.isdigit():
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            query += " AND (timestamp < ? OR (timestamp = ? AND id < ?))"
+            params += (timestamp, timestamp, int(message_id))
+        query += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+        params += (limit + 1,)  # One more row tells whether there are older ones
+
+        async with AsyncDatabase() as connection:
+            summary = await connection.fetchone(
+                "SELECT message_count, last_activity FROM session_summary WHERE"
+                " session_id = ?",
                 (session_id,),
             )
-            for row in result:
-                content = json.loads(row[3])["data"]["content"]
-                message_type = json.loads(row[3])["type"]
-                message = Message(
-                    id=row[0],
-                    timestamp=row[1],
-                    session_id=row[2],
-                    sender=message_type if message_type == "human" else "ai",
-                    content=content,
+            etag = None
+            if summary:
+                etag = get_history_etag(session_id, summary, limit, before)
+                if etag_matches(etag, request.headers.get("if-none-match")):
+                    return Response(status_code=304, headers={"ETag": etag})
+
+            rows = await connection.fetchall(query, params)
+
+        messages = [format_message(row) for row in reversed(rows[:limit])]
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = encode_cursor(messages[0]["timestamp"], messages[0]["id"])
+        if etag:
+            response.headers["ETag"] = etag
+            response.headers["Cache-Control"] = "no-cache"
+        return {"chat_id": session_id, "messages": messages, "next_cursor": next_cursor}
+
+    @app.get("/session/{session_id}/stream")
+    async def chat_stream(
+        session_id: str, current_user: User = authentication, dependencies=dependencies
+    ) -> StreamingResponse:
+        """Streams every message of a session, oldest first, as newline-delimited
+        JSON."""
+        await wait_for_history_writes(session_id)
+
+        async def stream_messages():
+            last_row = None
+            while True:
+                # Each page borrows its own connection, so that a slow client does not
+                # hold one for the whole download.
+                query = (
+                    "SELECT id, timestamp, session_id, message FROM message_history"
+                    " WHERE session_id = ?"
                 )
-                messages.append(message)
-        return {
-            "chat_id": session_id,
-            "messages": [message.dict() for message in messages],
-        }
+                params = (session_id,)
+                if last_row:
+                    query += " AND (timestamp > ? OR (timestamp = ? AND id > ?))"
+                    params += (last_row[1], last_row[1], last_row[0])
+                query += " ORDER BY timestamp ASC, id ASC LIMIT ?"
+                params += (STREAM_BATCH_SIZE,)
+                async with AsyncDatabase() as connection:
+                    rows = await connection.fetchall(query, params)
+
+                if rows:
+                    yield "".join(
+                        json.dumps(format_message(row)) + "\n" for row in rows
+                    )
+                if len(rows) < STREAM_BATCH_SIZE:
+                    return
+                last_row = rows[-1]
+
+        return StreamingResponse(stream_messages(), media_type="application/x-ndjson")
 
     @app.get("/session")
     async def session_root(
         current_user: User = authentication, dependencies=dependencies
     ) -> dict:
         return Response("Sessions management routes are enabled.", status_code=200)
+
+
+def format_message(row: tuple) -> dict:
+    """Turns a message_history row into the fields of `backend.model.Message`."""
+    message = json.loads(row[3])
+    return {
+        "id": str(row[0]),
+        "timestamp": str(row[1]),
+        "session_id": row[2],
+        "sender": "human" if message["type"] == "human" else "ai",
+        "content": message["data"]["content"],
+    }
+
+
+def get_history_etag(
+    session_id: str, summary: tuple, limit: int, before: Optional[str]
+) -> str:
+    """Identifies a page of history, it changes whenever a message is added."""
+    message_count, last_activity = summary
+    version = f"{session_id}:{message_count}:{last_activity}:{limit}:{before}"
+    return f'"{hashlib.sha1(version.encode("utf-8")).hexdigest()}"'
+
+
+def etag_matches(etag: str, if_none_match: Optional[str]) -> bool:
+    """Tells whether an `If-None-Match` header lists the entity tag, or is `*`.
+
+    The header is a comma-separated list of quoted entity tags. Tags are compared
+    without their weakness indicator `W/`, as required for `If-None-Match`.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag.removeprefix("W/") in ENTITY_TAG_PATTERN.findall(if_none_match)
+
+
+def encode_cursor(timestamp: str, row_id: str) -> str:
+    """Encodes the position of the last row of a page."""
+    cursor = json.dumps([timestamp, row_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(cursor).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple[str, str]:
+    try:
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(cursor))
+        return str(timestamp), str(row_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def backfill_session_summaries(connection) -> None:
+    """Creates the summaries missing for sessions that predate the summary table.
+
+    Only sessions without a summary are read, so this is a no-op once done. Nothing
+    is done on a database where no message was ever written.
+    """
+    from backend.rag_components.chat_message_history import (
+        FIRST_MESSAGE_PREVIEW_LENGTH,
+    )
+
+    if not connection.table_exists("message_history"):
+        return
+
+    missing = [
+        row[0]
+        for row in connection.fetchall(
+            "SELECT s.id FROM session s LEFT JOIN session_summary ss ON"
+            " ss.session_id = s.id WHERE ss.session_id IS NULL"
+        )
+    ]
+    for i in range(0, len(missing), BACKFILL_BATCH_SIZE):
+        batch = missing[i : i + BACKFILL_BATCH_SIZE]
+        placeholders = ", ".join("?" for _ in batch)
+        stats = {
+            row[0]: row[1:]
+            for row in connection.fetchall(
+                "SELECT session_id, MIN(id), MAX(timestamp), COUNT(*) FROM"
+                f" message_history WHERE session_id IN ({placeholders}) GROUP BY"
+                " session_id",
+                tuple(batch),
+            )
+        }
+        first_messages = {}
+        first_ids = tuple(first_id for first_id, _, _ in stats.values())
+        if first_ids:
+            id_placeholders = ", ".join("?" for _ in first_ids)
+            first_messages = dict(
+                connection.fetchall(
+                    "SELECT session_id, message FROM message_history WHERE id IN"
+                    f" ({id_placeholders})",
+                    first_ids,
+                )
+            )
+
+        summaries = []
+        for chat_id in batch:
+            _, last_activity, message_count = stats.get(chat_id, (None, None, 0))
+            first_message = None
+            if chat_id in first_messages:
+                content = json.loads(first_messages[chat_id])["data"]["content"]
+                if isinstance(content, str):
+                    first_message = content[:FIRST_MESSAGE_PREVIEW_LENGTH]
+            summaries.append((chat_id, first_message, last_activity, message_count))
+        connection.executemany(
+            "INSERT INTO session_summary (session_id, first_message, last_activity,"
+            " message_count) VALUES (?, ?, ?, ?)",
+            summaries,
+        ).close()
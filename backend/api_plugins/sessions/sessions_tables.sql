@@ -7,3 +7,11 @@ CREATE TABLE IF NOT EXISTS "session" (
     "user_id" VARCHAR(255),
     FOREIGN KEY ("user_id") REFERENCES "users" ("email")
 );
+
+-- Also created with the RAG tables, the routes of this plugin write it on their own.
+CREATE TABLE IF NOT EXISTS "session_summary" (
+    "session_id" VARCHAR(255) PRIMARY KEY,
+    "first_message" TEXT,
+    "last_activity" DATETIME,
+    "message_count" INTEGER DEFAULT 0
+);
@@ -0,0 +1,66 @@
+from typing import Callable, Optional
+
+from fastapi import Depends, Header, HTTPException, Request, status
+
+from backend.api_plugins.lib.user_management import User
+from backend.rag_components.tenancy import TENANT_KEY, validate_tenant
+
+
+def email_domain(user: User) -> str:
+    return user.email.rsplit("@", 1)[-1]
+
+
+def tenant_dependency(
+    rag,
+    authentication: Optional[Depends] = None,
+    tenant_of_user: Callable[[User], str] = email_domain,
+) -> Depends:
+    """Resolves the tenant of each request, for the routes that depend on it.
+
+    With `authentication`, the tenant is derived from the authenticated user, by
+    default the domain of their email. Without it, it is read from the
+    `tenancy.header` header, which should then be set by a trusted gateway. Requests
+    without a valid tenant are rejected when tenancy is enabled. Pass `with_tenant`
+    as the `per_req_config_modifier` of the langserve routes to hand the tenant to
+    the chain.
+    """
+    enabled = rag.tenants is not None
+
+    def resolve(request: Request, tenant: Optional[str]) -> Optional[str]:
+        if not enabled:
+            return None
+        if not tenant:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Missing tenant"
+            )
+        try:
+            request.state.tenant = validate_tenant(tenant)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        return tenant
+
+    if authentication is not None:
+
+        async def get_tenant(request: Request, user: User = authentication) -> str:
+            return resolve(request, tenant_of_user(user) if user else None)
+
+    else:
+
+        async def get_tenant(
+            request: Request,
+            tenant: Optional[str] = Header(None, alias=rag.config.tenancy.header),
+        ) -> str:
+            return resolve(request, tenant)
+
+    return Depends(get_tenant)
+
+
+def with_tenant(config: dict, request: Request) -> dict:
+    """Sets the tenant resolved by `tenant_dependency` in the config of a request,
+    replacing any tenant sent by the client."""
+    configurable = dict(config.get("configurable") or {})
+    configurable.pop(TENANT_KEY, None)
+    tenant = getattr(request.state, "tenant", None)
+    if tenant is not None:
+        configurable[TENANT_KEY] = tenant
+    return {**config, "configurable": configurable}
@@ -6,6 +6,7 @@ import yaml
 from dotenv import load_dotenv
 from jinja2 import Template
 from langchain.vectorstores import VectorStore
+from langchain_community.cross_encoders.base import BaseCrossEncoder
 from langchain_core.embeddings import Embeddings
 from langchain_core.language_models import LLM
 from langchain_core.language_models.chat_models import BaseChatModel
@@ -19,17 +20,53 @@ class LLMConfig:
     source_config: dict
 
 
+@dataclass
+class AnnIndexConfig:
+    enabled: bool = False  # Approximate search, only supported by LocalVectorStore
+    nlist: int = None  # Number of clusters, defaults to 4 * sqrt(number of vectors)
+    nprobe: int = 16  # Clusters scanned per query, trades latency for recall
+    min_vectors: int = 100_000  # Index size from which the clusters are built
+    training_sample_size: int = 64  # Vectors sampled per cluster to train them
+    training_iterations: int = 10
+
+
 @dataclass
 class VectorStoreConfig:
     source: VectorStore | str
     source_config: dict
     insertion_mode: str  # "None", "full", "incremental"
+    retriever_search_type: str = "similarity_score_threshold"
+    retriever_config: dict = field(
+        default_factory=lambda: {"k": 5, "score_threshold": 0.5}
+    )
+    ann_index: AnnIndexConfig = field(default_factory=AnnIndexConfig)
+
+    def __post_init__(self):
+        if isinstance(self.ann_index, dict):
+            self.ann_index = AnnIndexConfig(**self.ann_index)
+
+
+@dataclass
+class HybridSearchConfig:
+    enabled: bool = False  # Fuses BM25 and vector search results
+    index_path: str = "lexical_index/"  # Where the BM25 inverted index is stored
+    k: int = 5  # Documents returned after fusion
+    fetch_k: int = 20  # Documents fetched from each search before fusion
+    rrf_k: int = 60  # Rank offset of reciprocal rank fusion
+    bm25_k1: float = 1.2
+    bm25_b: float = 0.75
 
 
 @dataclass
 class EmbeddingModelConfig:
     source: Embeddings | str
     source_config: dict
+    cache: str = None  # None, "local" or "database"
+    cache_path: str = "embedding_cache/embeddings.sqlite3"  # Used by the local cache
+    cache_max_entries: int = 1_000_000
+    micro_batching: bool = False  # Embeds concurrent queries together
+    micro_batch_window_ms: float = 5  # Time waited for more queries after the first
+    micro_batch_max_size: int = 32  # Queries that trigger a batch without waiting
 
 
 @dataclass
@@ -37,6 +74,86 @@ class DatabaseConfig:
     database_url: str
 
 
+@dataclass
+class IngestionConfig:
+    batch_size: int = 100  # Documents per embedding batch and per index() batch
+    loader_workers: int = 4  # Processes parsing files, 0 loads in the main process
+    embedding_workers: int = 2  # Threads embedding batches ahead of the writer
+    queue_size: int = 8  # Batches buffered between two stages
+    skip_unchanged_files: bool = True  # Skips files whose size, mtime or hash match
+    checkpoint_interval: int = 10_000  # Documents of a file indexed between checkpoints
+
+
+@dataclass
+class SemanticCacheConfig:
+    enabled: bool = False
+    similarity_threshold: float = 0.95  # Cosine similarity between two questions
+    ttl_seconds: float = 3600
+    max_entries: int = 1000
+    index_check_seconds: float = 5  # Polling of the loads made by other processes
+
+
+@dataclass
+class BatchConfig:
+    max_concurrency: int = 8  # Questions of a batch answered at the same time
+
+
+@dataclass
+class RerankConfig:
+    enabled: bool = False  # Reranks the retrieved documents with a cross-encoder
+    source: BaseCrossEncoder | str = "HuggingFaceCrossEncoder"
+    source_config: dict = field(
+        default_factory=lambda: {"model_name": "BAAI/bge-reranker-base"}
+    )
+    k: int = 5  # Documents kept after reranking
+    fetch_k: int = 30  # Candidates retrieved and scored, without similarity threshold
+    min_score: float = None  # Cross-encoder score below which documents are dropped
+    max_workers: int = 1  # Threads running the cross-encoder
+    cache_max_entries: int = 10_000  # Scores cached by question and document
+
+
+@dataclass
+class ContextPackingConfig:
+    enabled: bool = True  # Fits the retrieved documents in max_tokens_limit
+    deduplicate: bool = True  # Removes duplicated and overlapping chunks
+    truncate: bool = True  # Truncates the document that does not fit whole
+    min_truncated_tokens: int = 64  # Smallest budget worth truncating a document into
+
+
+@dataclass
+class TenancyConfig:
+    enabled: bool = False  # Gives every tenant its own collection and lexical index
+    header: str = "X-Tenant-Id"  # Names the tenant of unauthenticated requests
+    memory_budget_mb: float = 1024  # Tenant indexes kept loaded, least recent evicted
+    max_loaded_tenants: int = 64  # Also bounds stores whose memory is not measured
+
+
+@dataclass
+class StartupConfig:
+    mode: str = "eager"  # "eager", "lazy" or "background"
+
+
+@dataclass
+class ChatHistoryConfig:
+    max_tokens: int = 1000  # Token budget of the history given to the prompts
+    summarize: bool = True  # Compresses the turns older than the window in a summary
+    max_cached_sessions: int = 1024  # Histories of recent sessions kept in memory
+    write_behind: bool = False  # Batches the inserts of many sessions in one commit
+    write_behind_interval_ms: float = 50  # Longest time a message waits to be written
+    write_behind_max_batch_size: int = 500  # Waiting messages that trigger a commit
+
+
+@dataclass
+class CondenseQuestionConfig:
+    skip_standalone_questions: bool = False  # Heuristic, only reliable in English
+    speculative_retrieval: bool = True  # Retrieves with the raw question meanwhile
+    llm: LLMConfig = None  # Smaller model used to condense, defaults to the main one
+
+    def __post_init__(self):
+        if isinstance(self.llm, dict):
+            self.llm = LLMConfig(**self.llm)
+
+
 @dataclass
 class RagConfig:
     """
@@ -51,9 +168,34 @@ class RagConfig:
     Attributes:
         llm (LLMConfig): Configuration for the language model component.
         vector_store (VectorStoreConfig): Configuration for the vector store component.
+        hybrid_search (HybridSearchConfig): Whether and how BM25 search results are
+            fused with the vector store ones.
         embedding_model (EmbeddingModelConfig): Configuration for the embedding model
             component.
         database (DatabaseConfig): Configuration for the database connection.
+        ingestion (IngestionConfig): Batch size, worker counts and queue sizes of the
+            document ingestion pipeline.
+        semantic_cache (SemanticCacheConfig): Configuration of the cache replaying
+            answers to near-duplicate questions.
+        batch (BatchConfig): Concurrency of the batched answering of questions.
+        startup (StartupConfig): Whether the components are loaded when the RAG is
+            created, on first use, or in the background.
+        chat_history (ChatHistoryConfig): Token budget and summarization of the
+            conversation history.
+        condense_question (CondenseQuestionConfig): When and with which model the
+            question is rephrased with the conversation history.
+        context_packing (ContextPackingConfig): How the retrieved documents are fitted
+            in the token budget of the context.
+        rerank (RerankConfig): Whether and how the retrieved documents are reranked
+            with a cross-encoder.
+        tenancy (TenancyConfig): Whether documents are isolated per tenant, and how
+            many tenant indexes stay loaded.
+        chat_history_window_size (int): Number of most recent messages of a
+            conversation given to the prompts.
+        max_tokens_limit (int): Token budget of the retrieved documents given to the
+            prompts.
+        tokenizer (str): Name of the tokenizer counting tokens against the budgets,
+            see `backend.rag_components.tokenizer.TOKENIZERS`.
 
     Methods:
         from_yaml: Class method to create an instance of RagConfig from a YAML file,
@@ -62,10 +204,23 @@ class RagConfig:
 
     llm: LLMConfig = field(default_factory=LLMConfig)
     vector_store: VectorStoreConfig = field(default_factory=VectorStoreConfig)
+    hybrid_search: HybridSearchConfig = field(default_factory=HybridSearchConfig)
     embedding_model: EmbeddingModelConfig = field(default_factory=EmbeddingModelConfig)
     database: DatabaseConfig = field(default_factory=DatabaseConfig)
+    ingestion: IngestionConfig = field(default_factory=IngestionConfig)
+    semantic_cache: SemanticCacheConfig = field(default_factory=SemanticCacheConfig)
+    batch: BatchConfig = field(default_factory=BatchConfig)
+    startup: StartupConfig = field(default_factory=StartupConfig)
+    context_packing: ContextPackingConfig = field(default_factory=ContextPackingConfig)
+    rerank: RerankConfig = field(default_factory=RerankConfig)
+    tenancy: TenancyConfig = field(default_factory=TenancyConfig)
+    chat_history: ChatHistoryConfig = field(default_factory=ChatHistoryConfig)
+    condense_question: CondenseQuestionConfig = field(
+        default_factory=CondenseQuestionConfig
+    )
     chat_history_window_size: int = 5
     max_tokens_limit: int = 3000
+    tokenizer: str = "approximate"
     response_mode: str = None
 
     @classmethod
@@ -1,15 +1,134 @@
+import asyncio
+import hashlib
+import inspect
+import json
+import os
+from functools import lru_cache
 from logging import Logger
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
 
 import sqlglot
 from dbutils.pooled_db import PooledDB
 from sqlalchemy.engine.url import make_url
 
-from backend import DATABASE_URL
+from backend import (
+    DATABASE_POOL_ACQUIRE_TIMEOUT,
+    DATABASE_POOL_MAX_IDLE,
+    DATABASE_POOL_MIN_IDLE,
+    DATABASE_POOL_SIZE,
+    DATABASE_URL,
+    SQL_TRANSPILE_CACHE_DIR,
+)
 from backend.logger import get_logger
 
-POOL = None
+POOLS = {}
+ASYNC_POOLS = {}
+
+# Placeholder of each dialect's driver, queries are always written with `?`
+DIALECT_PLACEHOLDERS = {
+    "sqlite": "?",
+    "postgresql": "%s",
+    "mysql": "%s",
+}
+
+# sqlglot dialect used to transpile the SQLite scripts for each database
+SQLGLOT_DIALECTS = {
+    "sqlite": "sqlite",
+    "postgresql": "postgres",
+    "mysql": "mysql",
+}
+
+# Scripts already transpiled by this process, keyed by content hash and dialect
+_TRANSPILED_SCRIPTS: Dict[Tuple[str, str], List[str]] = {}
+
+
+@lru_cache(maxsize=4096)
+def compile_statement(query: str, dialect: str) -> str:
+    """Rewrites a query written with `?` placeholders for the driver of a dialect.
+
+    Question marks inside string literals, quoted identifiers and comments are left
+    untouched. For drivers using `%s` placeholders, literal `%` are escaped. Queries
+    are compiled once per dialect and memoized.
+
+    Args:
+        query (str): The query, with `?` placeholders.
+        dialect (str): The database dialect, as returned by `URL.get_backend_name`.
+
+    Returns:
+        str: The query to send to the driver along with its parameters.
+    """
+    placeholder = DIALECT_PLACEHOLDERS.get(dialect, "?")
+    if placeholder == "?":
+        return query
+
+    compiled = []
+    closing = None  # Closing token of the literal or comment being scanned
+    i = 0
+    while i < len(query):
+        token = query[i]
+        if closing is None:
+            if token in "'\"`":
+                closing = token
+            elif query.startswith("--", i):
+                closing = "\n"
+            elif query.startswith("/*", i):
+                token, closing = "/*", "*/"
+            elif token == "?":
+                token = placeholder
+        elif query.startswith(closing, i):
+            token, closing = closing, None
+        i += 1 if token == placeholder else len(token)
+        compiled.append("%%" if token == "%" else token)
+    return "".join(compiled)
+
+
+def transpile_script(sql_script: str, dialect: str) -> List[str]:
+    """Transpiles a SQLite script into statements of another dialect.
+
+    Transpiling is slow, so results are cached in memory and on disk in
+    `SQL_TRANSPILE_CACHE_DIR`, keyed by the hash of the script and the dialect.
+    A script is only transpiled again when its content changes.
+
+    Args:
+        sql_script (str): The script, written in the SQLite dialect.
+        dialect (str): The database dialect, as returned by `URL.get_backend_name`.
+
+    Returns:
+        List[str]: The statements of the script, in the target dialect.
+    """
+    script_hash = hashlib.sha256(sql_script.encode("utf-8")).hexdigest()
+    cache_key = (script_hash, dialect)
+    if cache_key in _TRANSPILED_SCRIPTS:
+        return _TRANSPILED_SCRIPTS[cache_key]
+
+    cache_file = None
+    if SQL_TRANSPILE_CACHE_DIR:
+        cache_file = Path(SQL_TRANSPILE_CACHE_DIR) / f"{script_hash}.{dialect}.json"
+    statements = None
+    if cache_file and cache_file.exists():
+        try:
+            statements = json.loads(cache_file.read_text())
+        except (OSError, ValueError) as e:
+            get_logger().warning(
+                f"Ignoring unreadable transpile cache {cache_file}: {e}"
+            )
+
+    if statements is None:
+        statements = sqlglot.transpile(
+            sql_script, read="sqlite", write=SQLGLOT_DIALECTS.get(dialect, dialect)
+        )
+        if cache_file:
+            try:
+                cache_file.parent.mkdir(parents=True, exist_ok=True)
+                tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+                tmp_file.write_text(json.dumps(statements))
+                tmp_file.replace(cache_file)
+            except OSError as e:
+                get_logger().warning(f"Could not persist transpile cache: {e}")
+
+    _TRANSPILED_SCRIPTS[cache_key] = statements
+    return statements
 
 
 class Database:
@@ -26,26 +145,25 @@ class Database:
         url (URL): The parsed URL object of the connection string.
         pool (PooledDB): The connection pool for database connections.
         conn (Connection): The current database connection.
+        dialect (str): The database dialect, used to compile the queries.
         DIALECT_PLACEHOLDERS (dict): Mapping of database dialects to their placeholder
             symbols.
     """
 
-    DIALECT_PLACEHOLDERS = {
-        "sqlite": "?",
-        "postgresql": "%s",
-        "mysql": "%s",
-    }
+    DIALECT_PLACEHOLDERS = DIALECT_PLACEHOLDERS
 
     def __init__(self, connection_string: str = None, logger: Logger = None):
         self.connection_string = connection_string or DATABASE_URL
         self.logger = logger or get_logger()
 
         self.url = make_url(self.connection_string)
+        self.dialect = self.url.get_backend_name()
 
-        self.logger.debug("Creating connection pool")
-        global POOL
-        POOL = POOL or self._create_pool()  # Makes the pool a singleton
-        self.pool = POOL
+        if self.connection_string not in POOLS:
+            self.logger.debug("Creating connection pool")
+            # Makes the pool a singleton per database
+            POOLS[self.connection_string] = self._create_pool()
+        self.pool = POOLS[self.connection_string]
         self.conn = None
 
     def __enter__(self) -> "Database":
@@ -74,9 +192,26 @@ class Database:
     def execute(self, query: str, params: Optional[tuple] = None) -> Any:
         cursor = self.conn.cursor()
         try:
-            query = query.replace("?", self.DIALECT_PLACEHOLDERS[self.url.drivername])
-            self.logger.debug(f"Executing query: {query}")
-            cursor.execute(query, params or ())
+            self.logger.debug("Executing query: %s", query)
+            if params:
+                cursor.execute(compile_statement(query, self.dialect), params)
+            else:
+                cursor.execute(query)
+            return cursor
+        except Exception as e:
+            cursor.close()
+            self.logger.exception("Query execution failed", exc_info=e)
+            raise
+
+    def executemany(self, query: str, params_seq: Iterable[tuple]) -> Any:
+        """Runs a query once for each tuple of parameters, in a single driver call.
+
+        Use it for bulk inserts instead of calling `execute` in a loop.
+        """
+        cursor = self.conn.cursor()
+        try:
+            self.logger.debug("Executing query in bulk: %s", query)
+            cursor.executemany(compile_statement(query, self.dialect), list(params_seq))
             return cursor
         except Exception as e:
             cursor.close()
@@ -97,16 +232,70 @@ class Database:
         finally:
             cursor.close()
 
+    def table_exists(self, table: str) -> bool:
+        if self.dialect == "sqlite":
+            query = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?"
+        else:
+            query = "SELECT 1 FROM information_schema.tables WHERE table_name = ?"
+        return self.fetchone(query, (table,)) is not None
+
+    def index_exists(self, table: str, index: str) -> bool:
+        if self.dialect == "sqlite":
+            query = "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?"
+            params = (index,)
+        elif self.dialect == "mysql":
+            query = (
+                "SELECT 1 FROM information_schema.statistics WHERE table_schema ="
+                " DATABASE() AND table_name = ? AND index_name = ?"
+            )
+            params = (table, index)
+        else:
+            query = "SELECT 1 FROM pg_indexes WHERE tablename = ? AND indexname = ?"
+            params = (table, index)
+        return self.fetchone(query, params) is not None
+
+    def create_index(
+        self,
+        table: str,
+        index: str,
+        columns: List[str],
+        prefix_lengths: Optional[Dict[str, int]] = None,
+    ) -> None:
+        """Creates an index on columns of a table, unless it already exists.
+
+        MySQL has no `CREATE INDEX IF NOT EXISTS`, and only indexes the first
+        characters of TEXT columns, whose number is given by `prefix_lengths`.
+        Other dialects ignore them.
+        """
+        if self.dialect != "mysql":
+            quoted_columns = ", ".join(f'"{column}"' for column in columns)
+            self.execute(
+                f'CREATE INDEX IF NOT EXISTS "{index}" ON "{table}" ({quoted_columns})'
+            ).close()
+            return
+
+        if self.index_exists(table, index):
+            return
+        prefix_lengths = prefix_lengths or {}
+        quoted_columns = ", ".join(
+            f"`{column}`"
+            + (f"({prefix_lengths[column]})" if column in prefix_lengths else "")
+            for column in columns
+        )
+        try:
+            self.execute(
+                f"CREATE INDEX `{index}` ON `{table}` ({quoted_columns})"
+            ).close()
+        except Exception:
+            # Another process may have created it since
+            if not self.index_exists(table, index):
+                raise
+
     def initialize_schema(self):
         try:
             self.logger.debug("Initializing database schema")
             sql_script = Path(__file__).parent.joinpath("db_init.sql").read_text()
-            transpiled_sql = sqlglot.transpile(
-                sql_script,
-                read="sqlite",
-                write=self.url.drivername.replace("postgresql", "postgres"),
-            )
-            for statement in transpiled_sql:
+            for statement in transpile_script(sql_script, self.dialect):
                 self.execute(statement)
             self.logger.info(
                 f"Database schema initialized successfully for {self.url.drivername}"
@@ -117,14 +306,9 @@ class Database:
 
     def run_script(self, path: Path):
         try:
-            self.logger.debug(f"Running Database script at {str(path)}")
+            self.logger.debug("Running Database script at %s", path)
             sql_script = path.read_text()
-            transpiled_sql = sqlglot.transpile(
-                sql_script,
-                read="sqlite",
-                write=self.url.drivername.replace("postgresql", "postgres"),
-            )
-            for statement in transpiled_sql:
+            for statement in transpile_script(sql_script, self.dialect):
                 self.execute(statement)
             self.logger.info(
                 f"Successfuly ran script at {path} for {self.url.drivername}"
@@ -136,6 +320,14 @@ class Database:
             )
             raise
 
+    def _pool_kwargs(self) -> dict:
+        return {
+            "maxconnections": DATABASE_POOL_SIZE,
+            "mincached": DATABASE_POOL_MIN_IDLE,
+            "maxcached": DATABASE_POOL_MAX_IDLE,
+            "blocking": True,  # Wait for a free connection instead of failing
+        }
+
     def _create_pool(self) -> PooledDB:
         if self.connection_string.startswith("sqlite:///"):
             import sqlite3
@@ -146,13 +338,14 @@ class Database:
             return PooledDB(
                 creator=sqlite3,
                 database=self.connection_string.replace("sqlite:///", ""),
-                maxconnections=5,
+                check_same_thread=False,  # Pooled connections move between threads
+                **self._pool_kwargs(),
             )
         elif self.connection_string.startswith("postgresql://"):
             import psycopg2
 
             return PooledDB(
-                creator=psycopg2, dsn=self.connection_string, maxconnections=5
+                creator=psycopg2, dsn=self.connection_string, **self._pool_kwargs()
             )
         elif self.connection_string.startswith(
             "mysql://"
@@ -166,7 +359,7 @@ class Database:
                 host=self.url.host,
                 port=self.url.port,
                 database=self.url.database,
-                maxconnections=5,
+                **self._pool_kwargs(),
             )
         elif self.connection_string.startswith("sqlserver://"):
             import pyodbc
@@ -174,7 +367,243 @@ class Database:
             return PooledDB(
                 creator=pyodbc,
                 dsn=self.connection_string.replace("sqlserver://", ""),
-                maxconnections=5,
+                **self._pool_kwargs(),
             )
         else:
             raise ValueError(f"Unsupported database type: {self.url.drivername}")
+
+
+class AsyncConnectionPool:
+    """Pool of connections opened with an async database driver.
+
+    At most `max_size` connections are open at the same time, callers wait up to
+    `acquire_timeout` seconds for one to be released. Between `min_idle` and `max_idle`
+    released connections are kept open for reuse.
+
+    Attributes:
+        connect (Callable): Coroutine function opening a new connection.
+        max_size (int): Maximum number of open connections.
+        min_idle (int): Number of connections opened in advance.
+        max_idle (int): Maximum number of idle connections kept open.
+        acquire_timeout (float): Seconds to wait for a free connection.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], Awaitable[Any]],
+        max_size: int = DATABASE_POOL_SIZE,
+        min_idle: int = DATABASE_POOL_MIN_IDLE,
+        max_idle: int = DATABASE_POOL_MAX_IDLE,
+        acquire_timeout: float = DATABASE_POOL_ACQUIRE_TIMEOUT,
+    ):
+        self.connect = connect
+        self.max_size = max_size
+        self.min_idle = min(min_idle, max_size)
+        self.max_idle = max_idle
+        self.acquire_timeout = acquire_timeout
+
+        self._idle: List[Any] = []
+        self._slots = asyncio.Semaphore(max_size)
+        self._filled = False
+
+    async def acquire(self) -> Any:
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(
+                f"No database connection available after {self.acquire_timeout}s"
+                f" ({self.max_size} connections in use)"
+            )
+        try:
+            if not self._filled:
+                self._filled = True
+                await self._fill()
+            if self._idle:
+                return self._idle.pop()
+            return await self.connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    async def release(self, conn: Any, discard: bool = False) -> None:
+        try:
+            if discard or len(self._idle) >= self.max_idle:
+                await _maybe_await(conn.close())
+            else:
+                self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+    async def close(self) -> None:
+        while self._idle:
+            await _maybe_await(self._idle.pop().close())
+
+    async def _fill(self) -> None:
+        # The slot held by the caller is not counted, it will open its own connection
+        while len(self._idle) < min(self.min_idle, self.max_size - 1):
+            self._idle.append(await self.connect())
+
+
+class AsyncDatabase:
+    """
+    Handles database operations from async code, such as FastAPI handlers.
+
+    It mirrors the `Database` class: connections are borrowed from a pool in an async
+    context manager, committed on success and rolled back on failure, and queries use
+    `?` placeholders whatever the database. It relies on async drivers (aiosqlite,
+    psycopg, aiomysql) so that queries never block the event loop.
+
+    Attributes:
+        connection_string (str): The database connection string.
+        logger (Logger): The logger instance for logging messages.
+        url (URL): The parsed URL object of the connection string.
+        pool (AsyncConnectionPool): The connection pool, shared by every AsyncDatabase
+            of the same database and event loop.
+        conn (Connection): The current database connection.
+    """
+
+    DIALECT_PLACEHOLDERS = DIALECT_PLACEHOLDERS
+
+    def __init__(self, connection_string: str = None, logger: Logger = None):
+        self.connection_string = connection_string or DATABASE_URL
+        self.logger = logger or get_logger()
+        self.url = make_url(self.connection_string)
+        self.dialect = self.url.get_backend_name()
+
+        # Pools are bound to the event loop their connections were opened in
+        pool_key = (self.connection_string, asyncio.get_running_loop())
+        if pool_key not in ASYNC_POOLS:
+            self.logger.debug("Creating async connection pool")
+            ASYNC_POOLS[pool_key] = AsyncConnectionPool(self._connect)
+        self.pool = ASYNC_POOLS[pool_key]
+        self.conn = None
+
+    async def __aenter__(self) -> "AsyncDatabase":
+        self.logger.debug("Getting connection from async pool")
+        self.conn = await self.pool.acquire()
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[type],
+        exc_value: Optional[BaseException],
+        traceback: Optional[Any],
+    ) -> None:
+        if not self.conn:
+            return
+        broken = False
+        try:
+            if exc_type:
+                self.logger.error(
+                    "Transaction failed", exc_info=(exc_type, exc_value, traceback)
+                )
+                await self.conn.rollback()
+            else:
+                await self.conn.commit()
+        except Exception:
+            broken = True
+            raise
+        finally:
+            self.logger.debug("Returning connection to async pool")
+            await self.pool.release(self.conn, discard=broken)
+            self.conn = None
+
+    async def execute(self, query: str, params: Optional[tuple] = None) -> int:
+        """Runs a query and returns the number of affected rows."""
+        cursor = await self._execute(query, params)
+        try:
+            return cursor.rowcount
+        finally:
+            await _maybe_await(cursor.close())
+
+    async def executemany(self, query: str, params_seq: Iterable[tuple]) -> int:
+        """Runs a query once for each tuple of parameters and returns the number of
+        affected rows."""
+        cursor = await _maybe_await(self.conn.cursor())
+        try:
+            self.logger.debug("Executing query in bulk: %s", query)
+            await cursor.executemany(
+                compile_statement(query, self.dialect), list(params_seq)
+            )
+            return cursor.rowcount
+        except Exception as e:
+            self.logger.exception("Query execution failed", exc_info=e)
+            raise
+        finally:
+            await _maybe_await(cursor.close())
+
+    async def fetchone(
+        self, query: str, params: Optional[tuple] = None
+    ) -> Optional[tuple]:
+        cursor = await self._execute(query, params)
+        try:
+            row = await cursor.fetchone()
+            return tuple(row) if row is not None else None
+        finally:
+            await _maybe_await(cursor.close())
+
+    async def fetchall(self, query: str, params: Optional[tuple] = None) -> list:
+        cursor = await self._execute(query, params)
+        try:
+            return [tuple(row) for row in await cursor.fetchall()]
+        finally:
+            await _maybe_await(cursor.close())
+
+    async def _execute(self, query: str, params: Optional[tuple] = None) -> Any:
+        cursor = await _maybe_await(self.conn.cursor())
+        try:
+            self.logger.debug("Executing query: %s", query)
+            if params:
+                await cursor.execute(compile_statement(query, self.dialect), params)
+            else:
+                await cursor.execute(query)
+            return cursor
+        except Exception as e:
+            await _maybe_await(cursor.close())
+            self.logger.exception("Query execution failed", exc_info=e)
+            raise
+
+    async def _connect(self) -> Any:
+        if self.dialect == "sqlite":
+            import aiosqlite
+
+            Path(self.url.database).parent.mkdir(parents=True, exist_ok=True)
+            return await aiosqlite.connect(self.url.database)
+        elif self.dialect == "postgresql":
+            import psycopg
+
+            return await psycopg.AsyncConnection.connect(
+                self.connection_string.replace(
+                    "postgresql+psycopg2://", "postgresql://"
+                )
+            )
+        elif self.dialect == "mysql":
+            import aiomysql
+
+            return await aiomysql.connect(
+                user=self.url.username,
+                password=self.url.password or "",
+                host=self.url.host,
+                port=self.url.port or 3306,
+                db=self.url.database,
+            )
+        else:
+            raise ValueError(f"Unsupported async database type: {self.dialect}")
+
+
+async def close_async_pools() -> None:
+    """Closes the idle connections of the async pools bound to the running event loop.
+
+    Register it as a shutdown handler of the API, some drivers keep a thread per open
+    connection that would otherwise prevent the process from exiting.
+    """
+    loop = asyncio.get_running_loop()
+    for pool_key in [key for key in ASYNC_POOLS if key[1] is loop]:
+        await ASYNC_POOLS.pop(pool_key).close()
+
+
+async def _maybe_await(value: Any) -> Any:
+    # Drivers disagree on which cursor and connection methods are coroutines
+    if inspect.isawaitable(value):
+        return await value
+    return value
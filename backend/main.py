@@ -4,6 +4,11 @@ from fastapi import FastAPI
 from langserve import add_routes
 
 # from backend.api_plugins import authentication_routes, session_routes
+from backend.api_plugins.batch.batch import batch_routes
+from backend.api_plugins.readiness.readiness import readiness_routes
+from backend.api_plugins.tenancy.tenancy import tenant_dependency, with_tenant
+from backend.database import close_async_pools
+from backend.rag_components.chat_message_history import close_write_buffers
 from backend.rag_components.rag import RAG
 
 # Initialize a RAG as discribed in the config.yaml file
@@ -18,4 +23,10 @@ app = FastAPI(
     title="RAG Accelerator",
     description="A RAG-based question answering API",
 )
-add_routes(app, chain)
+app.add_event_handler("shutdown", close_async_pools)
+app.add_event_handler("shutdown", close_write_buffers)
+# Routes queries to the indexes of their tenant, when tenancy is enabled
+tenant = tenant_dependency(rag)
+add_routes(app, chain, dependencies=[tenant], per_req_config_modifier=with_tenant)
+batch_routes(app, rag, dependencies=[tenant])
+readiness_routes(app, rag)
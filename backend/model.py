@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import List, Union
+from typing import List, Optional, Union
 from uuid import uuid4
 
 from pydantic import BaseModel, Field
@@ -15,6 +15,7 @@ class Message(BaseModel):
 
 class Input(BaseModel):
     question: str
+    filter: Optional[dict] = None  # Restricts the documents retrieved, by metadata
 
 
 class InvokeRequest(BaseModel):
@@ -0,0 +1,256 @@
+"""Answers a batch of independent questions with shared embedding and search calls.
+
+Running the chain once per question embeds, searches and answers each of them in its
+own round trips. Here the questions of a batch are embedded in a single call, the
+vector store is searched for all of them at once when it supports it, and the LLM
+calls run concurrently under a concurrency limit. Answers are yielded as soon as
+they complete, and a failing question does not fail the others.
+"""
+
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, AsyncIterator, Dict, List, Optional
+
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableConfig
+from langchain_core.vectorstores import VectorStore
+
+from backend.logger import get_logger
+from backend.rag_components.chain_links.rag_basic import answer_from_documents
+from backend.rag_components.chain_links.retrieve_and_format_docs import (
+    combine_documents,
+)
+from backend.rag_components.context_packing import get_context_packer
+from backend.rag_components.metadata_filter import (
+    combine_filters,
+    get_filter,
+    matches,
+)
+from backend.rag_components.retriever import reciprocal_rank_fusion
+from backend.rag_components.tenancy import get_tenant
+
+if TYPE_CHECKING:
+    from backend.rag_components.rag import RAG
+
+# Search types answered from the question embeddings, others go through the retriever
+SEARCH_TYPES_BY_VECTOR = ("similarity", "similarity_score_threshold")
+
+# Names of the search of one vector returning the scores, depending on the store
+SCORED_SEARCH_BY_VECTOR_METHODS = (
+    "similarity_search_by_vector_with_score",
+    "similarity_search_by_vector_with_relevance_scores",  # Chroma
+    "similarity_search_with_score_by_vector",  # FAISS
+)
+
+
+class BatchAnswerer:
+    """Answers batches of questions from the documents of a RAG.
+
+    Attributes:
+        rag (RAG): The RAG whose embeddings, vector store, lexical index and LLM are
+            used.
+        max_concurrency (int): Maximum number of questions searched or answered at
+            the same time.
+    """
+
+    def __init__(self, rag: "RAG", max_concurrency: Optional[int] = None):
+        self.rag = rag
+        self.max_concurrency = max_concurrency or rag.config.batch.max_concurrency
+        self.logger = get_logger()
+        self.answer_chain = answer_from_documents(rag.llm)
+        self.context_packer = get_context_packer(rag.config)
+
+    async def astream(
+        self,
+        questions: List[str],
+        config: Optional[RunnableConfig] = None,
+        filters: Optional[List[Optional[dict]]] = None,
+    ) -> AsyncIterator[dict]:
+        """Answers the questions, yielding `{"index", "output"}` or `{"index",
+        "error"}` for each of them in the order they complete.
+
+        The documents of a question are retrieved among those matching its filter in
+        `filters`, and the filter of the config, if any. They are retrieved from the
+        indexes of the tenant of the config, if any.
+        """
+        filters = [
+            combine_filters(get_filter(config), filter)
+            for filter in filters or [None] * len(questions)
+        ]
+        try:
+            documents = await asyncio.to_thread(
+                self.retrieve, questions, filters, get_tenant(config)
+            )
+        except Exception as e:
+            self.logger.exception("Batch retrieval failed", exc_info=e)
+            for index in range(len(questions)):
+                yield {"index": index, "error": str(e)}
+            return
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def answer(index: int) -> dict:
+            if isinstance(documents[index], Exception):
+                return {"index": index, "error": str(documents[index])}
+            if self.context_packer is None:
+                context = combine_documents(documents[index])
+            else:
+                context = self.context_packer.pack(documents[index]).text
+            async with semaphore:
+                try:
+                    response = await self.answer_chain.ainvoke(
+                        {"question": questions[index], "relevant_documents": context},
+                        config,
+                    )
+                except Exception as e:
+                    self.logger.warning(f"Batch question {index} failed: {e}")
+                    return {"index": index, "error": str(e)}
+            return {"index": index, "output": getattr(response, "content", response)}
+
+        for result in asyncio.as_completed([answer(i) for i in range(len(questions))]):
+            yield await result
+
+    def retrieve(
+        self,
+        questions: List[str],
+        filters: Optional[List[Optional[dict]]] = None,
+        tenant: Optional[str] = None,
+    ) -> List[List[Document] | Exception]:
+        """Fetches the documents of every question, among those of the tenant and
+        matching its filter if any, or the error that prevented it."""
+        filters = filters or [None] * len(questions)
+        search_type = self.rag.config.vector_store.retriever_search_type
+        reranker = self.rag.reranker
+        if reranker is None and search_type not in SEARCH_TYPES_BY_VECTOR:
+            # Such as "mmr", searched by the retriever of the chain
+            return self._retrieve_one_by_one(questions, filters, tenant)
+
+        vector_store, lexical_index = self.rag.get_indexes(tenant)
+        vector_config = self.rag.config.vector_store.retriever_config
+        hybrid_config = self.rag.config.hybrid_search
+        k = vector_config.get("k", 4)
+        if reranker is not None:
+            k = self.rag.config.rerank.fetch_k  # Candidates for the cross-encoder
+        final_k = k if reranker is not None else hybrid_config.k
+        if hybrid_config.enabled:
+            k = max(hybrid_config.fetch_k, k)  # Candidates for the fusion
+        score_threshold = None
+        if reranker is None and search_type == "similarity_score_threshold":
+            score_threshold = vector_config.get("score_threshold")
+
+        vectors = self.rag.embeddings.embed_documents(questions)
+        # Questions with the same filter are searched together
+        groups: Dict[str, List[int]] = {}
+        for index, filter in enumerate(filters):
+            groups.setdefault(json.dumps(filter, sort_keys=True), []).append(index)
+        results: List[List[Document] | Exception] = [[] for _ in questions]
+        for indexes in groups.values():
+            group_results = search_by_vectors(
+                vector_store,
+                [vectors[index] for index in indexes],
+                k,
+                score_threshold,
+                self.max_concurrency,
+                combine_filters(vector_config.get("filter"), filters[indexes[0]]),
+            )
+            for index, documents in zip(indexes, group_results):
+                results[index] = documents
+        if hybrid_config.enabled and lexical_index is not None:
+            for index, question in enumerate(questions):
+                if isinstance(results[index], Exception):
+                    continue
+                lexical_results = [
+                    doc
+                    for doc, _ in lexical_index.search(question, k)
+                    if matches(doc.metadata, filters[index])
+                ]
+                results[index] = reciprocal_rank_fusion(
+                    [results[index], lexical_results],
+                    hybrid_config.rrf_k,
+                )[:final_k]
+        if reranker is not None:
+            for index, question in enumerate(questions):
+                if isinstance(results[index], Exception):
+                    continue
+                try:
+                    results[index] = reranker.rerank(question, results[index])
+                except Exception as e:
+                    results[index] = e
+        return results
+
+    def _retrieve_one_by_one(
+        self,
+        questions: List[str],
+        filters: List[Optional[dict]],
+        tenant: Optional[str] = None,
+    ) -> List[List[Document] | Exception]:
+        if tenant is None:
+            retriever = self.rag.retriever
+        else:
+            retriever = self.rag.tenants.get(tenant).retriever
+
+        def retrieve_one(index: int) -> List[Document] | Exception:
+            try:
+                return retriever.invoke(questions[index], filter=filters[index])
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            return list(executor.map(retrieve_one, range(len(questions))))
+
+
+def search_by_vectors(
+    vector_store: VectorStore,
+    vectors: List[List[float]],
+    k: int,
+    score_threshold: Optional[float] = None,
+    max_concurrency: int = 8,
+    filter: Optional[dict] = None,
+) -> List[List[Document] | Exception]:
+    """Searches the `k` nearest documents of several vectors, among those matching
+    the metadata filter if given.
+
+    Vector stores that search several vectors at once, such as LocalVectorStore, do
+    it in one call. Others are searched once per vector, concurrently. Documents are
+    only dropped under `score_threshold` by stores returning the scores.
+    """
+    search_kwargs = {"filter": filter} if filter else {}
+    if score_threshold is not None:
+        relevance = vector_store._select_relevance_score_fn()
+
+    def keep(results) -> List[Document]:
+        return [
+            document
+            for document, score in results
+            if score_threshold is None or relevance(score) >= score_threshold
+        ]
+
+    if hasattr(vector_store, "similarity_search_by_vectors_with_score"):
+        batch_results = vector_store.similarity_search_by_vectors_with_score(
+            vectors, k, **search_kwargs
+        )
+        return [keep(results) for results in batch_results]
+
+    # Chroma and FAISS name it differently, and return distances as the others do
+    search = next(
+        (
+            getattr(vector_store, name)
+            for name in SCORED_SEARCH_BY_VECTOR_METHODS
+            if hasattr(vector_store, name)
+        ),
+        None,
+    )
+
+    def search_one(vector: List[float]) -> List[Document] | Exception:
+        try:
+            if search is None or score_threshold is None:
+                return vector_store.similarity_search_by_vector(
+                    vector, k, **search_kwargs
+                )
+            return keep(search(vector, k, **search_kwargs))
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        return list(executor.map(search_one, vectors))
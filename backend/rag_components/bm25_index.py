@@ -0,0 +1,523 @@
+"""On-disk inverted index searched with BM25, the lexical half of hybrid retrieval.
+
+Dense embeddings retrieve product codes, references and rare names badly. This index
+matches the exact terms of the query instead. It is made of immutable segments, each
+mapping its terms to posting lists stored as NumPy arrays. Documents are buffered in
+memory and in a log, and flushed as a new segment, and segments of the same size are
+merged once there are enough of them. The text and metadata of the documents are
+stored along, so that results do not depend on the vector store.
+"""
+
+import json
+import math
+import os
+import re
+import shutil
+import uuid
+from collections import Counter
+from pathlib import Path
+from threading import RLock
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from backend.logger import get_logger
+
+# Words, and compounds such as product codes or versions ("XK-200", "v1.2.3")
+TOKEN_PATTERN = re.compile(r"\w+(?:[-./:]\w+)*")
+COMPOUND_SEPARATORS = re.compile(r"[-./:]")
+
+# Term frequencies are stored as uint16
+MAX_TERM_FREQUENCY = np.iinfo(np.uint16).max
+
+# Approximate size of an entry of the in-memory term and id dictionaries
+_BYTES_PER_TERM = 120
+
+
+def tokenize(text: str) -> List[str]:
+    """Splits a text into lowercase terms. Compounds are indexed whole, joined, and as
+    their parts, so that "XK-200" matches "xk-200", "XK200" and "XK 200"."""
+    terms = []
+    for match in TOKEN_PATTERN.finditer(text.casefold()):
+        term = match.group()
+        terms.append(term)
+        if not term.replace("_", "").isalnum():
+            parts = COMPOUND_SEPARATORS.split(term)
+            terms.append("".join(parts))
+            terms.extend(parts)
+    return terms
+
+
+class Segment:
+    """Immutable posting lists of a contiguous range of document numbers.
+
+    Attributes:
+        path (Path): Directory holding the arrays of the segment.
+        base (int): First document number of the segment.
+        num_docs (int): Number of document numbers covered by the segment.
+    """
+
+    def __init__(self, path: Path, base: int, num_docs: int):
+        self.path = path
+        self.base = base
+        self.num_docs = num_docs
+        self.terms: Dict[str, int] = {
+            term: term_id
+            for term_id, term in enumerate(
+                json.loads((path / "terms.json").read_text())
+            )
+        }
+        self.offsets = np.load(path / "offsets.npy", mmap_mode="r")
+        self.docs = np.load(path / "docs.npy", mmap_mode="r")
+        self.frequencies = np.load(path / "frequencies.npy", mmap_mode="r")
+        self.lengths = np.load(path / "lengths.npy", mmap_mode="r")
+
+    def postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        term_id = self.terms.get(term)
+        if term_id is None:
+            return _EMPTY_DOCS, _EMPTY_FREQUENCIES
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        return self.docs[start:end], self.frequencies[start:end]
+
+    @staticmethod
+    def write(
+        path: Path,
+        postings: Dict[str, Tuple[np.ndarray, np.ndarray]],
+        lengths: np.ndarray,
+    ) -> None:
+        """Writes posting lists, holding global document numbers, and the length of
+        every document of the segment."""
+        path.mkdir(parents=True)
+        terms = sorted(postings)
+        sizes = [len(postings[term][0]) for term in terms]
+        offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        docs = [postings[term][0] for term in terms]
+        frequencies = [postings[term][1] for term in terms]
+        (path / "terms.json").write_text(json.dumps(terms))
+        np.save(path / "offsets.npy", offsets)
+        np.save(path / "docs.npy", np.concatenate(docs or [_EMPTY_DOCS]))
+        np.save(
+            path / "frequencies.npy",
+            np.concatenate(frequencies or [_EMPTY_FREQUENCIES]),
+        )
+        np.save(path / "lengths.npy", lengths.astype(np.int32))
+
+
+_EMPTY_DOCS = np.zeros(0, dtype=np.int32)
+_EMPTY_FREQUENCIES = np.zeros(0, dtype=np.uint16)
+
+
+class BM25Index:
+    """Segmented inverted index of documents, searched with BM25.
+
+    Documents are numbered in the order they are flushed. Their text and metadata are
+    appended to a records file, and `segments.json` lists the segments covering them;
+    replacing it commits a flush or a merge. Deleted documents are appended to a
+    tombstone file, skipped by the searches, and their postings are dropped by the
+    merge of their segment.
+
+    Flushed segments are of level 0. Once the newest `merge_factor` segments are of
+    the same level, they are merged in one segment of the next level, so that every
+    document is rewritten once per level rather than by every merge.
+
+    Buffered documents are not searched, but they are appended to `buffer.jsonl` as
+    they are added, so that those of a writer that crashed before flushing them are
+    not lost: the next writer replays the log, and the next flush indexes them.
+
+    Only one process should write to an index at a time, any number can search it.
+
+    Attributes:
+        path (Path): Directory of the index.
+        k1 (float): Term frequency saturation of BM25.
+        b (float): Document length normalization of BM25.
+        max_buffered_documents (int): Documents buffered before a segment is flushed.
+        merge_factor (int): Number of segments of the same level merged together.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        k1: float = 1.2,
+        b: float = 0.75,
+        max_buffered_documents: int = 10_000,
+        merge_factor: int = 8,
+    ):
+        self.path = Path(path)
+        self.k1 = k1
+        self.b = b
+        self.max_buffered_documents = max_buffered_documents
+        self.merge_factor = merge_factor
+        self.logger = get_logger()
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        for name in ("records.jsonl", "offsets.bin", "deleted.bin", "buffer.jsonl"):
+            (self.path / name).touch()
+        self._lock = RLock()
+        self._buffer: Optional[Dict[str, Document]] = None  # Loaded by the writer only
+        self._version = None
+        self._segments: List[Segment] = []
+        self._num_docs = 0
+        self._total_length = 0
+        self._offsets = np.zeros(0, dtype=np.int64)
+        self._deleted = np.zeros(0, dtype=bool)
+        self._doc_by_id: Optional[Dict[str, int]] = None  # Loaded by the writer only
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return int(self._num_docs - self._deleted.sum())
+
+    def memory_usage(self) -> int:
+        """Estimates the bytes held by the mapped segments, their terms, and the
+        buffered documents."""
+        with self._lock:
+            usage = self._offsets.nbytes + self._deleted.nbytes
+            for segment in self._segments:
+                arrays = (
+                    segment.offsets,
+                    segment.docs,
+                    segment.frequencies,
+                    segment.lengths,
+                )
+                usage += sum(array.nbytes for array in arrays)
+                usage += len(segment.terms) * _BYTES_PER_TERM
+            usage += sum(
+                len(document.page_content) for document in (self._buffer or {}).values()
+            )
+            if self._doc_by_id is not None:
+                usage += len(self._doc_by_id) * _BYTES_PER_TERM
+            return usage
+
+    def add_documents(self, documents: List[Document], ids: List[str]) -> None:
+        """Buffers documents, replacing those with the same ids once flushed."""
+        with self._lock:
+            buffer = self._get_buffer()
+            records = [
+                {
+                    "id": str(id_),
+                    "text": document.page_content,
+                    "metadata": document.metadata,
+                }
+                for document, id_ in zip(documents, ids)
+            ]
+            self._append_to_log(records)
+            for document, record in zip(documents, records):
+                buffer[record["id"]] = document
+            if len(buffer) >= self.max_buffered_documents:
+                self.flush()
+
+    def delete(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            self._refresh()
+            doc_by_id = self._get_doc_by_id()
+            buffer = self._get_buffer()
+            ids = list(map(str, ids))
+            self._append_to_log(
+                [{"id": id_, "deleted": True} for id_ in ids if id_ in buffer]
+            )
+            docs = []
+            for id_ in ids:
+                buffer.pop(id_, None)
+                if id_ in doc_by_id:
+                    docs.append(doc_by_id.pop(id_))
+            if docs:
+                with (self.path / "deleted.bin").open("ab") as file:
+                    file.write(np.asarray(docs, dtype=np.int64).tobytes())
+                self._refresh()
+
+    def flush(self) -> None:
+        """Writes the buffered documents as a new segment."""
+        with self._lock:
+            if not self._get_buffer():
+                # Documents of the log may all have been deleted since
+                (self.path / "buffer.jsonl").open("wb").close()
+                return
+            self._refresh()
+            doc_by_id = self._get_doc_by_id()
+            replaced = [doc_by_id[id_] for id_ in self._buffer if id_ in doc_by_id]
+            if replaced:
+                with (self.path / "deleted.bin").open("ab") as file:
+                    file.write(np.asarray(replaced, dtype=np.int64).tobytes())
+
+            base = self._num_docs
+            postings: Dict[str, List[Tuple[int, int]]] = {}
+            lengths = []
+            with (self.path / "records.jsonl").open("ab") as records:
+                # Records of a flush that was interrupted were never committed
+                records.truncate(self._records_size())
+                offset = records.tell()
+                offsets = []
+                for doc, (id_, document) in enumerate(self._buffer.items(), base):
+                    terms = Counter(tokenize(document.page_content))
+                    for term, frequency in terms.items():
+                        postings.setdefault(term, []).append((doc, frequency))
+                    lengths.append(sum(terms.values()))
+                    line = json.dumps(
+                        {
+                            "id": id_,
+                            "text": document.page_content,
+                            "metadata": document.metadata,
+                        }
+                    ).encode("utf-8")
+                    records.write(line + b"\n")
+                    offsets.append(offset)
+                    offset += len(line) + 1
+            with (self.path / "offsets.bin").open("ab") as file:
+                file.truncate(base * 8)
+                file.write(np.asarray(offsets, dtype=np.int64).tobytes())
+
+            segment_name = f"segment-{uuid.uuid4().hex}"
+            Segment.write(
+                self.path / segment_name,
+                {
+                    term: (
+                        np.asarray([doc for doc, _ in pairs], dtype=np.int32),
+                        np.minimum(
+                            [frequency for _, frequency in pairs], MAX_TERM_FREQUENCY
+                        ).astype(np.uint16),
+                    )
+                    for term, pairs in postings.items()
+                },
+                np.asarray(lengths),
+            )
+            manifest = self._read_manifest()
+            manifest["segments"].append(
+                {
+                    "name": segment_name,
+                    "base": base,
+                    "num_docs": len(lengths),
+                    "level": 0,
+                }
+            )
+            manifest["num_docs"] = base + len(lengths)
+            manifest["total_length"] += int(sum(lengths))
+            self._write_manifest(manifest)
+
+            for doc, id_ in enumerate(self._buffer, base):
+                doc_by_id[id_] = doc
+            self._buffer = {}
+            # Documents of the log replayed after a crash here are flushed again, and
+            # replace the copies flushed now
+            (self.path / "buffer.jsonl").open("wb").close()
+            self._refresh()
+            while True:
+                levels = [
+                    segment.get("level", 0)
+                    for segment in self._read_manifest()["segments"]
+                ]
+                tail = levels[-self.merge_factor :]
+                if len(tail) < max(self.merge_factor, 2) or len(set(tail)) > 1:
+                    break
+                self._merge_segments(len(levels) - len(tail))
+
+    def merge(self) -> None:
+        """Merges all the segments in one, without the postings of deleted documents."""
+        with self._lock:
+            self._refresh()
+            if len(self._segments) >= 2:
+                self._merge_segments(0)
+
+    def _merge_segments(self, start: int) -> None:
+        """Merges the segments from the `start`-th to the newest in one."""
+        segments = self._segments[start:]
+        terms = set()
+        for segment in segments:
+            terms.update(segment.terms)
+        postings = {}
+        for term in terms:
+            docs, frequencies = zip(*(segment.postings(term) for segment in segments))
+            docs, frequencies = np.concatenate(docs), np.concatenate(frequencies)
+            live = ~self._deleted[docs]
+            if live.any():
+                postings[term] = (docs[live], frequencies[live])
+        lengths = np.concatenate([np.asarray(segment.lengths) for segment in segments])
+
+        segment_name = f"segment-{uuid.uuid4().hex}"
+        Segment.write(self.path / segment_name, postings, lengths)
+        manifest = self._read_manifest()
+        merged = manifest["segments"][start:]
+        old_segments = [segment["name"] for segment in merged]
+        level = max(segment.get("level", 0) for segment in merged)
+        manifest["segments"][start:] = [
+            {
+                "name": segment_name,
+                "base": segments[0].base,
+                "num_docs": len(lengths),
+                "level": level + 1,
+            }
+        ]
+        self._write_manifest(manifest)
+        self.logger.info(f"Merged {len(old_segments)} lexical index segments in one")
+        self._refresh()
+        # Segments stay readable by other processes until they reload
+        for name in old_segments:
+            shutil.rmtree(self.path / name, ignore_errors=True)
+
+    def document_frequency(self, term: str) -> int:
+        """Number of flushed documents containing the term, deleted ones excluded."""
+        with self._lock:
+            self._refresh()
+            postings = [segment.postings(term) for segment in self._segments]
+            return sum(self._count_live(docs) for docs, _ in postings)
+
+    def search(self, query: str, k: int = 4) -> List[Tuple[Document, float]]:
+        """Returns the `k` documents with the highest BM25 score for the query."""
+        with self._lock:
+            self._refresh()
+            terms = set(tokenize(query))
+            if not terms or not self._segments:
+                return []
+
+            num_live_docs = max(self._num_docs - int(self._deleted.sum()), 1)
+            average_length = self._total_length / max(self._num_docs, 1)
+            postings = {
+                term: [segment.postings(term) for segment in self._segments]
+                for term in terms
+            }
+            idf = {}
+            for term, segment_postings in postings.items():
+                # Over the live documents, as the number of documents
+                frequency = sum(self._count_live(docs) for docs, _ in segment_postings)
+                idf[term] = math.log(
+                    1 + (num_live_docs - frequency + 0.5) / (frequency + 0.5)
+                )
+
+            best_docs, best_scores = [], []
+            for i, segment in enumerate(self._segments):
+                scores = np.zeros(segment.num_docs, dtype=np.float32)
+                for term, segment_postings in postings.items():
+                    docs, frequencies = segment_postings[i]
+                    if not len(docs):
+                        continue
+                    local_docs = docs - segment.base
+                    frequencies = frequencies.astype(np.float32)
+                    lengths = segment.lengths[local_docs] / average_length
+                    norms = self.k1 * (1 - self.b + self.b * lengths)
+                    weights = idf[term] * frequencies * (self.k1 + 1)
+                    weights /= frequencies + norms
+                    scores += np.bincount(
+                        local_docs, weights=weights, minlength=segment.num_docs
+                    ).astype(np.float32)
+                deleted = self._deleted[segment.base : segment.base + segment.num_docs]
+                scores[deleted] = 0
+                candidates = np.flatnonzero(scores > 0)
+                if len(candidates) > k:
+                    top = np.argpartition(-scores[candidates], k - 1)[:k]
+                    candidates = candidates[top]
+                best_docs.extend(candidates + segment.base)
+                best_scores.extend(scores[candidates])
+
+            order = np.argsort(-np.asarray(best_scores))[:k]
+            docs = [int(best_docs[i]) for i in order]
+            return list(
+                zip(self._read_documents(docs), (float(best_scores[i]) for i in order))
+            )
+
+    def _count_live(self, docs: np.ndarray) -> int:
+        return int(np.count_nonzero(~self._deleted[docs]))
+
+    def _read_documents(self, docs: List[int]) -> List[Document]:
+        documents = []
+        with (self.path / "records.jsonl").open("rb") as file:
+            for doc in docs:
+                file.seek(self._offsets[doc])
+                record = json.loads(file.readline())
+                documents.append(
+                    Document(
+                        page_content=record["text"],
+                        metadata=record["metadata"],
+                        id=record["id"],
+                    )
+                )
+        return documents
+
+    def _get_doc_by_id(self) -> Dict[str, int]:
+        if self._doc_by_id is None:
+            live_docs = np.flatnonzero(~self._deleted)
+            self._doc_by_id = {
+                document.id: int(doc)
+                for doc, document in zip(live_docs, self._read_documents(live_docs))
+            }
+        return self._doc_by_id
+
+    def _get_buffer(self) -> Dict[str, Document]:
+        if self._buffer is None:
+            self._buffer = {}
+            with (self.path / "buffer.jsonl").open("rb+") as file:
+                for line in iter(file.readline, b""):
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Last line of a writer that crashed while appending it
+                        file.truncate(file.tell() - len(line))
+                        break
+                    if record.get("deleted"):
+                        self._buffer.pop(record["id"], None)
+                    else:
+                        self._buffer[record["id"]] = Document(
+                            page_content=record["text"], metadata=record["metadata"]
+                        )
+            if self._buffer:
+                self.logger.info(
+                    f"Replayed {len(self._buffer)} unflushed documents of {self.path}"
+                )
+        return self._buffer
+
+    def _append_to_log(self, records: List[dict]) -> None:
+        if records:
+            lines = b"".join(
+                json.dumps(record).encode("utf-8") + b"\n" for record in records
+            )
+            with (self.path / "buffer.jsonl").open("ab") as file:
+                file.write(lines)
+
+    def _records_size(self) -> int:
+        if not self._num_docs:
+            return 0
+        with (self.path / "records.jsonl").open("rb") as file:
+            file.seek(self._offsets[self._num_docs - 1])
+            return file.tell() + len(file.readline())
+
+    def _read_manifest(self) -> dict:
+        manifest_path = self.path / "segments.json"
+        if not manifest_path.exists():
+            return {"segments": [], "num_docs": 0, "total_length": 0}
+        return json.loads(manifest_path.read_text())
+
+    def _write_manifest(self, manifest: dict) -> None:
+        manifest_tmp = self.path / f"segments.json.{os.getpid()}.tmp"
+        manifest_tmp.write_text(json.dumps(manifest))
+        manifest_tmp.replace(self.path / "segments.json")
+
+    def _refresh(self) -> None:
+        """Loads the segments and deletions written since the last refresh."""
+        manifest_path = self.path / "segments.json"
+        if not manifest_path.exists():
+            return
+        version = (
+            manifest_path.stat().st_mtime_ns,
+            (self.path / "deleted.bin").stat().st_size,
+        )
+        if version == self._version:
+            return
+
+        manifest = self._read_manifest()
+        loaded = {segment.path.name: segment for segment in self._segments}
+        self._segments = [
+            loaded.get(segment["name"])
+            or Segment(
+                self.path / segment["name"], segment["base"], segment["num_docs"]
+            )
+            for segment in manifest["segments"]
+        ]
+        self._num_docs = manifest["num_docs"]
+        self._total_length = manifest["total_length"]
+        if len(self._offsets) != self._num_docs:
+            self._offsets = np.fromfile(
+                self.path / "offsets.bin", dtype=np.int64, count=self._num_docs
+            )
+        self._deleted = np.zeros(self._num_docs, dtype=bool)
+        deleted_docs = np.fromfile(self.path / "deleted.bin", dtype=np.int64)
+        self._deleted[deleted_docs[deleted_docs < self._num_docs]] = True
+        self._version = version
@@ -4,9 +4,13 @@ conversation history"""
 from langchain_core.retrievers import BaseRetriever
 from pydantic import BaseModel
 
-from backend.rag_components.chain_links.condense_question import condense_question
+from backend.config import CondenseQuestionConfig
 from backend.rag_components.chain_links.documented_runnable import DocumentedRunnable
-from backend.rag_components.chain_links.rag_basic import rag_basic
+from backend.rag_components.chain_links.gated_condense_question import (
+    condense_question_and_fetch_docs,
+)
+from backend.rag_components.chain_links.rag_basic import answer_from_documents
+from backend.rag_components.context_packing import ContextPacker
 
 
 class QuestionWithHistory(BaseModel):
@@ -19,12 +23,18 @@ class Response(BaseModel):
 
 
 def answer_question_from_docs_and_history_chain(
-    llm, retriever: BaseRetriever
+    llm,
+    retriever: BaseRetriever,
+    condense_config: CondenseQuestionConfig = None,
+    condense_llm=None,
+    context_packer: ContextPacker = None,
 ) -> DocumentedRunnable:
-    reformulate_question = condense_question(llm)
-    answer_question = rag_basic(llm, retriever)
+    reformulate_question_and_fetch_docs = condense_question_and_fetch_docs(
+        condense_llm or llm, retriever, condense_config, context_packer
+    )
+    answer_question = answer_from_documents(llm)
 
-    chain = reformulate_question | answer_question
+    chain = reformulate_question_and_fetch_docs | answer_question
     typed_chain = chain.with_types(input_type=QuestionWithHistory, output_type=Response)
 
     return DocumentedRunnable(
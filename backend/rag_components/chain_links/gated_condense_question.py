@@ -0,0 +1,164 @@
+"""This chain rephrases the question with the conversation history only when needed,
+and fetches the documents relevant to the resulting question."""
+
+import re
+from operator import itemgetter
+from typing import Optional
+
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import (
+    RunnableBranch,
+    RunnableConfig,
+    RunnableLambda,
+    RunnablePassthrough,
+)
+from pydantic import BaseModel
+
+from backend.config import CondenseQuestionConfig
+from backend.logger import get_logger
+from backend.rag_components.chain_links.condense_question import condense_question
+from backend.rag_components.chain_links.documented_runnable import DocumentedRunnable
+from backend.rag_components.chain_links.retrieve_and_format_docs import fetch_docs_chain
+from backend.rag_components.context_packing import ContextPacker
+
+# Words that make a question refer to the previous turns of the conversation
+FOLLOW_UP_MARKERS = re.compile(
+    r"\b(it|its|this|that|these|those|they|them|their|he|him|his|she|her|above|"
+    r"previous|earlier|same|also|else|more|again|other|one|ones|what about|how about)"
+    r"\b",
+    re.IGNORECASE,
+)
+
+# Questions shorter than this are too terse to be standalone
+MIN_STANDALONE_WORDS = 5
+
+# Decisions of the gate, reported in the traces
+EMPTY_HISTORY = "empty_history"
+STANDALONE_QUESTION = "standalone_question"
+CONDENSE = "condense"
+
+
+class QuestionWithChatHistory(BaseModel):
+    question: str
+    chat_history: str
+
+
+class QuestionWithDocuments(BaseModel):
+    question: str
+    relevant_documents: str
+
+
+def is_standalone_question(question: str) -> bool:
+    return len(question.split()) >= MIN_STANDALONE_WORDS and not (
+        FOLLOW_UP_MARKERS.search(question)
+    )
+
+
+def condense_question_and_fetch_docs(
+    llm,
+    retriever: BaseRetriever,
+    config: Optional[CondenseQuestionConfig] = None,
+    context_packer: Optional[ContextPacker] = None,
+) -> DocumentedRunnable:
+    """Builds the chain that turns a question and a history into documents.
+
+    A gate first decides whether the question needs to be condensed: it is not when
+    the history is empty, nor when `skip_standalone_questions` is set and the question
+    looks standalone. Otherwise the question is condensed by `llm` while, if
+    `speculative_retrieval` is set, the documents of the raw question are fetched in
+    parallel. They are used if the condensed question turns out to be the same.
+
+    Args:
+        llm: The model condensing the question, usually smaller than the one
+            answering it.
+        retriever (BaseRetriever): Fetches the documents relevant to the question.
+        config (CondenseQuestionConfig): When and how to condense the question.
+        context_packer (ContextPacker): Packs the documents in a token budget, they
+            are all joined if None.
+
+    Returns:
+        DocumentedRunnable: A chain taking a `question` and a `chat_history`, and
+            returning the `question` to answer and its `relevant_documents`.
+    """
+    config = config or CondenseQuestionConfig()
+    logger = get_logger()
+    fetch_docs = fetch_docs_chain(retriever, context_packer)
+
+    def decide(input: dict) -> dict:
+        if not input.get("chat_history"):
+            decision = EMPTY_HISTORY
+        elif config.skip_standalone_questions and is_standalone_question(
+            input["question"]
+        ):
+            decision = STANDALONE_QUESTION
+        else:
+            decision = CONDENSE
+        logger.debug(f"Condense question gate: {decision}")
+        return {**input, "decision": decision}
+
+    gate = RunnableLambda(decide).with_config(run_name="CondenseQuestionGate")
+
+    use_raw_question = RunnablePassthrough.assign(
+        relevant_documents=itemgetter("question") | fetch_docs
+    )
+
+    condense = condense_question(llm)
+    if config.speculative_retrieval:
+
+        def reconcile(input: dict, config: RunnableConfig) -> dict:
+            if _same_question(input["standalone_question"], input["question"]):
+                return _speculation_result(input, hit=True)
+            documents = fetch_docs.invoke(input["standalone_question"], config)
+            return _speculation_result(input, hit=False, documents=documents)
+
+        async def areconcile(input: dict, config: RunnableConfig) -> dict:
+            if _same_question(input["standalone_question"], input["question"]):
+                return _speculation_result(input, hit=True)
+            documents = await fetch_docs.ainvoke(input["standalone_question"], config)
+            return _speculation_result(input, hit=False, documents=documents)
+
+        use_condensed_question = RunnablePassthrough.assign(
+            standalone_question=condense,
+            speculative_documents=itemgetter("question") | fetch_docs,
+        ) | RunnableLambda(reconcile, afunc=areconcile).with_config(
+            run_name="ReconcileSpeculativeRetrieval"
+        )
+    else:
+        use_condensed_question = RunnablePassthrough.assign(
+            standalone_question=condense
+        ) | RunnablePassthrough.assign(
+            question=itemgetter("standalone_question"),
+            relevant_documents=itemgetter("standalone_question") | fetch_docs,
+        )
+
+    chain = gate | RunnableBranch(
+        (lambda input: input["decision"] != CONDENSE, use_raw_question),
+        use_condensed_question,
+    )
+    typed_chain = chain.with_types(
+        input_type=QuestionWithChatHistory, output_type=QuestionWithDocuments
+    )
+    return DocumentedRunnable(
+        typed_chain,
+        chain_name="Condense question if needed and fetch documents",
+        user_doc=__doc__,
+    )
+
+
+def _same_question(question: str, other_question: str) -> bool:
+    def normalize(text: str) -> str:
+        return " ".join(re.sub(r"[^\w\s]", " ", text.casefold()).split())
+
+    return normalize(question) == normalize(other_question)
+
+
+def _speculation_result(
+    input: dict, hit: bool, documents: Optional[str] = None
+) -> dict:
+    get_logger().debug(f"Speculative retrieval {'hit' if hit else 'miss'}")
+    return {
+        "question": input["standalone_question"],
+        "relevant_documents": (input["speculative_documents"] if hit else documents),
+        "decision": input["decision"],
+        "speculative_retrieval_hit": hit,
+    }
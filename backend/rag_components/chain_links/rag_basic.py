@@ -2,11 +2,13 @@
 
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.retrievers import BaseRetriever
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import Runnable, RunnablePassthrough
 from pydantic import BaseModel
 
 from backend.rag_components.chain_links.documented_runnable import DocumentedRunnable
 from backend.rag_components.chain_links.retrieve_and_format_docs import fetch_docs_chain
+from backend.rag_components.context_packing import ContextPacker
+from backend.rag_components.semantic_cache import SemanticCache, SemanticCacheRunnable
 
 prompt = """
 You are a professional document analysis assistant. Your role is to provide accurate, concise responses based strictly on the provided context documents.
@@ -47,19 +49,30 @@ class Response(BaseModel):
     response: str
 
 
-def rag_basic(llm, retriever: BaseRetriever) -> DocumentedRunnable:
-    chain = (
-        {
-            "relevant_documents": fetch_docs_chain(retriever),
-            "question": RunnablePassthrough(input_type=Question),
-        }
-        | ChatPromptTemplate.from_template(prompt)
-        | llm
-    )
+def rag_basic(
+    llm,
+    retriever: BaseRetriever,
+    semantic_cache: SemanticCache = None,
+    streaming=True,
+    context_packer: ContextPacker = None,
+) -> DocumentedRunnable:
+    chain = {
+        "relevant_documents": fetch_docs_chain(retriever, context_packer),
+        "question": RunnablePassthrough(input_type=Question),
+    } | answer_from_documents(llm)
     typed_chain = chain.with_types(input_type=str, output_type=Response)
+    if semantic_cache:
+        typed_chain = SemanticCacheRunnable(
+            typed_chain, cache=semantic_cache, streaming=streaming
+        )
     return DocumentedRunnable(
         typed_chain,
         chain_name="Answer questions from documents stored in a vector store",
         prompt=prompt,
         user_doc=__doc__,
     )
+
+
+def answer_from_documents(llm) -> Runnable:
+    """Answers the `question` of its input from its `relevant_documents`."""
+    return ChatPromptTemplate.from_template(prompt) | llm
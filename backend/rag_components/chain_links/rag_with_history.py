@@ -6,17 +6,29 @@ from backend.rag_components.chain_links.answer_question_from_docs_and_history im
     answer_question_from_docs_and_history_chain,
 )
 from backend.rag_components.chain_links.documented_runnable import DocumentedRunnable
-from backend.rag_components.chat_message_history import get_chat_message_history
+from backend.rag_components.chat_message_history import ChatHistoryStore
+from backend.rag_components.context_packing import get_context_packer
+from backend.rag_components.llm import get_llm_from_config
 
 
 def rag_with_history_chain(
     config: RagConfig, llm, retriever: BaseRetriever
 ) -> DocumentedRunnable:
-    chain = answer_question_from_docs_and_history_chain(llm, retriever)
+    condense_llm = None
+    if config.condense_question.llm:
+        condense_llm = get_llm_from_config(config.condense_question.llm)
+    chain = answer_question_from_docs_and_history_chain(
+        llm,
+        retriever,
+        config.condense_question,
+        condense_llm,
+        context_packer=get_context_packer(config),
+    )
 
+    history_store = ChatHistoryStore(config, llm)
     chain_with_mem = RunnableWithMessageHistory(
         chain,
-        lambda session_id: get_chat_message_history(config, session_id),
+        history_store.get,
         input_messages_key="question",
         history_messages_key="chat_history",
     )
@@ -1,10 +1,20 @@
 """This chain fetches the relevant documents and combines them into a single string."""
 
+from typing import List, Optional
+
 from langchain.schema import format_document
-from langchain_core.prompts import PromptTemplate
+from langchain_core.callbacks.manager import (
+    adispatch_custom_event,
+    dispatch_custom_event,
+)
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from pydantic import BaseModel
 
+from backend.logger import get_logger
 from backend.rag_components.chain_links.documented_runnable import DocumentedRunnable
+from backend.rag_components.context_packing import DOCUMENT_PROMPT, ContextPacker
+from backend.rag_components.metadata_filter import get_filter
 
 prompt = "{page_content}"
 
@@ -17,8 +27,14 @@ class Documents(BaseModel):
     documents: str
 
 
-def fetch_docs_chain(retriever) -> DocumentedRunnable:
-    relevant_documents = retriever | _combine_documents
+def fetch_docs_chain(
+    retriever, context_packer: Optional[ContextPacker] = None
+) -> DocumentedRunnable:
+    retrieve = filtered_retrieval_runnable(retriever)
+    if context_packer is None:
+        relevant_documents = retrieve | combine_documents
+    else:
+        relevant_documents = retrieve | pack_documents_runnable(context_packer)
     typed_chain = relevant_documents.with_types(
         input_type=Question, output_type=Documents
     )
@@ -27,7 +43,44 @@ def fetch_docs_chain(retriever) -> DocumentedRunnable:
     )
 
 
-def _combine_documents(docs, document_separator="\n\n"):
-    document_prompt = PromptTemplate.from_template(template=prompt)
-    doc_strings = [format_document(doc, document_prompt) for doc in docs]
+def filtered_retrieval_runnable(retriever) -> RunnableLambda:
+    """Retrieves the documents of a question, among those matching the metadata
+    filter of the config if any."""
+
+    def retrieve(question: str, config: RunnableConfig) -> List[Document]:
+        return retriever.invoke(question, config, filter=get_filter(config))
+
+    async def aretrieve(question: str, config: RunnableConfig) -> List[Document]:
+        return await retriever.ainvoke(question, config, filter=get_filter(config))
+
+    return RunnableLambda(retrieve, afunc=aretrieve).with_config(
+        run_name="FilteredRetrieval"
+    )
+
+
+def pack_documents_runnable(context_packer: ContextPacker) -> RunnableLambda:
+    """Packs documents in the token budget of `context_packer`.
+
+    What was packed and dropped is logged, and dispatched as a `context_packing`
+    custom event, visible in `astream_events` and in the callbacks.
+    """
+    logger = get_logger()
+
+    def pack(docs: List[Document]) -> str:
+        packed = context_packer.pack(docs)
+        logger.debug({"event": "context_packing", **packed.stats()})
+        dispatch_custom_event("context_packing", packed.stats())
+        return packed.text
+
+    async def apack(docs: List[Document]) -> str:
+        packed = context_packer.pack(docs)
+        logger.debug({"event": "context_packing", **packed.stats()})
+        await adispatch_custom_event("context_packing", packed.stats())
+        return packed.text
+
+    return RunnableLambda(pack, afunc=apack).with_config(run_name="PackContext")
+
+
+def combine_documents(docs, document_separator="\n\n"):
+    doc_strings = [format_document(doc, DOCUMENT_PROMPT) for doc in docs]
     return document_separator.join(doc_strings)
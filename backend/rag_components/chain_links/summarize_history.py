@@ -0,0 +1,47 @@
+"""This chain folds the oldest messages of a conversation into its running summary."""
+
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import PromptTemplate
+from pydantic import BaseModel
+
+from backend.rag_components.chain_links.documented_runnable import DocumentedRunnable
+
+
+class SummaryWithNewLines(BaseModel):
+    summary: str
+    new_lines: str
+
+
+class Summary(BaseModel):
+    summary: str
+
+
+prompt = """\
+Progressively summarize the lines of conversation provided, adding onto the previous \
+summary and returning a new summary. Keep the facts, names, figures and decisions the \
+user may refer to later, in the language of the conversation. Be concise.
+
+Current summary:
+{summary}
+
+New lines of conversation:
+{new_lines}
+
+New summary:
+"""
+
+
+def summarize_history(llm) -> DocumentedRunnable:
+    summarize_prompt = PromptTemplate.from_template(prompt)  # summary, new_lines
+
+    new_summary = summarize_prompt | llm | StrOutputParser()
+
+    typed_chain = new_summary.with_types(
+        input_type=SummaryWithNewLines, output_type=Summary
+    )
+    return DocumentedRunnable(
+        typed_chain,
+        chain_name="Summarize conversation history",
+        prompt=prompt,
+        user_doc=__doc__,
+    )
@@ -1,10 +1,30 @@
+import asyncio
+import atexit
+import time
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime
+from threading import Condition, Lock, Thread
+from typing import Dict, List, Optional, Sequence, Set, Tuple
 
+import numpy as np
 from langchain_community.chat_message_histories import SQLChatMessageHistory
 from langchain_community.chat_message_histories.sql import DefaultMessageConverter
-from sqlalchemy import Column, DateTime, Integer, Text
+from langchain_core.messages import BaseMessage, SystemMessage, get_buffer_string
+from langchain_core.runnables import Runnable
+from sqlalchemy import Column, DateTime, Integer, Text, create_engine, func, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
 
 from backend.config import RagConfig
+from backend.logger import get_logger
+from backend.rag_components.chain_links.summarize_history import summarize_history
+from backend.rag_components.tokenizer import (
+    Tokenizer,
+    count_message_tokens,
+    get_tokenizer,
+)
 
 try:
     from sqlalchemy.orm import declarative_base
@@ -12,20 +32,709 @@ except ImportError:
     from sqlalchemy.ext.declarative import declarative_base
 
 TABLE_NAME = "message_history"
+SUMMARY_TABLE_NAME = "session_summary"
+HISTORY_SUMMARY_TABLE_NAME = "message_history_summary"
 
+# Number of characters of the first message kept in the session summary
+FIRST_MESSAGE_PREVIEW_LENGTH = 200
 
-def get_chat_message_history(config: RagConfig, chat_id):
-    return SQLChatMessageHistory(
-        session_id=chat_id,
-        connection_string=config.database.database_url,
-        table_name=TABLE_NAME,
-        custom_message_converter=TimestampedMessageConverter(TABLE_NAME),
+# Creates the summary of a session or records new messages in it, in a single
+# statement, as the first messages of a session may be added at the same time
+UPSERT_SESSION_SUMMARY_QUERIES = {
+    None: (
+        f"INSERT INTO {SUMMARY_TABLE_NAME} (session_id, first_message, last_activity,"
+        " message_count) VALUES (:session_id, :first_message, :last_activity,"
+        " :message_count) ON CONFLICT (session_id) DO UPDATE SET message_count ="
+        f" {SUMMARY_TABLE_NAME}.message_count + excluded.message_count,"
+        " last_activity = excluded.last_activity, first_message ="
+        f" COALESCE({SUMMARY_TABLE_NAME}.first_message, excluded.first_message)"
+    ),
+    "mysql": (
+        f"INSERT INTO {SUMMARY_TABLE_NAME} (session_id, first_message, last_activity,"
+        " message_count) VALUES (:session_id, :first_message, :last_activity,"
+        " :message_count) ON DUPLICATE KEY UPDATE message_count = message_count +"
+        " VALUES(message_count), last_activity = VALUES(last_activity),"
+        " first_message = COALESCE(first_message, VALUES(first_message))"
+    ),
+}
+
+# Maximum number of messages folded into the rolling summary at once. Older messages
+# of a long conversation summarized for the first time are left out.
+MAX_MESSAGES_PER_SUMMARY = 50
+
+# Rolling summaries are updated by these threads, off the path of the requests
+SUMMARY_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="summary")
+
+# SQLAlchemy engines of the chat histories, one per database, so that histories share
+# a connection pool
+ENGINES: Dict[str, Engine] = {}
+
+# Mapped message classes, one per table
+MESSAGE_MODELS: Dict[str, type] = {}
+_MessageBase = declarative_base()
+
+# Tables whose existence was checked, per database
+_CHECKED_TABLES: Set[Tuple[str, str]] = set()
+
+# Write-behind buffers of the chat histories, one per database
+WRITE_BUFFERS: Dict[str, "HistoryWriteBuffer"] = {}
+
+# Attempts at committing a batch of buffered messages before they are dropped
+MAX_FLUSH_ATTEMPTS = 3
+
+# Number of recent flushes the latency percentiles are computed on
+LATENCY_WINDOW = 1000
+
+
+def get_engine(database_url: str) -> Engine:
+    if database_url not in ENGINES:
+        ENGINES[database_url] = create_engine(database_url)
+    return ENGINES[database_url]
+
+
+def get_message_model(table_name: str) -> type:
+    if table_name not in MESSAGE_MODELS:
+        MESSAGE_MODELS[table_name] = create_message_model(table_name, _MessageBase)
+    return MESSAGE_MODELS[table_name]
+
+
+class ChatHistoryStore:
+    """Hands out the chat histories of the sessions of a chain.
+
+    Histories share the engine of their database and the mapped class of their
+    table, and the most recently used ones are kept, so that a turn of conversation
+    does not create an engine, map a class or check the table again.
+
+    Attributes:
+        config (RagConfig): Database, window and token budget of the histories.
+        summarizer (Runnable): Chain updating the rolling summary of the histories,
+            None if they are not summarized.
+        max_sessions (int): Number of histories kept.
+    """
+
+    def __init__(self, config: RagConfig, llm=None, max_sessions: int = None):
+        self.config = config
+        self.summarizer = None
+        if llm is not None and config.chat_history.summarize:
+            self.summarizer = summarize_history(llm)
+        self.max_sessions = max_sessions or config.chat_history.max_cached_sessions
+        self.engine = get_engine(config.database.database_url)
+        self.converter = TimestampedMessageConverter(TABLE_NAME)
+        self.write_buffer = None
+        if config.chat_history.write_behind:
+            self.write_buffer = get_write_buffer(
+                config.database.database_url,
+                flush_interval_ms=config.chat_history.write_behind_interval_ms,
+                max_batch_size=config.chat_history.write_behind_max_batch_size,
+            )
+        self.tokenizer = get_tokenizer(config.tokenizer)
+        self._histories: OrderedDict[str, WindowedChatMessageHistory] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, session_id: str) -> "WindowedChatMessageHistory":
+        with self._lock:
+            history = self._histories.get(session_id)
+            if history is not None:
+                self._histories.move_to_end(session_id)
+                return history
+
+        history = WindowedChatMessageHistory(
+            session_id=session_id,
+            connection=self.engine,
+            table_name=TABLE_NAME,
+            custom_message_converter=self.converter,
+            window_size=self.config.chat_history_window_size,
+            max_tokens=self.config.chat_history.max_tokens,
+            tokenizer=self.tokenizer,
+            summarizer=self.summarizer,
+            write_buffer=self.write_buffer,
+        )
+        with self._lock:
+            history = self._histories.setdefault(session_id, history)
+            self._histories.move_to_end(session_id)
+            while len(self._histories) > self.max_sessions:
+                self._histories.popitem(last=False)
+        return history
+
+
+class SessionChatMessageHistory(SQLChatMessageHistory):
+    """SQL chat history that keeps the `session_summary` table up to date.
+
+    The summary row of the session is updated in the same transaction as the
+    messages, so that listing sessions never has to scan `message_history`. The async
+    methods run the sync ones in a thread, the history is backed by a sync engine.
+
+    With a `write_buffer`, messages are written behind, batched with those of other
+    sessions. Reading the history waits for the pending messages of the session to
+    be written first.
+    """
+
+    def __init__(
+        self, *args, write_buffer: Optional["HistoryWriteBuffer"] = None, **kwargs
+    ):
+        self.write_buffer = write_buffer
+        super().__init__(*args, **kwargs)
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        self.wait_for_writes()
+        return super().messages
+
+    def wait_for_writes(self) -> None:
+        """Waits for the buffered messages of the session to be written."""
+        if self.write_buffer is not None:
+            self.write_buffer.wait_flushed(self.session_id)
+
+    def _create_table_if_not_exists(self) -> None:
+        # Checked once per table and database, rather than by every history
+        key = (str(self.engine.url), self.sql_model_class.__tablename__)
+        if key not in _CHECKED_TABLES:
+            super()._create_table_if_not_exists()
+            _CHECKED_TABLES.add(key)
+        self._table_created = True
+
+    def add_message(self, message: BaseMessage) -> None:
+        self.add_messages([message])
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        if not messages:
+            return
+        if self.write_buffer is not None:
+            self.write_buffer.add(self.session_id, messages)
+            return
+        with self._make_sync_session() as session:
+            for message in messages:
+                session.add(self.converter.to_sql_model(message, self.session_id))
+            update_session_summary(session, self.session_id, messages)
+            session.commit()
+
+    async def aget_messages(self) -> List[BaseMessage]:
+        return await asyncio.to_thread(self.get_messages)
+
+    async def aadd_message(self, message: BaseMessage) -> None:
+        await asyncio.to_thread(self.add_messages, [message])
+
+    async def aadd_messages(self, messages: Sequence[BaseMessage]) -> None:
+        await asyncio.to_thread(self.add_messages, messages)
+
+    def clear(self) -> None:
+        self.wait_for_writes()
+        with self._make_sync_session() as session:
+            session.query(self.sql_model_class).filter(
+                self.sql_model_class.session_id == self.session_id
+            ).delete()
+            session.execute(
+                text(
+                    f"UPDATE {SUMMARY_TABLE_NAME} SET first_message = NULL,"
+                    " message_count = 0 WHERE session_id = :session_id"
+                ),
+                {"session_id": self.session_id},
+            )
+            session.commit()
+
+    async def aclear(self) -> None:
+        await asyncio.to_thread(self.clear)
+
+
+class WindowedChatMessageHistory(SessionChatMessageHistory):
+    """Chat history that only exposes the recent messages of a conversation.
+
+    Reading the history loads the last `window_size` messages with a `LIMIT` query,
+    preceded by a rolling summary of the older ones, and drops the oldest of them
+    until they fit in `max_tokens`. The summary is updated by the `summarizer` when
+    messages leave the window, and stored in `message_history_summary`, so that the
+    cost of a turn does not depend on the length of the conversation.
+
+    The history counts the messages the summary does not cover yet in memory. Turns
+    that do not push messages out of the window do not touch the database, and the
+    summary is updated in a background thread when they do.
+
+    Attributes:
+        window_size (int): Number of most recent messages returned.
+        max_tokens (int): Token budget of the returned messages, summary included.
+        tokenizer (Tokenizer): Counts the tokens of a text.
+        summarizer (Runnable): Chain taking the current `summary` and the `new_lines`
+            of conversation and returning the new summary, no summary is kept if None.
+    """
+
+    def __init__(
+        self,
+        *args,
+        window_size: int = 5,
+        max_tokens: int = 1000,
+        tokenizer: Tokenizer = None,
+        summarizer: Optional[Runnable] = None,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.window_size = window_size
+        self.max_tokens = max_tokens
+        self.tokenizer = tokenizer or get_tokenizer()
+        self.summarizer = summarizer
+        self.logger = get_logger()
+
+        self._summary_lock = Lock()
+        self._summarizing = False
+        # Messages added by this instance, and messages not covered by the summary,
+        # None until the summary is first checked
+        self._num_added = 0
+        self._num_unsummarized: Optional[int] = None
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        self.wait_for_writes()
+        model = self.sql_model_class
+        with self._make_sync_session() as session:
+            summary = session.execute(
+                text(
+                    f"SELECT summary FROM {HISTORY_SUMMARY_TABLE_NAME} WHERE"
+                    " session_id = :session_id"
+                ),
+                {"session_id": self.session_id},
+            ).scalar()
+            records = (
+                session.query(model)
+                .where(model.session_id == self.session_id)
+                .order_by(model.timestamp.desc(), model.id.desc())
+                .limit(self.window_size)
+                .all()
+            )
+            messages = [self.converter.from_sql_model(record) for record in records]
+
+        if summary:
+            messages.append(
+                SystemMessage(content=f"Summary of the earlier conversation: {summary}")
+            )
+        return self._trim(messages)[::-1]
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        super().add_messages(messages)
+        if self.summarizer is None or not messages:
+            return
+        with self._summary_lock:
+            self._num_added += len(messages)
+            if self._num_unsummarized is not None:
+                self._num_unsummarized += len(messages)
+                if self._num_unsummarized <= self.window_size:
+                    return
+            if self._summarizing:
+                return
+            self._summarizing = True
+        SUMMARY_EXECUTOR.submit(self._summarize)
+
+    def _summarize(self) -> None:
+        """Updates the summary until the messages it does not cover fit in the
+        window, as messages can be added meanwhile."""
+        while True:
+            with self._summary_lock:
+                num_added = self._num_added
+            try:
+                num_unsummarized = self.update_summary()
+            except Exception as e:
+                # The messages are saved, the summary will catch up on the next turn
+                self.logger.warning(f"Failed to summarize chat history: {e}")
+                num_unsummarized = None
+            with self._summary_lock:
+                if num_unsummarized is not None:
+                    # Messages added during the update may be counted twice, which
+                    # only costs another check
+                    num_unsummarized += self._num_added - num_added
+                self._num_unsummarized = num_unsummarized
+                if num_unsummarized is None or num_unsummarized <= self.window_size:
+                    self._summarizing = False
+                    return
+
+    def update_summary(self) -> int:
+        """Folds the messages that left the window into the rolling summary.
+
+        Returns:
+            int: Number of messages not covered by the summary.
+        """
+        self.wait_for_writes()
+        model = self.sql_model_class
+        with self._make_sync_session() as session:
+            row = session.execute(
+                text(
+                    "SELECT summary, summarized_until FROM"
+                    f" {HISTORY_SUMMARY_TABLE_NAME} WHERE session_id = :session_id"
+                ),
+                {"session_id": self.session_id},
+            ).first()
+            summary, summarized_until = row if row else ("", 0)
+            num_unsummarized = (
+                session.query(func.count(model.id))
+                .where(
+                    model.session_id == self.session_id,
+                    model.id > (summarized_until or 0),
+                )
+                .scalar()
+            )
+            if num_unsummarized <= self.window_size:
+                return num_unsummarized
+            # Newest message outside of the window
+            boundary = (
+                session.query(model.id)
+                .where(model.session_id == self.session_id)
+                .order_by(model.timestamp.desc(), model.id.desc())
+                .offset(self.window_size)
+                .limit(1)
+                .scalar()
+            )
+            if boundary is None or boundary <= (summarized_until or 0):
+                return num_unsummarized
+            records = (
+                session.query(model)
+                .where(
+                    model.session_id == self.session_id,
+                    model.id > (summarized_until or 0),
+                    model.id <= boundary,
+                )
+                .order_by(model.id.desc())
+                .limit(MAX_MESSAGES_PER_SUMMARY)
+                .all()
+            )
+            new_messages = [self.converter.from_sql_model(r) for r in records[::-1]]
+
+        # The LLM is called outside of the transaction
+        summary = self.summarizer.invoke(
+            {"summary": summary or "", "new_lines": get_buffer_string(new_messages)}
+        )
+
+        with self._make_sync_session() as session:
+            params = {
+                "session_id": self.session_id,
+                "summary": summary,
+                "summarized_until": boundary,
+                "updated_at": datetime.utcnow().isoformat(),
+            }
+            if row:
+                session.execute(
+                    text(
+                        f"UPDATE {HISTORY_SUMMARY_TABLE_NAME} SET summary = :summary,"
+                        " summarized_until = :summarized_until, updated_at ="
+                        " :updated_at WHERE session_id = :session_id"
+                    ),
+                    params,
+                )
+            else:
+                session.execute(
+                    text(
+                        f"INSERT INTO {HISTORY_SUMMARY_TABLE_NAME} (session_id,"
+                        " summary, summarized_until, updated_at) VALUES (:session_id,"
+                        " :summary, :summarized_until, :updated_at)"
+                    ),
+                    params,
+                )
+            session.commit()
+        return self.window_size
+
+    def clear(self) -> None:
+        super().clear()
+        with self._summary_lock:
+            self._num_unsummarized = None
+        with self._make_sync_session() as session:
+            session.execute(
+                text(
+                    f"DELETE FROM {HISTORY_SUMMARY_TABLE_NAME} WHERE session_id ="
+                    " :session_id"
+                ),
+                {"session_id": self.session_id},
+            )
+            session.commit()
+
+    def _trim(self, messages: List[BaseMessage]) -> List[BaseMessage]:
+        """Keeps the first messages, newest first, that fit in the token budget."""
+        kept, num_tokens = [], 0
+        for message in messages:
+            num_tokens += count_message_tokens([message], self.tokenizer)
+            if num_tokens > self.max_tokens:
+                break
+            kept.append(message)
+        return kept
+
+
+@dataclass
+class _PendingWrite:
+    sequence: int
+    session_id: str
+    messages: Sequence[BaseMessage]
+    timestamp: datetime  # Recorded when added, so that messages keep their order
+    queued_at: float
+    attempts: int = 0
+
+
+class HistoryWriteBuffer:
+    """Writes the messages of chat histories behind, in batched transactions.
+
+    Messages are queued, and a writer thread inserts those of every session in a
+    single transaction once `max_batch_size` of them are waiting or
+    `flush_interval_ms` have passed since the oldest one was queued. Messages are
+    written in the order they were added, and keep the time they were added at.
+    Readers that need the messages of a session call `wait_flushed`, which flushes
+    right away if some are pending.
+
+    A batch that fails to commit is retried, and dropped after `MAX_FLUSH_ATTEMPTS`.
+
+    Attributes:
+        engine (Engine): Engine of the database the messages are written to.
+        converter (BaseMessageConverter): Converts messages to rows.
+        flush_interval_ms (float): Longest time a message waits to be written.
+        max_batch_size (int): Number of waiting messages that triggers a flush.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        converter: DefaultMessageConverter,
+        flush_interval_ms: float = 50,
+        max_batch_size: int = 500,
+    ):
+        self.engine = engine
+        self.converter = converter
+        self.flush_interval_ms = flush_interval_ms
+        self.max_batch_size = max_batch_size
+        self.logger = get_logger()
+
+        self._pending: deque[_PendingWrite] = deque()
+        self._num_pending_messages = 0
+        self._last_sequences: Dict[str, int] = {}  # Last write of each session
+        self._sequence = 0
+        self._flushed_sequence = 0
+        self._flush_requested = False
+        self._closed = False
+        self._condition = Condition()
+        self._writer: Optional[Thread] = None
+
+        self.batch_sizes: Counter = Counter()  # Number of flushes of every size
+        self.max_queue_depth = 0
+        self.dropped_messages = 0
+        self._flush_seconds: deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._delay_seconds: deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    def add(self, session_id: str, messages: Sequence[BaseMessage]) -> None:
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("The history write buffer is closed")
+            if self._writer is None:
+                self._writer = Thread(
+                    target=self._run, name="history-writer", daemon=True
+                )
+                self._writer.start()
+            self._sequence += 1
+            self._pending.append(
+                _PendingWrite(
+                    self._sequence,
+                    session_id,
+                    list(messages),
+                    datetime.utcnow(),
+                    time.perf_counter(),
+                )
+            )
+            self._last_sequences[session_id] = self._sequence
+            self._num_pending_messages += len(messages)
+            self.max_queue_depth = max(self.max_queue_depth, self._num_pending_messages)
+            # The writer waits for the first message, then for the batch to fill
+            if (
+                len(self._pending) == 1
+                or self._num_pending_messages >= self.max_batch_size
+            ):
+                self._condition.notify_all()
+
+    def has_pending(self, session_id: str) -> bool:
+        return session_id in self._last_sequences
+
+    def wait_flushed(self, session_id: Optional[str] = None) -> None:
+        """Flushes and waits until the messages of a session, or all messages, that
+        were added so far are written or dropped."""
+        with self._condition:
+            if session_id is None:
+                sequence = self._sequence
+            else:
+                sequence = self._last_sequences.get(session_id, 0)
+            if sequence <= self._flushed_sequence:
+                return
+            self._flush_requested = True
+            self._condition.notify_all()
+            self._condition.wait_for(lambda: self._flushed_sequence >= sequence)
+
+    def close(self) -> None:
+        """Writes the pending messages and stops the writer thread."""
+        self.wait_flushed()
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._writer is not None:
+            self._writer.join()
+
+    def stats(self) -> dict:
+        num_flushes = sum(self.batch_sizes.values())
+        num_messages = sum(size * count for size, count in self.batch_sizes.items())
+        flush_ms = 1000 * np.array(self._flush_seconds)
+        delay_ms = 1000 * np.array(self._delay_seconds)
+        return {
+            "flushes": num_flushes,
+            "messages": num_messages,
+            "mean_batch_size": num_messages / num_flushes if num_flushes else None,
+            "queue_depth": self._num_pending_messages,
+            "max_queue_depth": self.max_queue_depth,
+            "dropped_messages": self.dropped_messages,
+            "flush_ms_p50": np.percentile(flush_ms, 50) if num_flushes else None,
+            "flush_ms_p99": np.percentile(flush_ms, 99) if num_flushes else None,
+            "write_delay_ms_p50": np.percentile(delay_ms, 50) if num_flushes else None,
+            "write_delay_ms_p99": np.percentile(delay_ms, 99) if num_flushes else None,
+        }
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._closed or self._should_flush(),
+                    timeout=self._timeout(),
+                )
+                if not self._pending and self._closed:
+                    return
+                if not self._should_flush():
+                    continue
+                batch, num_messages = [], 0
+                while self._pending and num_messages < self.max_batch_size:
+                    batch.append(self._pending.popleft())
+                    num_messages += len(batch[-1].messages)
+
+            written = self._write(batch)
+            if not written:
+                time.sleep(self.flush_interval_ms / 1000)  # The database may be busy
+            with self._condition:
+                if not written:
+                    # Put back first, so that the messages of a session stay in order
+                    retried = [w for w in batch if w.attempts < MAX_FLUSH_ATTEMPTS]
+                    self._pending.extendleft(reversed(retried))
+                    num_messages -= sum(len(write.messages) for write in retried)
+                self._num_pending_messages -= num_messages
+                self._mark_flushed()
+                self._condition.notify_all()
+
+    def _should_flush(self) -> bool:
+        if not self._pending:
+            return False
+        if self._flush_requested or self._closed:
+            return True
+        if self._num_pending_messages >= self.max_batch_size:
+            return True
+        age = time.perf_counter() - self._pending[0].queued_at
+        return age >= self.flush_interval_ms / 1000
+
+    def _timeout(self) -> Optional[float]:
+        if not self._pending:
+            return None
+        age = time.perf_counter() - self._pending[0].queued_at
+        return max(self.flush_interval_ms / 1000 - age, 0)
+
+    def _write(self, batch: List[_PendingWrite]) -> bool:
+        started_at = time.perf_counter()
+        messages_by_session: Dict[str, List[BaseMessage]] = {}
+        try:
+            with Session(self.engine) as session:
+                for write in batch:
+                    for message in write.messages:
+                        row = self.converter.to_sql_model(message, write.session_id)
+                        row.timestamp = write.timestamp
+                        session.add(row)
+                    messages_by_session.setdefault(write.session_id, []).extend(
+                        write.messages
+                    )
+                for session_id, messages in messages_by_session.items():
+                    update_session_summary(session, session_id, messages)
+                session.commit()
+        except Exception:
+            for write in batch:
+                write.attempts += 1
+            dropped = [w for w in batch if w.attempts >= MAX_FLUSH_ATTEMPTS]
+            self.dropped_messages += sum(len(w.messages) for w in dropped)
+            self.logger.exception(
+                f"Failed to write {len(batch)} chat history updates,"
+                f" {len(dropped)} of them dropped"
+            )
+            return False
+
+        finished_at = time.perf_counter()
+        num_messages = sum(len(write.messages) for write in batch)
+        self.batch_sizes[num_messages] += 1
+        self._flush_seconds.append(finished_at - started_at)
+        self._delay_seconds.append(finished_at - batch[0].queued_at)
+        return True
+
+    def _mark_flushed(self) -> None:
+        # Every write before the oldest pending one is written or dropped
+        if self._pending:
+            self._flushed_sequence = self._pending[0].sequence - 1
+        else:
+            self._flushed_sequence = self._sequence
+            self._flush_requested = False
+        for session_id in [
+            session_id
+            for session_id, last in self._last_sequences.items()
+            if last <= self._flushed_sequence
+        ]:
+            del self._last_sequences[session_id]
+
+
+def get_write_buffer(database_url: str, **kwargs) -> HistoryWriteBuffer:
+    if database_url not in WRITE_BUFFERS:
+        WRITE_BUFFERS[database_url] = HistoryWriteBuffer(
+            get_engine(database_url), TimestampedMessageConverter(TABLE_NAME), **kwargs
+        )
+    return WRITE_BUFFERS[database_url]
+
+
+async def wait_for_history_writes(session_id: str) -> None:
+    """Waits for the buffered messages of a session to be written, so that they can
+    be read from the database."""
+    for write_buffer in list(WRITE_BUFFERS.values()):
+        if write_buffer.has_pending(session_id):
+            await asyncio.to_thread(write_buffer.wait_flushed, session_id)
+
+
+def close_write_buffers() -> None:
+    """Writes the buffered messages of every history, register it as a shutdown
+    handler of the API."""
+    for write_buffer in list(WRITE_BUFFERS.values()):
+        write_buffer.close()
+
+
+atexit.register(close_write_buffers)
+
+
+def update_session_summary(
+    session, session_id: str, messages: Sequence[BaseMessage]
+) -> None:
+    """Records new messages in the summary of their session.
+
+    Args:
+        session (Session): The SQLAlchemy session in which the messages are added.
+        session_id (str): The id of the conversation.
+        messages (Sequence[BaseMessage]): The messages being added.
+    """
+    params = {
+        "session_id": session_id,
+        "first_message": get_message_preview(messages[0]),
+        "last_activity": datetime.utcnow().isoformat(),
+        "message_count": len(messages),
+    }
+    dialect = session.get_bind().dialect.name
+    query = UPSERT_SESSION_SUMMARY_QUERIES.get(
+        dialect, UPSERT_SESSION_SUMMARY_QUERIES[None]
     )
+    session.execute(text(query), params)
+
+
+def get_message_preview(message: BaseMessage) -> str:
+    content = message.content if isinstance(message.content, str) else ""
+    return content[:FIRST_MESSAGE_PREVIEW_LENGTH]
 
 
 class TimestampedMessageConverter(DefaultMessageConverter):
     def __init__(self, table_name: str):
-        self.model_class = create_message_model(table_name, declarative_base())
+        self.model_class = get_message_model(table_name)
 
 
 def create_message_model(table_name, dynamic_base):
@@ -0,0 +1,212 @@
+"""Packs retrieved documents into a context that fits a token budget.
+
+Retrievers return chunks that overlap, since documents are split with some overlap,
+and that may together exceed the context the prompt can afford. The packer removes
+duplicated and overlapping text, keeps the most relevant chunks first, and adds them
+until the token budget is spent, truncating the last one that does not fit whole.
+"""
+
+import hashlib
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence
+
+from langchain.schema import format_document
+from langchain_core.documents import Document
+from langchain_core.prompts import PromptTemplate
+
+from backend.config import RagConfig
+from backend.rag_components.tokenizer import Tokenizer, get_tokenizer
+
+# Metadata key of the relevance score of a document, higher is more relevant. Set by
+# the stages that score documents, documents without it keep the retriever's order.
+SCORE_METADATA_KEY = "relevance_score"
+
+# Shortest text shared by two chunks of the same source considered an overlap
+MIN_OVERLAP_CHARACTERS = 32
+
+DOCUMENT_PROMPT = PromptTemplate.from_template("{page_content}")
+
+
+@dataclass
+class PackedContext:
+    """A context packed from documents, and what was left out of it.
+
+    Attributes:
+        text (str): The documents packed, joined by the separator.
+        documents (List[Document]): The documents packed, truncated ones included.
+        packed_tokens (int): Number of tokens of `text`.
+        dropped_tokens (int): Number of tokens of the documents, or of the parts of
+            documents, that did not fit in the budget.
+        duplicate_tokens (int): Number of tokens removed as duplicated or overlapping.
+        num_dropped (int): Number of documents that were left out entirely.
+        num_truncated (int): Number of documents that were packed truncated.
+    """
+
+    text: str
+    documents: List[Document] = field(default_factory=list)
+    packed_tokens: int = 0
+    dropped_tokens: int = 0
+    duplicate_tokens: int = 0
+    num_dropped: int = 0
+    num_truncated: int = 0
+
+    def stats(self) -> dict:
+        return {
+            "packed_documents": len(self.documents),
+            "packed_tokens": self.packed_tokens,
+            "dropped_tokens": self.dropped_tokens,
+            "duplicate_tokens": self.duplicate_tokens,
+            "dropped_documents": self.num_dropped,
+            "truncated_documents": self.num_truncated,
+        }
+
+
+class ContextPacker:
+    """Fills a token budget with the most relevant retrieved documents.
+
+    Attributes:
+        max_tokens (int): Token budget of the packed context, separators included.
+        tokenizer (Tokenizer): Counts the tokens of a text.
+        deduplicate (bool): Whether duplicated chunks, chunks contained in others and
+            the overlaps between chunks of the same source are removed.
+        truncate (bool): Whether a document that does not fit whole is truncated to
+            the remaining budget, rather than left out.
+        min_truncated_tokens (int): Smallest remaining budget worth truncating a
+            document into.
+        document_separator (str): Text put between two documents.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 3000,
+        tokenizer: Tokenizer = None,
+        deduplicate: bool = True,
+        truncate: bool = True,
+        min_truncated_tokens: int = 64,
+        document_separator: str = "\n\n",
+    ):
+        self.max_tokens = max_tokens
+        self.tokenizer = tokenizer or get_tokenizer()
+        self.deduplicate = deduplicate
+        self.truncate = truncate
+        self.min_truncated_tokens = min_truncated_tokens
+        self.document_separator = document_separator
+        self._separator_tokens = self.tokenizer(document_separator)
+
+    def pack(self, documents: Sequence[Document]) -> PackedContext:
+        # Stable, so that documents without score keep the order of the retriever
+        documents = sorted(
+            documents,
+            key=lambda doc: -doc.metadata.get(SCORE_METADATA_KEY, float("-inf")),
+        )
+        packed = PackedContext(text="")
+        texts: List[str] = []
+        seen_hashes = set()
+        budget = self.max_tokens
+
+        for document in documents:
+            text = format_document(document, DOCUMENT_PROMPT)
+            text_hash = _hash(text)
+            if self.deduplicate:
+                deduplicated = self._remove_overlaps(text, document, packed.documents)
+                if deduplicated is None or text_hash in seen_hashes:
+                    packed.duplicate_tokens += self.tokenizer(text)
+                    continue
+                if len(deduplicated) < len(text):
+                    packed.duplicate_tokens += self.tokenizer(text) - self.tokenizer(
+                        deduplicated
+                    )
+                    text = deduplicated
+                    document = Document(
+                        page_content=text, metadata=document.metadata, id=document.id
+                    )
+
+            num_tokens = self.tokenizer(text)
+            cost = num_tokens + (self._separator_tokens if texts else 0)
+            if cost > budget:
+                remaining = budget - (self._separator_tokens if texts else 0)
+                if not self.truncate or remaining < self.min_truncated_tokens:
+                    packed.dropped_tokens += num_tokens
+                    packed.num_dropped += 1
+                    continue
+                text = self._truncate(text, remaining)
+                document = Document(
+                    page_content=text, metadata=document.metadata, id=document.id
+                )
+                packed.dropped_tokens += num_tokens - self.tokenizer(text)
+                packed.num_truncated += 1
+                cost = self.tokenizer(text) + (self._separator_tokens if texts else 0)
+
+            budget -= cost
+            texts.append(text)
+            seen_hashes.add(text_hash)
+            packed.documents.append(document)
+
+        packed.text = self.document_separator.join(texts)
+        packed.packed_tokens = self.max_tokens - budget
+        return packed
+
+    def _remove_overlaps(
+        self, text: str, document: Document, packed: List[Document]
+    ) -> Optional[str]:
+        """Returns the text without the parts already packed, None if it is entirely
+        contained in a packed document."""
+        source = document.metadata.get("source")
+        for other in packed:
+            if text in other.page_content:
+                return None
+            if source is None or other.metadata.get("source") != source:
+                continue
+            # Consecutive chunks of a document share their end and start
+            text = text[_overlap(other.page_content, text) :]
+            text = text[: len(text) - _overlap(text, other.page_content)]
+            if not text.strip():
+                return None
+        return text
+
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        """Keeps the longest start of the text that fits in `max_tokens`, cut at a
+        whitespace when possible."""
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.tokenizer(text[:middle]) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        truncated = text[:low]
+        cut = truncated.rfind(" ")
+        if cut > len(truncated) // 2:
+            truncated = truncated[:cut]
+        return truncated
+
+
+def get_context_packer(config: RagConfig) -> Optional[ContextPacker]:
+    packing_config = config.context_packing
+    if not packing_config.enabled:
+        return None
+    return ContextPacker(
+        max_tokens=config.max_tokens_limit,
+        tokenizer=get_tokenizer(config.tokenizer),
+        deduplicate=packing_config.deduplicate,
+        truncate=packing_config.truncate,
+        min_truncated_tokens=packing_config.min_truncated_tokens,
+    )
+
+
+def _overlap(first: str, second: str) -> int:
+    """Length of the longest end of `first` that starts `second`."""
+    if len(first) < MIN_OVERLAP_CHARACTERS or len(second) < MIN_OVERLAP_CHARACTERS:
+        return 0
+    probe = second[:MIN_OVERLAP_CHARACTERS]
+    start = max(len(first) - len(second), 0)
+    position = first.find(probe, start)
+    while position != -1:
+        if second.startswith(first[position:]):
+            return len(first) - position
+        position = first.find(probe, position + 1)
+    return 0
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha1(" ".join(text.split()).encode("utf-8")).hexdigest()
@@ -1,23 +1,252 @@
 import inspect
+import mimetypes
+import time
+from collections import Counter
+from functools import lru_cache
 from pathlib import Path
-from typing import List
+from typing import Dict, Iterator, List, Optional
 
 from langchain.chains import LLMChain
 from langchain.chat_models.base import BaseChatModel
+from langchain.docstore.document import Document
 from langchain.prompts import PromptTemplate
 
+from backend.database import Database
+from backend.logger import get_logger
 
-def get_documents(file_path: Path, llm: BaseChatModel):
+# Static registry mapping file extensions to the loader that handles them.
+# Extend it to skip the LLM-based loader selection for your own file types.
+LOADERS_BY_EXTENSION = {
+    ".csv": "CSVLoader",
+    ".pdf": "PyPDFLoader",
+    ".txt": "TextLoader",
+    ".md": "UnstructuredMarkdownLoader",
+    ".html": "BSHTMLLoader",
+    ".htm": "BSHTMLLoader",
+    ".docx": "Docx2txtLoader",
+    ".doc": "UnstructuredWordDocumentLoader",
+    ".pptx": "UnstructuredPowerPointLoader",
+    ".ppt": "UnstructuredPowerPointLoader",
+    ".xlsx": "UnstructuredExcelLoader",
+    ".xls": "UnstructuredExcelLoader",
+    ".eml": "UnstructuredEmailLoader",
+    ".msg": "OutlookMessageLoader",
+    ".epub": "UnstructuredEPubLoader",
+    ".rtf": "UnstructuredRTFLoader",
+    ".odt": "UnstructuredODTLoader",
+    ".ipynb": "NotebookLoader",
+    ".xml": "UnstructuredXMLLoader",
+    ".tsv": "UnstructuredTSVLoader",
+    ".srt": "SRTLoader",
+    ".py": "PythonLoader",
+}
+
+# Fallback registry used when the extension is unknown but the MIME type is not.
+LOADERS_BY_MIME_TYPE = {
+    "text/csv": "CSVLoader",
+    "application/pdf": "PyPDFLoader",
+    "text/plain": "TextLoader",
+    "text/markdown": "UnstructuredMarkdownLoader",
+    "text/html": "BSHTMLLoader",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": (
+        "Docx2txtLoader"
+    ),
+    "application/msword": "UnstructuredWordDocumentLoader",
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation": (
+        "UnstructuredPowerPointLoader"
+    ),
+    "application/vnd.ms-powerpoint": "UnstructuredPowerPointLoader",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": (
+        "UnstructuredExcelLoader"
+    ),
+    "application/vnd.ms-excel": "UnstructuredExcelLoader",
+    "message/rfc822": "UnstructuredEmailLoader",
+    "application/epub+zip": "UnstructuredEPubLoader",
+    "application/rtf": "UnstructuredRTFLoader",
+    "text/xml": "UnstructuredXMLLoader",
+    "application/xml": "UnstructuredXMLLoader",
+    "text/tab-separated-values": "UnstructuredTSVLoader",
+}
+
+# Counts how each loader resolution was answered: "registry", "cache" or "llm".
+LOADER_RESOLUTION_STATS = Counter()
+
+# In-process copy of the persisted loader decisions, keyed by file extension.
+_loader_decisions: Dict[str, str] = {}
+
+# Seconds during which an extension the LLM found no loader for is not asked again,
+# so that a loader added to the registry or to langchain is eventually picked up.
+NO_LOADER_TTL_SECONDS = 24 * 3600
+
+# In-process copy of the persisted extensions without a loader, with the time the LLM
+# was asked about them.
+_loader_misses: Dict[str, float] = {}
+
+# Inserts or replaces the loader of an extension, in a single statement
+UPSERT_LOADER_QUERIES = {
+    None: (
+        "INSERT INTO document_loaders (file_extension, loader_class_name) VALUES"
+        " (?, ?) ON CONFLICT (file_extension) DO UPDATE SET loader_class_name ="
+        " excluded.loader_class_name"
+    ),
+    "mysql": (
+        "INSERT INTO document_loaders (file_extension, loader_class_name) VALUES"
+        " (?, ?) ON DUPLICATE KEY UPDATE loader_class_name ="
+        " VALUES(loader_class_name)"
+    ),
+}
+
+# Inserts or replaces the time an extension was found to have no loader
+UPSERT_MISS_QUERIES = {
+    None: (
+        "INSERT INTO document_loader_misses (file_extension, checked_at) VALUES"
+        " (?, ?) ON CONFLICT (file_extension) DO UPDATE SET checked_at ="
+        " excluded.checked_at"
+    ),
+    "mysql": (
+        "INSERT INTO document_loader_misses (file_extension, checked_at) VALUES"
+        " (?, ?) ON DUPLICATE KEY UPDATE checked_at = VALUES(checked_at)"
+    ),
+}
+
+
+def get_documents(file_path: Path, llm: BaseChatModel) -> Iterator[Document]:
+    """Parses a file lazily, the documents are read as they are iterated."""
     file_extension = file_path.suffix
-    loader_class_name = get_best_loader(file_extension, llm)
-    print(f"loader selected {loader_class_name} for {file_path}")
+    loader_class_name = resolve_loader(file_path, llm)
+    get_logger().info(f"loader selected {loader_class_name} for {file_path}")
 
     if loader_class_name == "None":
         raise Exception(f"No loader found for {file_extension} files.")
 
     loader_class = get_loader_class(loader_class_name)
     loader = loader_class(str(file_path))
-    return loader.load()
+    return loader.lazy_load()
+
+
+def resolve_loader(file_path: Path, llm: BaseChatModel) -> str:
+    """Find the loader class name for a file without calling the LLM when possible.
+
+    The static extension and MIME type registries are checked first, then the
+    decisions previously made by the LLM and persisted in the database. The LLM is
+    only queried for extensions that were never seen before. Its answer is persisted
+    when it names a known loader, so that it is asked at most once per extension.
+    Extensions it finds no loader for are persisted too, and only asked about again
+    after `NO_LOADER_TTL_SECONDS`.
+
+    Args:
+        file_path (Path): The file to find a loader for.
+        llm (BaseChatModel): The model used as a last resort to pick a loader.
+
+    Returns:
+        str: The name of a `langchain_community.document_loaders` class, or "None" if
+            no loader is relevant.
+    """
+    file_extension = file_path.suffix.lower()
+
+    loader_class_name = get_registered_loader(file_path)
+    if loader_class_name:
+        LOADER_RESOLUTION_STATS["registry"] += 1
+        return loader_class_name
+
+    loader_class_name = get_cached_loader(file_extension)
+    if loader_class_name:
+        LOADER_RESOLUTION_STATS["cache"] += 1
+        return loader_class_name
+
+    if is_cached_miss(file_extension):
+        LOADER_RESOLUTION_STATS["cache"] += 1
+        return "None"
+
+    LOADER_RESOLUTION_STATS["llm"] += 1
+    loader_class_name = get_best_loader(file_extension, llm).strip()
+    if loader_class_name not in get_loaders():
+        # "None", or a name the LLM made up
+        if loader_class_name != "None":
+            get_logger().warning(
+                f"Unknown loader {loader_class_name!r} suggested for"
+                f" {file_extension} files"
+            )
+        cache_miss(file_extension)
+        return "None"
+    cache_loader(file_extension, loader_class_name)
+    return loader_class_name
+
+
+def get_registered_loader(file_path: Path) -> Optional[str]:
+    loader_class_name = LOADERS_BY_EXTENSION.get(file_path.suffix.lower())
+    if loader_class_name:
+        return loader_class_name
+
+    mime_type, _ = mimetypes.guess_type(file_path.name)
+    return LOADERS_BY_MIME_TYPE.get(mime_type)
+
+
+def get_cached_loader(file_extension: str) -> Optional[str]:
+    if file_extension in _loader_decisions:
+        return _loader_decisions[file_extension]
+
+    with Database() as connection:
+        row = connection.fetchone(
+            "SELECT loader_class_name FROM document_loaders WHERE file_extension = ?",
+            (file_extension,),
+        )
+    if row:
+        _loader_decisions[file_extension] = row[0]
+        return row[0]
+    return None
+
+
+def cache_loader(file_extension: str, loader_class_name: str) -> None:
+    _loader_decisions[file_extension] = loader_class_name
+    with Database() as connection:
+        # Loader processes may resolve the same extension at the same time
+        connection.execute(
+            UPSERT_LOADER_QUERIES.get(connection.dialect, UPSERT_LOADER_QUERIES[None]),
+            (file_extension, loader_class_name),
+        ).close()
+
+
+def is_cached_miss(file_extension: str) -> bool:
+    checked_at = _loader_misses.get(file_extension)
+    if checked_at is None or time.time() - checked_at > NO_LOADER_TTL_SECONDS:
+        # Another process may have asked the LLM since
+        with Database() as connection:
+            row = connection.fetchone(
+                "SELECT checked_at FROM document_loader_misses"
+                " WHERE file_extension = ?",
+                (file_extension,),
+            )
+        if row is None:
+            return False
+        checked_at = _loader_misses[file_extension] = row[0]
+    return time.time() - checked_at <= NO_LOADER_TTL_SECONDS
+
+
+def cache_miss(file_extension: str) -> None:
+    checked_at = _loader_misses[file_extension] = time.time()
+    with Database() as connection:
+        connection.execute(
+            UPSERT_MISS_QUERIES.get(connection.dialect, UPSERT_MISS_QUERIES[None]),
+            (file_extension, checked_at),
+        ).close()
+
+
+def get_loader_resolution_stats() -> dict:
+    """Report how loaders were resolved since the process started.
+
+    A `llm` count that stays flat while `registry` and `cache` grow shows that
+    ingestion does not wait on the LLM anymore.
+    """
+    total = sum(LOADER_RESOLUTION_STATS.values())
+    return {
+        "registry_hits": LOADER_RESOLUTION_STATS["registry"],
+        "cache_hits": LOADER_RESOLUTION_STATS["cache"],
+        "llm_calls": LOADER_RESOLUTION_STATS["llm"],
+        "hit_rate": (
+            (total - LOADER_RESOLUTION_STATS["llm"]) / total if total else None
+        ),
+    }
 
 
 def get_loader_class(loader_class_name: str):
@@ -46,9 +275,14 @@ def get_best_loader(file_extension: str, llm: BaseChatModel):
     ]
 
 
+@lru_cache(maxsize=1)
 def get_loaders() -> List[str]:
     import langchain_community.document_loaders
 
+    # Loaders are imported on first access, only `__all__` lists them all
+    names = getattr(langchain_community.document_loaders, "__all__", None)
+    if names is not None:
+        return list(names)
     loaders = []
     for _, obj in inspect.getmembers(langchain_community.document_loaders):
         if inspect.isclass(obj):
@@ -1,17 +1,46 @@
 # embedding.py
+import asyncio
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
 from importlib import import_module
+from queue import Empty, Queue
+from threading import Lock, Thread
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
 
 from backend.config import RagConfig
+from backend.logger import get_logger
+from backend.rag_components.embedding_cache import get_cached_embeddings
 
 # Example registry mapping provider names to their import paths
 EMBEDDING_PROVIDERS = {
     "HuggingFaceEmbeddings": "langchain_huggingface.HuggingFaceEmbeddings",
     "OpenAIEmbeddings": "langchain_openai.OpenAIEmbeddings",
+    "RemoteEmbeddings": "backend.rag_components.embedding_server.RemoteEmbeddings",
     # Add more providers as needed
 }
 
 
 def get_embedding_model(config: RagConfig):
+    embeddings = _get_provider_model(config)
+
+    # Concurrent queries are embedded together instead of one forward pass each
+    if config.embedding_model.micro_batching:
+        embeddings = MicroBatchingEmbeddings(
+            embeddings,
+            window_ms=config.embedding_model.micro_batch_window_ms,
+            max_batch_size=config.embedding_model.micro_batch_max_size,
+        )
+
+    # Only embed texts that were not embedded by the same model before
+    if config.embedding_model.cache:
+        return get_cached_embeddings(embeddings, config)
+    return embeddings
+
+
+def _get_provider_model(config: RagConfig):
     source = config.embedding_model.source
     source_config = config.embedding_model.source_config
 
@@ -29,3 +58,150 @@ def get_embedding_model(config: RagConfig):
     embedding_class = getattr(module, class_name)
 
     return embedding_class(**source_config)
+
+
+class PrefetchedEmbeddings(Embeddings):
+    """Wraps an embedding model so that document vectors can be computed ahead of time.
+
+    The ingestion pipeline embeds batches on worker threads with `prefetch`, while the
+    vector store keeps calling `embed_documents` from the writer. Prefetched vectors
+    are served from a bounded LRU buffer, and texts that were not prefetched are
+    embedded by the wrapped model as usual.
+
+    Attributes:
+        embeddings (Embeddings): The wrapped embedding model.
+        max_entries (int): Maximum number of prefetched vectors kept in memory.
+    """
+
+    def __init__(self, embeddings: Embeddings, max_entries: int = 10_000):
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self._prefetched: OrderedDict[str, List[float]] = OrderedDict()
+        self._lock = Lock()
+
+    def prefetch(self, texts: List[str]) -> None:
+        if not texts:
+            return
+        vectors = self.embeddings.embed_documents(texts)
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                self._prefetched[text] = vector
+                self._prefetched.move_to_end(text)
+            while len(self._prefetched) > self.max_entries:
+                self._prefetched.popitem(last=False)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self._lock:
+            vectors = [self._prefetched.get(text) for text in texts]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            computed = self.embeddings.embed_documents([texts[i] for i in missing])
+            for i, vector in zip(missing, computed):
+                vectors[i] = vector
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.embeddings.aembed_query(text)
+
+
+class MicroBatchingEmbeddings(Embeddings):
+    """Wraps an embedding model so that concurrent queries are embedded in batches.
+
+    Queries are queued, and a worker thread embeds them with a single
+    `embed_documents` call once `max_batch_size` of them are waiting or `window_ms`
+    have passed since the first one arrived. Each caller then gets its own vector
+    back. The wrapped model must embed queries and documents the same way, as
+    `HuggingFaceEmbeddings` does. Documents are embedded by the wrapped model
+    directly, they come in batches already.
+
+    Attributes:
+        embeddings (Embeddings): The wrapped embedding model.
+        window_ms (float): Time the worker waits for more queries after the first.
+        max_batch_size (int): Number of queries that triggers a batch right away.
+    """
+
+    def __init__(
+        self, embeddings: Embeddings, window_ms: float = 5, max_batch_size: int = 32
+    ):
+        self.embeddings = embeddings
+        self.window_ms = window_ms
+        self.max_batch_size = max_batch_size
+        self.logger = get_logger()
+
+        self._queue: Queue = Queue()
+        self._worker: Optional[Thread] = None
+        self._lock = Lock()
+        self.batch_sizes: Counter = Counter()  # Number of batches of every size
+        self.max_queue_depth = 0
+        self.queued_seconds = 0.0  # Time spent by queries waiting for their batch
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._submit(text).result()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await asyncio.wrap_future(self._submit(text))
+
+    def stats(self) -> dict:
+        num_batches = sum(self.batch_sizes.values())
+        num_queries = sum(size * count for size, count in self.batch_sizes.items())
+        return {
+            "batches": num_batches,
+            "queries": num_queries,
+            "mean_batch_size": num_queries / num_batches if num_batches else None,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "queue_depth": self._queue.qsize(),
+            "max_queue_depth": self.max_queue_depth,
+            "mean_queued_ms": (
+                1000 * self.queued_seconds / num_queries if num_queries else None
+            ),
+        }
+
+    def _submit(self, text: str) -> Future:
+        future = Future()
+        with self._lock:
+            if self._worker is None:
+                self._worker = Thread(target=self._run, daemon=True)
+                self._worker.start()
+            self._queue.put((text, future, time.perf_counter()))
+            self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+        return future
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.window_ms / 1000
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except Empty:
+                    break
+            self._embed_batch(batch)
+
+    def _embed_batch(self, batch: list) -> None:
+        started_at = time.perf_counter()
+        texts = [text for text, _, _ in batch]
+        try:
+            vectors = self.embeddings.embed_documents(texts)
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for (_, future, _), vector in zip(batch, vectors):
+            future.set_result(vector)
+
+        with self._lock:
+            self.batch_sizes[len(batch)] += 1
+            self.queued_seconds += sum(started_at - queued for *_, queued in batch)
+        self.logger.debug(
+            f"Embedded a batch of {len(batch)} queries in"
+            f" {1000 * (time.perf_counter() - started_at):.1f}ms"
+        )
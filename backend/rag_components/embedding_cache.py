@@ -0,0 +1,254 @@
+"""Persistent, content-addressed cache for embedding vectors.
+
+Vectors are keyed by a hash of the embedding model identity and of the embedded text,
+so re-embedding a chunk that was already seen by the same model is a single batched
+database lookup. The cache is stored in a SQL table, either in a local SQLite file or
+in the configured database, and is bounded with a least-recently-used eviction.
+"""
+
+import base64
+import hashlib
+import time
+from array import array
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Iterable, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from backend.database import Database
+from backend.logger import get_logger
+
+# Number of keys per `IN (...)` clause, stays under the parameter limit of SQLite.
+LOOKUP_BATCH_SIZE = 500
+
+# Share of the entries kept when the cache overflows, so that eviction does not run
+# again on the next insert.
+EVICTION_TARGET_RATIO = 0.9
+
+
+class EmbeddingStore:
+    """SQL table of embedding vectors with a size-bounded LRU eviction.
+
+    Attributes:
+        connection_string (str): Connection string of the database holding the table.
+        max_entries (int): Maximum number of vectors kept in the table.
+    """
+
+    def __init__(self, connection_string: str, max_entries: int = 1_000_000):
+        self.connection_string = connection_string
+        self.max_entries = max_entries
+        self.logger = get_logger()
+
+        if connection_string.startswith("sqlite:///"):
+            Path(connection_string.replace("sqlite:///", "")).parent.mkdir(
+                parents=True, exist_ok=True
+            )
+        with Database(connection_string) as connection:
+            connection.run_script(Path(__file__).parent / "embedding_cache_tables.sql")
+            connection.create_index(
+                "embedding_cache", "embedding_cache_last_used_at", ["last_used_at"]
+            )
+            self._size = connection.fetchone("SELECT COUNT(*) FROM embedding_cache")[0]
+        self._lock = Lock()
+
+    def mget(self, keys: List[str]) -> Dict[str, List[float]]:
+        vectors = {}
+        with Database(self.connection_string) as connection:
+            for batch in _batches(keys, LOOKUP_BATCH_SIZE):
+                placeholders = ", ".join("?" for _ in batch)
+                rows = connection.fetchall(
+                    "SELECT cache_key, embedding FROM embedding_cache WHERE cache_key"
+                    f" IN ({placeholders})",
+                    tuple(batch),
+                )
+                for cache_key, embedding in rows:
+                    vectors[cache_key] = _decode(embedding)
+
+            now = _now_ms()
+            for batch in _batches(list(vectors), LOOKUP_BATCH_SIZE):
+                placeholders = ", ".join("?" for _ in batch)
+                connection.execute(
+                    "UPDATE embedding_cache SET last_used_at = ? WHERE cache_key IN"
+                    f" ({placeholders})",
+                    (now, *batch),
+                ).close()
+        return vectors
+
+    def mset(self, vectors: Dict[str, List[float]]) -> None:
+        now = _now_ms()
+        with Database(self.connection_string) as connection:
+            for batch in _batches(list(vectors), LOOKUP_BATCH_SIZE):
+                placeholders = ", ".join("?" for _ in batch)
+                # Entries written concurrently by another worker are replaced.
+                deleted = connection.execute(
+                    "DELETE FROM embedding_cache WHERE cache_key IN"
+                    f" ({placeholders})",
+                    tuple(batch),
+                )
+                num_replaced = max(deleted.rowcount, 0)
+                deleted.close()
+                connection.executemany(
+                    "INSERT INTO embedding_cache (cache_key, embedding, last_used_at)"
+                    " VALUES (?, ?, ?)",
+                    [
+                        (cache_key, _encode(vectors[cache_key]), now)
+                        for cache_key in batch
+                    ],
+                ).close()
+                with self._lock:
+                    self._size += len(batch) - num_replaced
+
+        if self._size > self.max_entries:
+            self.evict()
+
+    def evict(self) -> None:
+        """Deletes the least recently used vectors until the cache is back under its
+        target size."""
+        with Database(self.connection_string) as connection:
+            size = connection.fetchone("SELECT COUNT(*) FROM embedding_cache")[0]
+            num_to_evict = size - int(self.max_entries * EVICTION_TARGET_RATIO)
+            if num_to_evict > 0:
+                threshold = connection.fetchone(
+                    "SELECT last_used_at FROM embedding_cache ORDER BY last_used_at"
+                    " ASC LIMIT 1 OFFSET ?",
+                    (num_to_evict,),
+                )
+                if threshold:
+                    connection.execute(
+                        "DELETE FROM embedding_cache WHERE last_used_at <= ?",
+                        (threshold[0],),
+                    ).close()
+                size = connection.fetchone("SELECT COUNT(*) FROM embedding_cache")[0]
+        with self._lock:
+            self._size = size
+        self.logger.info(f"Embedding cache evicted down to {size} entries.")
+
+
+class CachedEmbeddings(Embeddings):
+    """Embedding model wrapper that only embeds texts missing from an EmbeddingStore.
+
+    Cache failures are logged and never prevent the wrapped model from embedding.
+
+    Attributes:
+        embeddings (Embeddings): The wrapped embedding model.
+        store (EmbeddingStore): Where the vectors are persisted.
+        namespace (str): Identity of the embedding model, part of every cache key so
+            that vectors of different models never collide.
+        hits (int): Number of texts served from the cache.
+        misses (int): Number of texts embedded by the wrapped model.
+    """
+
+    def __init__(self, embeddings: Embeddings, store: EmbeddingStore, namespace: str):
+        self.embeddings = embeddings
+        self.store = store
+        self.namespace = namespace
+        self.logger = get_logger()
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        cached = self._mget(list(dict.fromkeys(keys)))
+
+        missing = {}  # Deduplicates texts missing from the cache
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing[key] = text
+        if missing:
+            computed = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing, computed))
+            self._mset(computed)
+            cached.update(computed)
+
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        # Some models embed queries differently from documents
+        key = self._key(text, kind="query")
+        cached = self._mget([key])
+        if key in cached:
+            self.hits += 1
+            return cached[key]
+
+        self.misses += 1
+        vector = self.embeddings.embed_query(text)
+        self._mset({key: vector})
+        return vector
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else None,
+        }
+
+    def _key(self, text: str, kind: str = "document") -> str:
+        key = f"{self.namespace}\0{kind}\0{text}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _mget(self, keys: List[str]) -> Dict[str, List[float]]:
+        try:
+            return self.store.mget(keys)
+        except Exception as e:
+            self.logger.warning(f"Embedding cache lookup failed: {e}")
+            return {}
+
+    def _mset(self, vectors: Dict[str, List[float]]) -> None:
+        try:
+            self.store.mset(vectors)
+        except Exception as e:
+            self.logger.warning(f"Embedding cache write failed: {e}")
+
+
+def get_cached_embeddings(
+    embeddings: Embeddings, config, namespace: Optional[str] = None
+) -> CachedEmbeddings:
+    embedding_config = config.embedding_model
+    if embedding_config.cache == "local":
+        connection_string = f"sqlite:///{embedding_config.cache_path}"
+    elif embedding_config.cache == "database":
+        connection_string = config.database.database_url
+    else:
+        raise ValueError(f"Unknown embedding cache: {embedding_config.cache}")
+
+    store = EmbeddingStore(connection_string, embedding_config.cache_max_entries)
+    return CachedEmbeddings(
+        embeddings, store, namespace or get_model_identity(embedding_config)
+    )
+
+
+def get_model_identity(embedding_config) -> str:
+    source = embedding_config.source
+    source_name = source if isinstance(source, str) else type(source).__name__
+    source_config = embedding_config.source_config or {}
+    model_name = next(
+        (
+            source_config[key]
+            for key in ("model_name", "model", "deployment", "model_id")
+            if source_config.get(key)
+        ),
+        getattr(source, "model_name", None) or getattr(source, "model", None),
+    )
+    return f"{source_name}:{model_name}"
+
+
+def _batches(items: List, size: int) -> Iterable[List]:
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def _encode(vector: List[float]) -> str:
+    # Stored as base64 text, binary column types do not transpile across dialects
+    return base64.b64encode(array("f", vector).tobytes()).decode("ascii")
+
+
+def _decode(embedding: str) -> List[float]:
+    return array("f", base64.b64decode(embedding)).tolist()
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
@@ -0,0 +1,8 @@
+-- Dialect MUST be sqlite, even if the database you use is different.
+-- It is transpiled to the right dialect when executed.
+
+CREATE TABLE IF NOT EXISTS "embedding_cache" (
+    "cache_key" VARCHAR(64) PRIMARY KEY,
+    "embedding" TEXT,
+    "last_used_at" BIGINT
+);
@@ -0,0 +1,256 @@
+"""Embedding service that keeps the embedding model out of the API processes.
+
+Local models such as `HuggingFaceEmbeddings` hold the GIL while they run and take
+hundreds of megabytes in every uvicorn worker that loads them. The service loads the
+model once, forks worker processes that share its memory, and serves embedding
+requests on a Unix socket. API processes embed through `RemoteEmbeddings`.
+
+Start it with the configuration of the API, whose `EmbeddingModelConfig` describes
+the served model under `source_config.model`:
+
+    python -m backend.rag_components.embedding_server --config backend/config.yaml
+
+Messages are framed by their length. A request is a JSON object, and a response is a
+JSON header followed by the vectors as raw float32 values.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import struct
+from dataclasses import replace
+from pathlib import Path
+from queue import Empty, Queue
+from threading import Thread
+from typing import List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from backend.config import EmbeddingModelConfig, RagConfig
+from backend.logger import get_logger
+
+DEFAULT_SOCKET_PATH = "/tmp/rag-embeddings.sock"
+
+# Length prefix of every message
+FRAME_HEADER = struct.Struct("!I")
+
+
+class RemoteEmbeddings(Embeddings):
+    """Embeds texts with the embedding service listening on a Unix socket.
+
+    Connections of the synchronous methods are kept open and reused. A request that
+    fails on a connection is retried once on a new one, in case the service was
+    restarted. The asynchronous methods open a connection per request, as streams
+    are bound to the event loop that opened them.
+
+    Attributes:
+        socket_path (str): Path of the Unix socket of the service.
+        model (dict): `EmbeddingModelConfig` of the model served, only read by the
+            service. Identifies the model in the embedding cache.
+        timeout (float): Seconds to wait for a response, connection included.
+        max_connections (int): Number of idle connections kept open for the
+            synchronous methods.
+    """
+
+    def __init__(
+        self,
+        socket_path: str = DEFAULT_SOCKET_PATH,
+        model: Optional[dict] = None,
+        timeout: float = 60,
+        max_connections: int = 8,
+    ):
+        self.socket_path = socket_path
+        self.model = model or {}
+        self.timeout = timeout
+        self._connections: Queue = Queue(maxsize=max_connections)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._request({"op": "embed_documents", "texts": texts}).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._request({"op": "embed_query", "texts": [text]})[0].tolist()
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        request = {"op": "embed_documents", "texts": texts}
+        return (await self._arequest(request)).tolist()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        request = {"op": "embed_query", "texts": [text]}
+        return (await self._arequest(request))[0].tolist()
+
+    def _request(self, request: dict) -> np.ndarray:
+        payload = json.dumps(request).encode("utf-8")
+        for attempt in range(2):
+            connection = self._get_connection()
+            try:
+                connection.sendall(FRAME_HEADER.pack(len(payload)) + payload)
+                header = json.loads(_receive_frame(connection))
+                vectors = _receive_exactly(connection, _vectors_size(header))
+            except OSError:
+                connection.close()
+                if attempt:
+                    raise
+                continue
+            self._release_connection(connection)
+            return _decode_response(header, vectors)
+
+    async def _arequest(self, request: dict) -> np.ndarray:
+        payload = json.dumps(request).encode("utf-8")
+
+        async def exchange() -> Tuple[dict, bytes]:
+            reader, writer = await asyncio.open_unix_connection(self.socket_path)
+            try:
+                writer.write(FRAME_HEADER.pack(len(payload)) + payload)
+                await writer.drain()
+                frame_header = await reader.readexactly(FRAME_HEADER.size)
+                size = FRAME_HEADER.unpack(frame_header)[0]
+                header = json.loads(await reader.readexactly(size))
+                vectors = await reader.readexactly(_vectors_size(header))
+            finally:
+                writer.close()
+            return header, vectors
+
+        header, vectors = await asyncio.wait_for(exchange(), self.timeout)
+        return _decode_response(header, vectors)
+
+    def _get_connection(self) -> socket.socket:
+        try:
+            return self._connections.get_nowait()
+        except Empty:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.settimeout(self.timeout)
+            connection.connect(self.socket_path)
+            return connection
+
+    def _release_connection(self, connection: socket.socket) -> None:
+        try:
+            self._connections.put_nowait(connection)
+        except Exception:
+            connection.close()
+
+
+def serve(embeddings: Embeddings, socket_path: str, num_workers: int = 1) -> None:
+    """Serves `embeddings` on a Unix socket from `num_workers` forked processes."""
+    logger = get_logger()
+    Path(socket_path).unlink(missing_ok=True)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    Path(socket_path).chmod(0o660)
+    listener.listen(128)
+
+    # Workers are forked after the model is loaded, so they share its memory
+    context = multiprocessing.get_context("fork")
+    workers = [
+        context.Process(target=_serve_worker, args=(listener, embeddings), daemon=True)
+        for _ in range(num_workers)
+    ]
+    for worker in workers:
+        worker.start()
+    logger.info(f"Embedding service listening on {socket_path}, {num_workers} workers")
+
+    def stop(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for worker in workers:
+            worker.join()
+    finally:
+        for worker in workers:
+            worker.terminate()
+        listener.close()
+        Path(socket_path).unlink(missing_ok=True)
+
+
+def _serve_worker(listener: socket.socket, embeddings: Embeddings) -> None:
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    while True:
+        connection, _ = listener.accept()
+        Thread(
+            target=_serve_connection, args=(connection, embeddings), daemon=True
+        ).start()
+
+
+def _serve_connection(connection: socket.socket, embeddings: Embeddings) -> None:
+    logger = get_logger()
+    with connection:
+        while True:
+            try:
+                request = json.loads(_receive_frame(connection))
+            except (OSError, ConnectionError):
+                return
+            try:
+                if request["op"] == "embed_query":
+                    vectors = [embeddings.embed_query(request["texts"][0])]
+                elif request["op"] == "embed_documents":
+                    vectors = embeddings.embed_documents(request["texts"])
+                else:
+                    raise ValueError(f"Unknown operation: {request['op']}")
+                matrix = np.asarray(vectors, dtype=np.float32)
+                header, payload = {"shape": matrix.shape}, matrix.tobytes()
+            except Exception as e:
+                logger.exception(f"Embedding request failed in worker {os.getpid()}")
+                header, payload = {"error": str(e)}, b""
+            header = json.dumps(header).encode("utf-8")
+            try:
+                connection.sendall(FRAME_HEADER.pack(len(header)) + header + payload)
+            except OSError:
+                return
+
+
+def _receive_frame(connection: socket.socket) -> bytes:
+    size = FRAME_HEADER.unpack(_receive_exactly(connection, FRAME_HEADER.size))[0]
+    return _receive_exactly(connection, size)
+
+
+def _receive_exactly(connection: socket.socket, size: int) -> bytes:
+    buffer = bytearray(size)
+    view, received = memoryview(buffer), 0
+    while received < size:
+        num_bytes = connection.recv_into(view[received:])
+        if not num_bytes:
+            raise ConnectionError("Connection closed by the peer")
+        received += num_bytes
+    return bytes(buffer)
+
+
+def _vectors_size(header: dict) -> int:
+    shape: Tuple[int, int] = header.get("shape", (0, 0))
+    return int(np.prod(shape)) * 4
+
+
+def _decode_response(header: dict, vectors: bytes) -> np.ndarray:
+    if "error" in header:
+        raise RuntimeError(f"Embedding service error: {header['error']}")
+    return np.frombuffer(vectors, dtype=np.float32).reshape(header["shape"])
+
+
+def main():
+    from backend.rag_components.embedding import get_embedding_model
+
+    parser = argparse.ArgumentParser(description="Serves the embedding model")
+    parser.add_argument("--config", type=Path, default=Path("backend/config.yaml"))
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    config = RagConfig.from_yaml(args.config)
+    source_config = config.embedding_model.source_config
+    if config.embedding_model.source != "RemoteEmbeddings":
+        parser.error("The configured embedding model is not RemoteEmbeddings")
+    served_config = replace(
+        config, embedding_model=EmbeddingModelConfig(**source_config["model"])
+    )
+    serve(
+        get_embedding_model(served_config),
+        source_config.get("socket_path", DEFAULT_SOCKET_PATH),
+        args.workers,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""Manifest of the files loaded in the RAG, to skip unchanged files on re-ingestion.
+
+`langchain.indexes.index` only skips documents that were indexed before once they are
+parsed, split and hashed, which is most of the cost of re-loading a large tree of
+files. The manifest records the size, modification time and content hash of every
+file loaded, per record manager namespace. A file with the same size and
+modification time is skipped without being read, and a file with the same content
+hash is skipped without being parsed.
+
+Large files are also checkpointed while their documents are indexed, so that an
+ingestion that crashed resumes each file after the documents already indexed.
+"""
+
+import hashlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from backend.database import Database
+
+# Number of paths per `IN (...)` clause, stays under the parameter limit of SQLite.
+LOOKUP_BATCH_SIZE = 500
+
+# Bytes read at once when hashing a file
+HASH_CHUNK_SIZE = 1 << 20
+
+# Databases where the manifest table was created by this process
+_INITIALIZED_DATABASES = set()
+
+
+@dataclass
+class FileState:
+    """What the manifest knows of a file.
+
+    Attributes:
+        path (str): Path of the file, as given to the ingestion.
+        size (int): Size in bytes.
+        mtime (float): Modification time, in seconds since the epoch.
+        content_hash (str): SHA-256 of the content, None until the file is read.
+        source (str): The `source` of the documents of the file in the record
+            manager.
+    """
+
+    path: str
+    size: int
+    mtime: float
+    content_hash: Optional[str] = None
+    source: Optional[str] = None
+
+    @classmethod
+    def of(cls, path: Path) -> "FileState":
+        stat = path.stat()
+        return cls(str(path), stat.st_size, stat.st_mtime)
+
+    def has_same_stat(self, other: "FileState") -> bool:
+        return self.size == other.size and self.mtime == other.mtime
+
+
+@dataclass
+class Checkpoint:
+    """Progress of a file whose ingestion did not complete.
+
+    Attributes:
+        path (str): Path of the file, as given to the ingestion.
+        content_hash (str): SHA-256 of the content when its documents were indexed.
+        source (str): The `source` of the documents of the file.
+        num_documents (int): Number of documents of the file, in the order of its
+            loader, that are indexed.
+        started_at (float): Record manager time at which the ingestion that indexed
+            the last of them started.
+    """
+
+    path: str
+    content_hash: str
+    source: str
+    num_documents: int
+    started_at: float
+
+
+def hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as file:
+        while chunk := file.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FileManifest:
+    """SQL table of the files loaded in a record manager namespace.
+
+    Attributes:
+        connection_string (str): Connection string of the database holding the table.
+        namespace (str): The record manager namespace the files were loaded in.
+    """
+
+    def __init__(self, connection_string: str, namespace: str):
+        self.connection_string = connection_string
+        self.namespace = namespace
+        if connection_string not in _INITIALIZED_DATABASES:
+            with Database(connection_string) as connection:
+                connection.run_script(
+                    Path(__file__).parent / "file_manifest_tables.sql"
+                )
+                connection.create_index(
+                    "file_manifest", "file_manifest_namespace", ["namespace"]
+                )
+            _INITIALIZED_DATABASES.add(connection_string)
+
+    def get(self, paths: List[str]) -> Dict[str, FileState]:
+        states = {}
+        with Database(self.connection_string) as connection:
+            for i in range(0, len(paths), LOOKUP_BATCH_SIZE):
+                batch = paths[i : i + LOOKUP_BATCH_SIZE]
+                placeholders = ", ".join("?" for _ in batch)
+                rows = connection.fetchall(
+                    "SELECT path, size, mtime, content_hash, source FROM file_manifest"
+                    f" WHERE file_key IN ({placeholders})",
+                    tuple(self._key(path) for path in batch),
+                )
+                for row in rows:
+                    states[row[0]] = FileState(*row)
+        return states
+
+    def list(self) -> List[FileState]:
+        with Database(self.connection_string) as connection:
+            rows = connection.fetchall(
+                "SELECT path, size, mtime, content_hash, source FROM file_manifest"
+                " WHERE namespace = ?",
+                (self.namespace,),
+            )
+        return [FileState(*row) for row in rows]
+
+    def set(self, states: Iterable[FileState]) -> None:
+        states = list(states)
+        with Database(self.connection_string) as connection:
+            for i in range(0, len(states), LOOKUP_BATCH_SIZE):
+                batch = states[i : i + LOOKUP_BATCH_SIZE]
+                self._delete(connection, [state.path for state in batch])
+                connection.executemany(
+                    "INSERT INTO file_manifest (file_key, namespace, path, size, mtime,"
+                    " content_hash, source) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (
+                            self._key(state.path),
+                            self.namespace,
+                            state.path,
+                            state.size,
+                            state.mtime,
+                            state.content_hash,
+                            state.source,
+                        )
+                        for state in batch
+                    ],
+                ).close()
+
+    def delete(self, paths: Iterable[str]) -> None:
+        paths = list(paths)
+        with Database(self.connection_string) as connection:
+            for i in range(0, len(paths), LOOKUP_BATCH_SIZE):
+                self._delete(connection, paths[i : i + LOOKUP_BATCH_SIZE])
+
+    def get_checkpoints(self, paths: List[str]) -> Dict[str, Checkpoint]:
+        checkpoints = {}
+        with Database(self.connection_string) as connection:
+            for i in range(0, len(paths), LOOKUP_BATCH_SIZE):
+                batch = paths[i : i + LOOKUP_BATCH_SIZE]
+                placeholders = ", ".join("?" for _ in batch)
+                rows = connection.fetchall(
+                    "SELECT path, content_hash, source, num_documents, started_at"
+                    f" FROM ingestion_checkpoint WHERE file_key IN ({placeholders})",
+                    tuple(self._key(path) for path in batch),
+                )
+                for row in rows:
+                    checkpoints[row[0]] = Checkpoint(*row)
+        return checkpoints
+
+    def set_checkpoint(self, checkpoint: Checkpoint) -> None:
+        with Database(self.connection_string) as connection:
+            self._delete(connection, [checkpoint.path], "ingestion_checkpoint")
+            connection.execute(
+                "INSERT INTO ingestion_checkpoint (file_key, namespace, path,"
+                " content_hash, source, num_documents, started_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self._key(checkpoint.path),
+                    self.namespace,
+                    checkpoint.path,
+                    checkpoint.content_hash,
+                    checkpoint.source,
+                    checkpoint.num_documents,
+                    checkpoint.started_at,
+                ),
+            ).close()
+
+    def delete_checkpoints(self, paths: Iterable[str]) -> None:
+        paths = list(paths)
+        with Database(self.connection_string) as connection:
+            for i in range(0, len(paths), LOOKUP_BATCH_SIZE):
+                batch = paths[i : i + LOOKUP_BATCH_SIZE]
+                self._delete(connection, batch, "ingestion_checkpoint")
+
+    def _delete(
+        self, connection: Database, paths: List[str], table: str = "file_manifest"
+    ) -> None:
+        placeholders = ", ".join("?" for _ in paths)
+        connection.execute(
+            f"DELETE FROM {table} WHERE file_key IN ({placeholders})",
+            tuple(self._key(path) for path in paths),
+        ).close()
+
+    def _key(self, path: str) -> str:
+        # Paths can be longer than the primary keys some databases accept
+        return hashlib.sha256(f"{self.namespace}\0{path}".encode()).hexdigest()
@@ -0,0 +1,24 @@
+-- Dialect MUST be sqlite, even if the database you use is different.
+-- It is transpiled to the right dialect when executed.
+
+-- One row per file loaded, keyed by a hash of its record manager namespace and path.
+CREATE TABLE IF NOT EXISTS "file_manifest" (
+    "file_key" VARCHAR(64) PRIMARY KEY,
+    "namespace" VARCHAR(255),
+    "path" TEXT,
+    "size" BIGINT,
+    "mtime" DOUBLE PRECISION,
+    "content_hash" VARCHAR(64),
+    "source" TEXT
+);
+
+-- Progress of the files whose ingestion was interrupted, same keys as the manifest.
+CREATE TABLE IF NOT EXISTS "ingestion_checkpoint" (
+    "file_key" VARCHAR(64) PRIMARY KEY,
+    "namespace" VARCHAR(255),
+    "path" TEXT,
+    "content_hash" VARCHAR(64),
+    "source" TEXT,
+    "num_documents" BIGINT,
+    "started_at" DOUBLE PRECISION
+);
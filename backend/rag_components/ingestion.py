@@ -0,0 +1,871 @@
+"""Staged ingestion pipeline that loads, embeds and indexes documents in parallel.
+
+Files are parsed lazily by a pool of loader processes, their documents are embedded
+in batches by a pool of threads, and a single writer indexes them in the vector store
+with `langchain.indexes.index`. Stages are connected by bounded queues, so only a few
+batches are held in memory at any time, whatever the size of the corpus or of its
+files. Files that did not change since they were last loaded are skipped before being
+parsed, and files whose ingestion was interrupted resume after their last checkpoint,
+see `backend.rag_components.file_manifest`.
+"""
+
+import multiprocessing
+import pickle
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field, replace
+from itertools import count, islice, repeat
+from pathlib import Path
+from queue import Empty, Full, Queue
+from threading import Event, Lock, Thread
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+)
+
+from langchain.docstore.document import Document
+from langchain.indexes import SQLRecordManager, index
+from langchain_community.vectorstores.utils import filter_complex_metadata
+from langchain_core.indexing.api import _HashedDocument
+from langchain_core.vectorstores import VectorStore
+
+from backend.logger import get_logger
+from backend.rag_components.bm25_index import BM25Index
+from backend.rag_components.document_loader import get_loader_class, resolve_loader
+from backend.rag_components.embedding import PrefetchedEmbeddings
+from backend.rag_components.file_manifest import (
+    LOOKUP_BATCH_SIZE,
+    Checkpoint,
+    FileManifest,
+    FileState,
+    hash_file,
+)
+
+if TYPE_CHECKING:
+    from backend.rag_components.rag import RAG
+
+_END_OF_STAGE = None
+
+# Messages of `stream_file` about a file, the last one is unchanged, finished or failed
+_UNCHANGED = "unchanged"  # Its content hash is the known one
+_STARTED = "started"  # Its content hash and the number of documents skipped
+_DOCUMENTS = "documents"  # A chunk of documents and the seconds spent parsing it
+_FINISHED = "finished"
+_FAILED = "failed"  # The exception raised by its loader
+
+# Queue and stop event of the pipeline, in the loader processes
+_loader_queue = None
+_loader_stop = None
+
+
+@dataclass
+class StageStats:
+    """Throughput counters of one pipeline stage.
+
+    Attributes:
+        name (str): Name of the stage.
+        items (int): Number of documents that went through the stage.
+        busy_seconds (float): Time spent working, summed over the stage's workers.
+        started_at (float): Time at which the stage processed its first item.
+        finished_at (float): Time at which the stage processed its last item.
+    """
+
+    name: str
+    items: int = 0
+    busy_seconds: float = 0.0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    _lock: Lock = field(default_factory=Lock, repr=False)
+
+    def record(self, items: int, started_at: float) -> None:
+        finished_at = time.perf_counter()
+        with self._lock:
+            self.items += items
+            self.busy_seconds += finished_at - started_at
+            self.started_at = min(self.started_at or started_at, started_at)
+            self.finished_at = max(self.finished_at or finished_at, finished_at)
+
+    def to_dict(self) -> dict:
+        wall_seconds = (
+            self.finished_at - self.started_at if self.started_at is not None else 0.0
+        )
+        return {
+            "stage": self.name,
+            "documents": self.items,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "wall_seconds": round(wall_seconds, 3),
+            "documents_per_second": (
+                round(self.items / wall_seconds, 2) if wall_seconds else None
+            ),
+        }
+
+
+class _IndexDestination(VectorStore):
+    """Writes to a vector store, mirrors the writes in a lexical index if any, and
+    times them in the stats of the write stage.
+
+    The lexical index logs the documents of every index() batch before index()
+    records them as indexed, so that they are not missing from it after a crash.
+    """
+
+    def __init__(
+        self,
+        vector_store: VectorStore,
+        lexical_index: Optional[BM25Index] = None,
+        stats: Optional[StageStats] = None,
+    ):
+        self.vector_store = vector_store
+        self.lexical_index = lexical_index
+        self.stats = stats or StageStats("write")
+
+    @property
+    def embeddings(self):
+        return self.vector_store.embeddings
+
+    def add_documents(self, documents: List[Document], **kwargs: Any) -> List[str]:
+        started_at = time.perf_counter()
+        ids = self.vector_store.add_documents(documents, **kwargs)
+        if self.lexical_index is not None:
+            self.lexical_index.add_documents(documents, kwargs.get("ids") or ids)
+        self.stats.record(len(documents), started_at)
+        return ids
+
+    def add_texts(self, texts, metadatas=None, **kwargs: Any) -> List[str]:
+        documents = [
+            Document(page_content=text, metadata=metadata or {})
+            for text, metadata in zip(texts, metadatas or [None] * len(texts))
+        ]
+        return self.add_documents(documents, **kwargs)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        started_at = time.perf_counter()
+        deleted = self.vector_store.delete(ids, **kwargs)
+        if self.lexical_index is not None:
+            self.lexical_index.delete(ids or [])
+        self.stats.record(0, started_at)
+        return deleted
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any):
+        return self.vector_store.similarity_search(query, k, **kwargs)
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding,
+        metadatas: Optional[List[dict]] = None,
+        *,
+        vector_store_cls: Type[VectorStore],
+        lexical_index: Optional[BM25Index] = None,
+        **kwargs: Any,
+    ) -> "_IndexDestination":
+        """Creates the vector store with `vector_store_cls.from_texts`, and indexes
+        the texts in the lexical index too."""
+        ids = kwargs.pop("ids", None) or [str(uuid.uuid4()) for _ in texts]
+        vector_store = vector_store_cls.from_texts(
+            texts, embedding, metadatas, ids=ids, **kwargs
+        )
+        if lexical_index is not None:
+            documents = [
+                Document(page_content=text, metadata=metadata or {})
+                for text, metadata in zip(texts, metadatas or [None] * len(texts))
+            ]
+            lexical_index.add_documents(documents, ids)
+        return cls(vector_store, lexical_index)
+
+
+def load_file_documents(file_path: Path, loader_class_name: str) -> Iterator[Document]:
+    """Parses one file lazily, so that only the documents in use are held in memory
+    with loaders that support it."""
+    loader_class = get_loader_class(loader_class_name)
+    for document in loader_class(str(file_path)).lazy_load():
+        yield from filter_complex_metadata([document])
+
+
+def stream_file(
+    file_path: Path,
+    loader_class_name: str,
+    batch_size: int,
+    hash_content: bool = False,
+    known_hash: Optional[str] = None,
+    checkpoint: Optional[Checkpoint] = None,
+) -> Iterator[tuple]:
+    """Parses one file and yields messages about it: its content hash, then chunks of
+    at most `batch_size` documents, then the end of the file.
+
+    With `hash_content`, files whose hash is `known_hash` are not parsed, and the
+    documents counted by `checkpoint` are skipped when the file did not change since.
+    Loaders can not seek, so they are parsed again but not indexed.
+    """
+    content_hash = hash_file(file_path) if hash_content else None
+    if content_hash is not None and content_hash == known_hash:
+        yield _UNCHANGED, content_hash
+        return
+    num_skipped = 0
+    if checkpoint is not None and checkpoint.content_hash == content_hash:
+        num_skipped = checkpoint.num_documents
+    yield _STARTED, content_hash, num_skipped
+
+    documents = islice(
+        load_file_documents(file_path, loader_class_name), num_skipped, None
+    )
+    while True:
+        started_at = time.perf_counter()
+        chunk = list(islice(documents, batch_size))
+        if not chunk:
+            break
+        yield _DOCUMENTS, chunk, time.perf_counter() - started_at
+    yield (_FINISHED,)
+
+
+def stream_file_to_queue(task_id: int, *args) -> None:
+    """Sends the messages of `stream_file` to the queue of the loader processes. Runs
+    in the loader processes, so it must stay picklable."""
+    try:
+        for message in stream_file(*args):
+            if _loader_stop.is_set():
+                return
+            _loader_queue.put((task_id, *message))
+    except Exception as e:
+        try:
+            pickle.dumps(e)
+        except Exception:
+            e = RuntimeError(f"{type(e).__name__}: {e}")
+        _loader_queue.put((task_id, _FAILED, e))
+
+
+def _init_loader_process(queue, stop) -> None:
+    global _loader_queue, _loader_stop
+    _loader_queue, _loader_stop = queue, stop
+    # Once the pipeline stopped, the messages left are not read and would keep the
+    # process from exiting. Otherwise, they are all read before the pool shuts down.
+    _loader_queue.cancel_join_thread()
+
+
+@dataclass
+class _FileTask:
+    """A file to load, with its current state and the state the manifest knows,
+    both None when the manifest is not used, and the progress of its indexing."""
+
+    path: Path
+    state: Optional[FileState] = None
+    known: Optional[FileState] = None
+    checkpoint: Optional[Checkpoint] = None
+    # Position in the file of the next document read
+    num_read: int = 0
+    # Number of the first documents of the file that are indexed
+    num_indexed: int = 0
+    num_checkpointed: int = 0
+    _indexed: Set[int] = field(default_factory=set, repr=False)
+
+    def mark_indexed(self, position: int) -> None:
+        self._indexed.add(position)
+        while self.num_indexed in self._indexed:
+            self._indexed.remove(self.num_indexed)
+            self.num_indexed += 1
+
+
+@dataclass
+class _Batch:
+    """Documents to index, with their file task and position in the file when it is
+    checkpointed."""
+
+    documents: List[Document]
+    origins: List[Optional[Tuple[_FileTask, int]]] = field(default_factory=list)
+
+
+class IngestionPipeline:
+    """Loads files or documents into the RAG's vector store.
+
+    The pipeline has three stages connected by bounded queues:
+        - load: files are parsed lazily by `loader_workers` processes, which send
+        their documents in chunks through a bounded queue. Documents are grouped in
+        batches of `batch_size`.
+        - embed: `embedding_workers` threads compute the vectors of each batch ahead
+        of time (only when the RAG embeddings support prefetching).
+        - write: a single `index` call consumes the embedded batches and writes them
+        in the vector store and in the `SQLRecordManager`. Every
+        `checkpoint_interval` documents of a file written, its progress is saved in
+        the manifest.
+
+    Attributes:
+        rag (RAG): The RAG whose vector store and embeddings are used. Documents
+            are also indexed in its lexical index, if any.
+        insertion_mode (str): The `cleanup` mode passed to `index`.
+        namespace (str): The record manager namespace. When tenancy is enabled, any
+            namespace but "default" is a tenant, and documents go to its indexes.
+        skip_errors (bool): Whether files that fail to load are skipped and logged
+            instead of stopping the ingestion.
+        manifest (FileManifest): The files loaded in the namespace, None unless
+            `ingestion.skip_unchanged_files` is set.
+        num_skipped_files (int): Number of files skipped as unchanged.
+        stats (dict[str, StageStats]): Throughput counters of each stage.
+    """
+
+    def __init__(
+        self,
+        rag: "RAG",
+        insertion_mode: str = None,
+        namespace: str = "default",
+        skip_errors: bool = False,
+    ):
+        self.rag = rag
+        self.config = rag.config.ingestion
+        self.insertion_mode = insertion_mode
+        self.namespace = namespace
+        self.skip_errors = skip_errors
+        self.logger = get_logger()
+
+        # With tenancy enabled, namespaces other than the default one are tenants
+        tenant = None
+        if rag.tenants is not None and namespace != "default":
+            tenant = namespace
+        vector_store, self.lexical_index = rag.get_indexes(tenant)
+
+        self.manifest: Optional[FileManifest] = None
+        if self.config.skip_unchanged_files:
+            self.manifest = FileManifest(rag.config.database.database_url, namespace)
+        self.num_skipped_files = 0
+
+        self.stats = {name: StageStats(name) for name in ("load", "embed", "write")}
+        self.destination = _IndexDestination(
+            vector_store, self.lexical_index, self.stats["write"]
+        )
+        self.failed_files: List[Path] = []
+
+        self._loaded: Queue = Queue(maxsize=self.config.queue_size)
+        self._embedded: Queue = Queue(maxsize=self.config.queue_size)
+        self._stop = Event()
+        self._errors: List[BaseException] = []
+        self._sources: Set[str] = set()
+        self._directory: Optional[Path] = None
+        # Manifest entries to write once the documents are indexed
+        self._file_states: Dict[str, FileState] = {}
+        # Unchanged files, whose records are kept by a full cleanup
+        self._kept_files: Set[str] = set()
+        # Sources whose records to refresh, with the time after which they were
+        # indexed, None for all of them
+        self._kept_sources: deque = deque()
+        # Files with a checkpoint, to delete once they are loaded
+        self._checkpointed_files: Set[str] = set()
+        self._index_start_dt: Optional[float] = None
+
+    def run_files(
+        self, file_paths: Iterable[Path], directory: Optional[Path] = None
+    ) -> dict:
+        """Loads files, skipping those unchanged since they were last loaded.
+
+        The documents of files that were removed from `directory`, when given, are
+        deleted with the incremental cleanup. The full cleanup deletes those of every
+        file that is not in `file_paths` anyway.
+        """
+        self._directory = directory
+        indexing_output = self._run(
+            lambda: self._load_files(self._file_tasks(file_paths))
+        )
+        if self.manifest is not None:
+            self._update_manifest()
+        return {**indexing_output, "num_skipped_files": self.num_skipped_files}
+
+    def run_documents(self, documents: Iterable[Document]) -> dict:
+        return self._run(lambda: self._batch_documents(documents))
+
+    def _run(self, produce_batches) -> dict:
+        embedding_workers = max(1, self.config.embedding_workers)
+        if isinstance(self.rag.embeddings, PrefetchedEmbeddings):
+            self.rag.embeddings.max_entries = max(
+                self.rag.embeddings.max_entries,
+                2 * self.config.batch_size * (self.config.queue_size + 1),
+            )
+        record_manager = SQLRecordManager(
+            namespace=self.namespace, db_url=self.rag.config.database.database_url
+        )
+        record_manager.create_schema()
+
+        threads = [Thread(target=self._produce, args=(produce_batches,), daemon=True)]
+        threads += [
+            Thread(target=self._embed, args=(record_manager,), daemon=True)
+            for _ in range(embedding_workers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            indexing_output = self._write(embedding_workers, record_manager)
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+
+        if self._errors:
+            raise self._errors[0]
+
+        stage_stats = [stats.to_dict() for stats in self.stats.values()]
+        for stage in stage_stats:
+            self.logger.info({"event": "ingestion_stage", **stage})
+        if self.failed_files:
+            self.logger.warning(
+                f"{len(self.failed_files)} files could not be loaded: "
+                f"{[str(path) for path in self.failed_files]}"
+            )
+        return {**indexing_output, "stages": stage_stats}
+
+    def _produce(self, produce_batches) -> None:
+        try:
+            for batch in produce_batches():
+                if not self._put(self._loaded, batch):
+                    return
+        except BaseException as e:
+            self._errors.append(e)
+            self._stop.set()
+        finally:
+            for _ in range(max(1, self.config.embedding_workers)):
+                self._put(self._loaded, _END_OF_STAGE)
+
+    def _file_tasks(self, file_paths: Iterable[Path]) -> Iterator[_FileTask]:
+        """Yields the files to load, skipping those whose size and modification time
+        are the ones in the manifest."""
+        if self.manifest is None:
+            yield from (_FileTask(Path(file_path)) for file_path in file_paths)
+            return
+
+        file_paths = iter(file_paths)
+        while batch := list(islice(file_paths, LOOKUP_BATCH_SIZE)):
+            paths = [str(file_path) for file_path in batch]
+            known_states = self.manifest.get(paths)
+            checkpoints = {}
+            if self.config.checkpoint_interval > 0:
+                checkpoints = self.manifest.get_checkpoints(paths)
+                self._checkpointed_files.update(checkpoints)
+            for file_path in map(Path, batch):
+                try:
+                    state = FileState.of(file_path)
+                except OSError as e:
+                    self._on_file_error(file_path, e)
+                    continue
+                known = known_states.get(state.path)
+                if known is not None and known.has_same_stat(state):
+                    self._skip_unchanged(known)
+                else:
+                    yield _FileTask(
+                        file_path, state, known, checkpoints.get(state.path)
+                    )
+
+    def _skip_unchanged(self, state: FileState, changed: bool = False) -> None:
+        self.num_skipped_files += 1
+        if changed:
+            self._file_states[state.path] = state
+        if self.insertion_mode == "full":
+            self._kept_files.add(state.path)
+            self._kept_sources.append((state.source, None))
+
+    def _load_files(self, tasks: Iterable[_FileTask]) -> Iterator[_Batch]:
+        checkpointed = self.manifest is not None and self.config.checkpoint_interval > 0
+        batch = _Batch([])
+        for task, documents in self._parse_files(tasks):
+            for document in documents:
+                batch.documents.append(document)
+                batch.origins.append((task, task.num_read) if checkpointed else None)
+                task.num_read += 1
+                if len(batch.documents) == self.config.batch_size:
+                    yield batch
+                    batch = _Batch([])
+        if batch.documents:
+            yield batch
+
+    def _parse_files(
+        self, tasks: Iterable[_FileTask]
+    ) -> Iterator[Tuple[_FileTask, List[Document]]]:
+        """Yields the documents of the files in chunks, as their loaders read them."""
+        if self.config.loader_workers <= 0:
+            for task in tasks:
+                if self._stop.is_set():
+                    return
+                loader_class_name = self._resolve_loader(task.path)
+                if loader_class_name is None:
+                    continue
+                messages = stream_file(*self._stream_args(task, loader_class_name))
+                while True:
+                    try:
+                        message = next(messages, None)
+                    except Exception as e:
+                        message = (_FAILED, e)
+                    if message is None:
+                        break
+                    yield from self._on_file_message(task, message)
+                    if message[0] == _FAILED:
+                        break
+            return
+
+        # Workers block on the bounded queue while the pipeline is behind, so the
+        # documents of a large file are never all held in memory.
+        context = multiprocessing.get_context()
+        messages = context.Queue(maxsize=2 * self.config.loader_workers)
+        stop = context.Event()
+        in_flight: Dict[int, Tuple[_FileTask, Future]] = {}
+        with ProcessPoolExecutor(
+            max_workers=self.config.loader_workers,
+            mp_context=context,
+            initializer=_init_loader_process,
+            initargs=(messages, stop),
+        ) as executor:
+            try:
+                yield from self._stream_files(executor, tasks, messages, in_flight)
+            finally:
+                stop.set()
+                for _, future in in_flight.values():
+                    future.cancel()
+                # Unblocks the workers waiting for room in the queue
+                while not all(future.done() for _, future in in_flight.values()):
+                    try:
+                        messages.get(timeout=0.1)
+                    except Empty:
+                        pass
+
+    def _stream_files(
+        self,
+        executor: ProcessPoolExecutor,
+        tasks: Iterable[_FileTask],
+        messages,
+        in_flight: Dict[int, Tuple[_FileTask, Future]],
+    ) -> Iterator[Tuple[_FileTask, List[Document]]]:
+        tasks = iter(tasks)
+        task_ids = count()
+        max_in_flight = 2 * self.config.loader_workers
+        while True:
+            while len(in_flight) < max_in_flight and not self._stop.is_set():
+                task = next(tasks, None)
+                if task is None:
+                    break
+                loader_class_name = self._resolve_loader(task.path)
+                if loader_class_name is None:
+                    continue
+                task_id = next(task_ids)
+                future = executor.submit(
+                    stream_file_to_queue,
+                    task_id,
+                    *self._stream_args(task, loader_class_name),
+                )
+                in_flight[task_id] = (task, future)
+            if not in_flight or self._stop.is_set():
+                return
+
+            try:
+                task_id, *message = messages.get(timeout=0.1)
+            except Empty:
+                # Loaders report their errors, futures only fail when a process died
+                for task_id, (task, future) in list(in_flight.items()):
+                    if future.done() and future.exception() is not None:
+                        del in_flight[task_id]
+                        self._on_file_error(task.path, future.exception())
+                continue
+            if task_id not in in_flight:
+                continue
+            task, _ = in_flight[task_id]
+            if message[0] in (_UNCHANGED, _FINISHED, _FAILED):
+                del in_flight[task_id]
+            yield from self._on_file_message(task, message)
+
+    def _stream_args(self, task: _FileTask, loader_class_name: str) -> tuple:
+        """Returns the arguments of `stream_file` for a file."""
+        if task.state is None:
+            return task.path, loader_class_name, self.config.batch_size
+        known_hash = task.known.content_hash if task.known else None
+        return (
+            task.path,
+            loader_class_name,
+            self.config.batch_size,
+            True,
+            known_hash,
+            task.checkpoint,
+        )
+
+    def _on_file_message(
+        self, task: _FileTask, message: tuple
+    ) -> Iterator[Tuple[_FileTask, List[Document]]]:
+        kind, *payload = message
+        if kind == _UNCHANGED:  # Touched, but with the same content
+            self._skip_unchanged(
+                replace(task.known, size=task.state.size, mtime=task.state.mtime),
+                changed=True,
+            )
+        elif kind == _STARTED:
+            content_hash, num_skipped = payload
+            task.num_read = task.num_indexed = task.num_checkpointed = num_skipped
+            if task.state is not None:
+                task.state.content_hash = content_hash
+            if num_skipped:
+                self.logger.info(
+                    f"Resuming {task.path} after {num_skipped} indexed documents"
+                )
+                task.state.source = task.checkpoint.source
+                if self.insertion_mode in ("incremental", "full"):
+                    self._kept_sources.append(
+                        (task.checkpoint.source, task.checkpoint.started_at)
+                    )
+        elif kind == _DOCUMENTS:
+            documents, parse_seconds = payload
+            self.stats["load"].record(
+                len(documents), time.perf_counter() - parse_seconds
+            )
+            if task.state is not None and task.state.source is None:
+                task.state.source = documents[0].metadata.get("source", task.state.path)
+            yield task, documents
+        elif kind == _FINISHED:
+            if task.state is not None:
+                task.state.source = task.state.source or task.state.path
+                self._file_states[task.state.path] = task.state
+        else:
+            self._on_file_error(task.path, payload[0])
+
+    def _resolve_loader(self, file_path: Path) -> Optional[str]:
+        try:
+            loader_class_name = resolve_loader(file_path, self.rag.llm)
+            if loader_class_name == "None":
+                raise Exception(f"No loader found for {file_path.suffix} files.")
+            return loader_class_name
+        except Exception as e:
+            self._on_file_error(file_path, e)
+            return None
+
+    def _on_file_error(self, file_path: Path, error: Exception) -> None:
+        if not self.skip_errors:
+            raise error
+        self.logger.exception(f"Failed to load {file_path}", exc_info=error)
+        self.failed_files.append(file_path)
+
+    def _batch_documents(self, documents: Iterable[Document]) -> Iterator[_Batch]:
+        batch = []
+        started_at = time.perf_counter()
+        for document in documents:
+            batch.append(document)
+            if len(batch) == self.config.batch_size:
+                self.stats["load"].record(len(batch), started_at)
+                yield _Batch(batch)
+                batch, started_at = [], time.perf_counter()
+        if batch:
+            self.stats["load"].record(len(batch), started_at)
+            yield _Batch(batch)
+
+    def _embed(self, record_manager: SQLRecordManager) -> None:
+        try:
+            while True:
+                batch = self._get(self._loaded)
+                if batch is _END_OF_STAGE:
+                    return
+                started_at = time.perf_counter()
+                if isinstance(self.rag.embeddings, PrefetchedEmbeddings):
+                    self.rag.embeddings.prefetch(
+                        self._new_texts(batch.documents, record_manager)
+                    )
+                self.stats["embed"].record(len(batch.documents), started_at)
+                if not self._put(self._embedded, batch):
+                    return
+        except BaseException as e:
+            self._errors.append(e)
+            self._stop.set()
+        finally:
+            self._put(self._embedded, _END_OF_STAGE)
+
+    def _new_texts(
+        self, documents: List[Document], record_manager: SQLRecordManager
+    ) -> List[str]:
+        """Returns the texts of the documents that are not indexed yet. index() skips
+        the others, they need no embedding."""
+        uids = [_HashedDocument.from_document(document).uid for document in documents]
+        return [
+            document.page_content
+            for document, exists in zip(documents, record_manager.exists(uids))
+            if not exists
+        ]
+
+    def _write(self, embedding_workers: int, record_manager: SQLRecordManager) -> dict:
+        index_start_dt = record_manager.get_time()
+        self._index_start_dt = index_start_dt
+
+        # index() runs the incremental cleanup after each batch, which deletes and
+        # re-adds the later batches of any source that spans several batches. The
+        # cleanup is done once per source after the writer is done instead.
+        incremental = self.insertion_mode == "incremental"
+        try:
+            indexing_output = index(
+                self._embedded_documents(embedding_workers, record_manager),
+                record_manager,
+                self.destination,
+                batch_size=self.config.batch_size,
+                cleanup=None if incremental else self.insertion_mode,
+                source_id_key="source",
+            )
+            if incremental:
+                indexing_output["num_deleted"] += self._delete_stale_records(
+                    record_manager, index_start_dt
+                )
+                if self.manifest is not None and self._directory is not None:
+                    indexing_output["num_deleted"] += self._delete_removed_files(
+                        record_manager
+                    )
+        finally:
+            if self.lexical_index is not None:
+                self.lexical_index.flush()
+        return indexing_output
+
+    def _delete_stale_records(
+        self, record_manager: SQLRecordManager, index_start_dt: float
+    ) -> int:
+        num_deleted = 0
+        sources = list(self._sources)
+        for i in range(0, len(sources), self.config.batch_size):
+            uids_to_delete = record_manager.list_keys(
+                group_ids=sources[i : i + self.config.batch_size],
+                before=index_start_dt,
+            )
+            if uids_to_delete:
+                self.destination.delete(uids_to_delete)
+                record_manager.delete_keys(uids_to_delete)
+                num_deleted += len(uids_to_delete)
+        return num_deleted
+
+    def _delete_removed_files(self, record_manager: SQLRecordManager) -> int:
+        """Deletes the documents of the files of the manifest that were under the
+        loaded directory and no longer exist."""
+        removed = [
+            state
+            for state in self.manifest.list()
+            if Path(state.path).is_relative_to(self._directory)
+            and not Path(state.path).exists()
+        ]
+        num_deleted = 0
+        sources = [state.source for state in removed]
+        for i in range(0, len(sources), self.config.batch_size):
+            uids_to_delete = record_manager.list_keys(
+                group_ids=sources[i : i + self.config.batch_size]
+            )
+            if uids_to_delete:
+                self.destination.delete(uids_to_delete)
+                record_manager.delete_keys(uids_to_delete)
+                num_deleted += len(uids_to_delete)
+        self.manifest.delete(state.path for state in removed)
+        return num_deleted
+
+    def _keep_unchanged_records(self, record_manager: SQLRecordManager) -> None:
+        """Refreshes the records of the unchanged files, and those indexed before the
+        checkpoint of resumed files, which are not indexed again, so that the cleanup
+        does not delete them."""
+        while self._kept_sources:
+            source, indexed_after = self._kept_sources.popleft()
+            if indexed_after is not None:
+                self._sources.add(source)
+                # Record manager times may be rounded to the millisecond
+                indexed_after -= 1e-3
+            uids = record_manager.list_keys(group_ids=[source], after=indexed_after)
+            if uids:
+                record_manager.update(uids, group_ids=[source] * len(uids))
+
+    def _checkpoint_files(self, positions: deque, num_written: int) -> None:
+        """Marks the documents written by `index` as indexed in their file, and
+        checkpoints the files indexed `checkpoint_interval` documents further."""
+        tasks = {}
+        while positions and positions[0][0] <= num_written:
+            _, task, position = positions.popleft()
+            task.mark_indexed(position)
+            tasks[id(task)] = task
+        for task in tasks.values():
+            num_unsaved = task.num_indexed - task.num_checkpointed
+            if num_unsaved < self.config.checkpoint_interval:
+                continue
+            if self.lexical_index is not None:
+                self.lexical_index.flush()
+            self.manifest.set_checkpoint(
+                Checkpoint(
+                    task.state.path,
+                    task.state.content_hash,
+                    task.state.source,
+                    task.num_indexed,
+                    self._index_start_dt,
+                )
+            )
+            task.num_checkpointed = task.num_indexed
+            self._checkpointed_files.add(task.state.path)
+
+    def _update_manifest(self) -> None:
+        self.manifest.set(self._file_states.values())
+        self.manifest.delete_checkpoints(
+            path for path in self._checkpointed_files if path in self._file_states
+        )
+        if self.insertion_mode == "full":
+            # The full cleanup deleted the documents of the files not loaded
+            self.manifest.delete(
+                state.path
+                for state in self.manifest.list()
+                if state.path not in self._file_states
+                and state.path not in self._kept_files
+            )
+
+    def _embedded_documents(
+        self, embedding_workers: int, record_manager: SQLRecordManager
+    ) -> Iterator[Document]:
+        finished_workers = 0
+        # Documents sent to index(), and the positions in their file of those whose
+        # file is checkpointed, until they are written
+        num_sent = 0
+        positions: deque = deque()
+        while finished_workers < embedding_workers:
+            self._keep_unchanged_records(record_manager)
+            # index() pulls the documents of a batch once the previous ones are written
+            num_written = num_sent - num_sent % self.config.batch_size
+            self._checkpoint_files(positions, num_written)
+            batch = self._get(self._embedded)
+            self._raise_stage_error()
+            if batch is _END_OF_STAGE:
+                finished_workers += 1
+                continue
+            for document, origin in zip(batch.documents, batch.origins or repeat(None)):
+                source = document.metadata.get("source")
+                if source is None and self.insertion_mode == "incremental":
+                    raise ValueError(
+                        "Source ids are required when cleanup mode is incremental. "
+                        "Document that starts with content: "
+                        f"{document.page_content[:100]} has no source."
+                    )
+                self._sources.add(source)
+                yield document
+                num_sent += 1
+                if origin is not None:
+                    positions.append((num_sent, *origin))
+            self.logger.info(f"Indexing: {num_sent} documents sent.")
+        self._raise_stage_error()
+        self._keep_unchanged_records(record_manager)
+
+    def _raise_stage_error(self) -> None:
+        """Raises the error of the load or embed stage in index(). Its input would
+        otherwise end as if complete, and its full cleanup would delete every
+        document that was not indexed before the error."""
+        if self._errors:
+            raise self._errors[0]
+
+    def _put(self, queue: Queue, item) -> bool:
+        while True:
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                if self._stop.is_set():
+                    return False
+
+    def _get(self, queue: Queue):
+        while True:
+            try:
+                return queue.get(timeout=0.1)
+            except Empty:
+                if self._stop.is_set() and queue.empty():
+                    return _END_OF_STAGE
@@ -0,0 +1,242 @@
+"""Inverted file (IVF) index used by LocalVectorStore for approximate search.
+
+The vectors are clustered with a spherical k-means, and every row of the store is
+assigned to its nearest cluster. A query only scores the rows of the `nprobe`
+clusters whose centroids are the most similar to it, which makes search time depend
+on the size of the clusters instead of the size of the index.
+"""
+
+import json
+import os
+import uuid
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+
+from backend.logger import get_logger
+
+# Rows appended since the posting lists were sorted that are scanned before sorting
+# them again, relative to the number of sorted rows
+MAX_UNSORTED_RATIO = 0.05
+MIN_UNSORTED_ROWS = 4096
+
+
+class IVFIndex:
+    """Clusters and cluster assignments of the rows of one store generation.
+
+    The centroids and the assignment of every row are persisted next to the vectors.
+    A build writes new files under a new build id and switches `ivf.json` to them
+    atomically. New rows are assigned to the existing clusters and appended, like the
+    vectors. Rows that are not assigned yet are scanned by every query.
+
+    Attributes:
+        path (Path): Directory of the store generation.
+        build_id (str): Identifies the centroids in use, None until built.
+        centroids (np.ndarray): Normalized cluster centroids, one per row.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.logger = get_logger()
+        self.build_id: Optional[str] = None
+        self.centroids: Optional[np.ndarray] = None
+        self._lists = np.zeros(0, dtype=np.int32)  # Cluster of every assigned row
+        self._order = np.zeros(0, dtype=np.int64)  # Sorted rows, grouped by cluster
+        self._bounds = np.zeros(1, dtype=np.int64)  # Start of every cluster in _order
+        self._num_sorted = 0
+
+    @property
+    def is_built(self) -> bool:
+        return self.centroids is not None
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids) if self.is_built else 0
+
+    def memory_usage(self) -> int:
+        arrays = (self.centroids, self._lists, self._order, self._bounds)
+        return sum(array.nbytes for array in arrays if array is not None)
+
+    def build(
+        self,
+        vectors: np.ndarray,
+        get_rows: Callable[[np.ndarray], np.ndarray],
+        nlist: Optional[int] = None,
+        training_sample_size: int = 64,
+        training_iterations: int = 10,
+        block_size: int = 65_536,
+    ) -> None:
+        """Trains the clusters on a sample of the rows, and assigns every row.
+
+        Args:
+            vectors (np.ndarray): The stored vectors, possibly memory-mapped.
+            get_rows (Callable): Returns the normalized float32 vectors of the given
+                rows, in the order they are given.
+            nlist (int): Number of clusters, defaults to 4 * sqrt(number of rows).
+            training_sample_size (int): Rows sampled per cluster to train them.
+            training_iterations (int): Number of k-means iterations.
+            block_size (int): Number of rows assigned at once.
+        """
+        num_rows = len(vectors)
+        nlist = min(nlist or int(4 * np.sqrt(num_rows)), num_rows)
+        rng = np.random.default_rng(0)
+        sample_size = min(num_rows, nlist * training_sample_size)
+        sample_rows = np.sort(rng.choice(num_rows, sample_size, replace=False))
+        centroids = _train_kmeans(
+            get_rows(sample_rows), nlist, training_iterations, rng, block_size
+        )
+
+        lists = np.concatenate(
+            [
+                _nearest(
+                    get_rows(np.arange(start, min(start + block_size, num_rows))),
+                    centroids,
+                )
+                for start in range(0, num_rows, block_size)
+            ]
+        )
+        self.write(self.path, centroids, lists)
+        self.logger.info(
+            f"Built an IVF index of {nlist} clusters over {num_rows} vectors"
+        )
+        self.refresh(num_rows)
+
+    @staticmethod
+    def write(path: Path, centroids: np.ndarray, lists: np.ndarray) -> None:
+        """Persists clusters and assignments under a new build id in `path`."""
+        build_id = uuid.uuid4().hex
+        np.save(path / f"ivf-{build_id}.centroids.npy", centroids.astype(np.float32))
+        lists.astype(np.int32).tofile(path / f"ivf-{build_id}.lists.bin")
+
+        meta_path = path / "ivf.json"
+        previous = json.loads(meta_path.read_text()) if meta_path.exists() else None
+        meta_tmp = path / f"ivf.json.{os.getpid()}.tmp"
+        meta_tmp.write_text(json.dumps({"build_id": build_id}))
+        meta_tmp.replace(meta_path)
+        if previous:
+            # Readers keep the previous centroids in memory until they reload
+            for name in ("centroids.npy", "lists.bin"):
+                (path / f"ivf-{previous['build_id']}.{name}").unlink(missing_ok=True)
+
+    def append(self, matrix: np.ndarray, first_row: int) -> None:
+        """Assigns new rows, starting at `first_row`, to their nearest cluster."""
+        if not self.is_built:
+            return
+        lists = _nearest(matrix, self.centroids).astype(np.int32)
+        with self._lists_path().open("ab") as file:
+            file.truncate(first_row * lists.itemsize)
+            file.write(lists.tobytes())
+
+    def get_lists(
+        self, rows: np.ndarray, get_rows: Callable[[np.ndarray], np.ndarray]
+    ) -> np.ndarray:
+        """Returns the cluster of the given rows, assigning those that are not yet."""
+        lists = np.empty(len(rows), dtype=np.int32)
+        assigned = rows < len(self._lists)
+        lists[assigned] = self._lists[rows[assigned]]
+        if not assigned.all():
+            lists[~assigned] = _nearest(get_rows(rows[~assigned]), self.centroids)
+        return lists
+
+    def refresh(self, num_rows: int) -> None:
+        """Loads a new build, or the assignments of the rows committed since the last
+        refresh."""
+        meta_path = self.path / "ivf.json"
+        if not meta_path.exists():
+            self.build_id, self.centroids = None, None
+            return
+        build_id = json.loads(meta_path.read_text())["build_id"]
+        if build_id != self.build_id:
+            try:
+                centroids = np.load(self.path / f"ivf-{build_id}.centroids.npy")
+            except FileNotFoundError:
+                return  # Replaced by a newer build meanwhile, loaded on next refresh
+            self.build_id, self.centroids = build_id, centroids
+            self._lists = np.zeros(0, dtype=np.int32)
+            self._num_sorted = 0
+            self._sort(0)
+
+        lists_path = self._lists_path()
+        size = lists_path.stat().st_size if lists_path.exists() else 0
+        # Assignments past the committed rows may be rewritten by the writer
+        size = min(size, num_rows * self._lists.itemsize)
+        known_size = len(self._lists) * self._lists.itemsize
+        if size > known_size:
+            new_lists = np.fromfile(
+                lists_path,
+                dtype=np.int32,
+                count=(size - known_size) // self._lists.itemsize,
+                offset=known_size,
+            )
+            self._lists = np.concatenate([self._lists, new_lists])
+
+    def candidates(self, query: np.ndarray, nprobe: int, num_rows: int) -> np.ndarray:
+        """Returns the sorted rows of the `nprobe` clusters nearest to the query, and
+        the rows not assigned to a cluster yet."""
+        num_assigned = min(len(self._lists), num_rows)
+        num_unsorted = num_assigned - self._num_sorted
+        if num_unsorted > max(MIN_UNSORTED_ROWS, MAX_UNSORTED_RATIO * self._num_sorted):
+            self._sort(num_assigned)
+
+        nprobe = min(nprobe, self.nlist)
+        similarities = self.centroids @ query
+        probed = np.argpartition(-similarities, nprobe - 1)[:nprobe]
+        parts = [
+            self._order[self._bounds[list_] : self._bounds[list_ + 1]]
+            for list_ in probed
+        ]
+
+        unsorted_rows = np.arange(self._num_sorted, num_assigned)
+        parts.append(unsorted_rows[np.isin(self._lists[unsorted_rows], probed)])
+        parts.append(np.arange(num_assigned, num_rows))  # Not assigned yet
+        rows = np.concatenate(parts)
+        return np.sort(rows[rows < num_rows])
+
+    def _sort(self, num_rows: int) -> None:
+        lists = self._lists[:num_rows]
+        self._order = np.argsort(lists, kind="stable")
+        self._bounds = np.searchsorted(
+            lists[self._order], np.arange(self.nlist + 1), side="left"
+        )
+        self._num_sorted = num_rows
+
+    def _lists_path(self) -> Path:
+        return self.path / f"ivf-{self.build_id}.lists.bin"
+
+
+def _train_kmeans(
+    sample: np.ndarray,
+    nlist: int,
+    iterations: int,
+    rng: np.random.Generator,
+    block_size: int,
+) -> np.ndarray:
+    """Spherical k-means: centroids are normalized, similarity is the dot product."""
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+    for _ in range(iterations):
+        assignments = np.concatenate(
+            [
+                _nearest(sample[start : start + block_size], centroids)
+                for start in range(0, len(sample), block_size)
+            ]
+        )
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=nlist)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        non_empty = counts > 0
+        sums = np.add.reduceat(sample[order], starts[non_empty], axis=0)
+
+        centroids = centroids.copy()
+        centroids[non_empty] = sums
+        # Empty clusters are moved to random vectors of the sample
+        empty = np.flatnonzero(~non_empty)
+        centroids[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids /= norms
+    return centroids.astype(np.float32)
+
+
+def _nearest(matrix: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    return np.argmax(matrix @ centroids.T, axis=1).astype(np.int32)
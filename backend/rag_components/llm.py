@@ -12,8 +12,12 @@ LLM_PROVIDERS = {
 
 
 def get_llm_model(config, callbacks: List[BaseCallbackHandler] = []):
-    source = config.llm.source
-    source_config = config.llm.source_config
+    return get_llm_from_config(config.llm, callbacks)
+
+
+def get_llm_from_config(llm_config, callbacks: List[BaseCallbackHandler] = []):
+    source = llm_config.source
+    source_config = llm_config.source_config
 
     # If already an instance, return directly
     if not isinstance(source, str):
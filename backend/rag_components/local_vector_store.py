@@ -0,0 +1,637 @@
+"""First-party vector store keeping its embeddings in memory-mapped NumPy files.
+
+The index is a directory of append-only files: the vectors, a JSON line per document
+with its text and metadata, and the list of deleted rows. Searches map the vector
+file in memory instead of loading it, so every process serving the same index
+shares the pages cached by the OS. Deleted documents are skipped until the index is
+compacted into a new generation of files.
+"""
+
+import json
+import os
+import shutil
+import uuid
+from pathlib import Path
+from threading import RLock
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from backend.config import AnnIndexConfig
+from backend.logger import get_logger
+from backend.rag_components.ivf_index import IVFIndex
+from backend.rag_components.metadata_filter import AttributeIndex
+
+# Storage type of the vectors and the number of bytes of one component
+DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+# Largest int8 component, vectors are scaled so that their largest one maps to it
+INT8_MAX = 127
+
+# Share of the rows matching a filter above which scanning every row and masking the
+# others is faster than gathering the matching rows
+DENSE_FILTER_RATIO = 0.25
+
+# Approximate size of an entry of the id to row mapping: the key, the row and the slot
+_BYTES_PER_ID = 150
+
+
+class LocalVectorStore(VectorStore):
+    """Vector store backed by memory-mapped NumPy files, with exact cosine search.
+
+    Vectors are normalized and stored as float32, float16, or int8 with a scale per
+    row. Adding documents appends to the files, deleting them appends their rows to
+    a tombstone file. Once deleted rows make up `compaction_threshold` of the index,
+    live rows are rewritten in a new generation directory, and the `CURRENT` file is
+    switched to it atomically. Processes reading the index pick up new rows and new
+    generations on their next search.
+
+    When `ann_index` is enabled, an IVF index is built over the vectors once there
+    are `ann_index.min_vectors` of them, and searches only score the rows of the
+    `nprobe` clusters nearest to the query. Pass `exact=True` to a search to score
+    every row regardless.
+
+    Searches take a metadata `filter`, see `backend.rag_components.metadata_filter`.
+    The metadata of the rows are indexed in memory on the first filtered search, and
+    a filtered search only scores the rows matching the filter, so that its cost
+    depends on the number of matching rows rather than on the size of the index.
+
+    Only one process should write to an index at a time.
+
+    Attributes:
+        embedding (Embeddings): The model embedding the texts and the queries.
+        persist_directory (Path): Directory holding the collections.
+        collection_name (str): Name of the index, a subdirectory of
+            `persist_directory`.
+        dtype (str): Storage type of the vectors: "float32", "float16" or "int8".
+        block_size (int): Number of rows scored at once by a search.
+        compaction_threshold (float): Share of deleted rows that triggers a
+            compaction, None to only compact when `compact` is called.
+        ann_index (AnnIndexConfig): Approximate search settings.
+    """
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        persist_directory: str = "vector_database/",
+        collection_name: str = "default",
+        dtype: str = "float32",
+        block_size: int = 65_536,
+        compaction_threshold: Optional[float] = 0.3,
+        ann_index: Optional[AnnIndexConfig] = None,
+    ):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported dtype {dtype}, use one of {list(DTYPES)}")
+        self.embedding = embedding
+        self.persist_directory = Path(persist_directory)
+        self.collection_name = collection_name
+        self.dtype = dtype
+        self.block_size = block_size
+        self.compaction_threshold = compaction_threshold
+        self.ann_index = ann_index or AnnIndexConfig()
+        self.logger = get_logger()
+
+        self.path = self.persist_directory / collection_name
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._lock = RLock()
+        self._version = None  # Identifies the state of the files currently mapped
+        self._generation: Optional[str] = None
+        self._dim: Optional[int] = None
+        self._vectors: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        self._offsets = np.zeros(0, dtype=np.int64)
+        self._deleted = np.zeros(0, dtype=bool)
+        self._row_by_id: Optional[Dict[str, int]] = None  # Loaded by the writer only
+        self._ivf: Optional[IVFIndex] = None
+        self._attributes: Optional[AttributeIndex] = None  # Built on first filter
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return int(len(self._offsets) - self._deleted.sum())
+
+    def memory_usage(self) -> int:
+        """Estimates the bytes held by the mapped vectors and the in-memory indexes.
+
+        Mapped vectors are counted whole, as exact searches read all of them.
+        """
+        with self._lock:
+            arrays = (self._vectors, self._scales, self._offsets, self._deleted)
+            usage = sum(array.nbytes for array in arrays if array is not None)
+            if self._row_by_id is not None:
+                usage += len(self._row_by_id) * _BYTES_PER_ID
+            if self._ivf is not None:
+                usage += self._ivf.memory_usage()
+            if self._attributes is not None:
+                usage += self._attributes.memory_usage()
+            return usage
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        vectors = self.embedding.embed_documents(texts)
+        return self.add_vectors(vectors, texts, metadatas, ids)
+
+    def add_vectors(
+        self,
+        vectors: List[List[float]],
+        texts: List[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+    ) -> List[str]:
+        """Appends documents whose vectors are already computed.
+
+        Documents whose id is already in the index replace the previous version.
+        """
+        metadatas = metadatas or [{} for _ in texts]
+        ids = [str(id_) for id_ in ids] if ids else [str(uuid.uuid4()) for _ in texts]
+        matrix = _normalize(np.asarray(vectors, dtype=np.float32))
+
+        with self._lock:
+            self._refresh()
+            if self._dim is None:
+                self._create_generation(matrix.shape[1])
+            elif matrix.shape[1] != self._dim:
+                raise ValueError(
+                    f"Vectors have {matrix.shape[1]} dimensions, the index has"
+                    f" {self._dim}"
+                )
+
+            row_by_id = self._get_row_by_id()
+            replaced = [row_by_id[id_] for id_ in ids if id_ in row_by_id]
+            if replaced:
+                self._append_deleted(replaced)
+
+            generation_path = self._generation_path()
+            first_row = len(self._offsets)
+            stored, scales = self._quantize(matrix)
+            # Rows written by an interrupted append were never committed
+            self._append_rows(generation_path / "vectors.bin", stored, first_row)
+            if scales is not None:
+                self._append_rows(generation_path / "scales.bin", scales, first_row)
+            if self._ivf is not None:
+                self._ivf.append(matrix, first_row)
+
+            records_path = generation_path / "records.jsonl"
+            offset = records_path.stat().st_size if records_path.exists() else 0
+            offsets = []
+            with records_path.open("ab") as file:
+                for id_, text, metadata in zip(ids, texts, metadatas):
+                    line = json.dumps(
+                        {"id": id_, "text": text, "metadata": metadata}
+                    ).encode("utf-8")
+                    file.write(line + b"\n")
+                    offsets.append(offset)
+                    offset += len(line) + 1
+
+            # The offsets are written last, they commit the new rows
+            with (generation_path / "offsets.bin").open("ab") as file:
+                file.write(np.asarray(offsets, dtype=np.int64).tobytes())
+            for row, id_ in enumerate(ids, start=first_row):
+                row_by_id[id_] = row
+            self._refresh()
+
+            if (
+                self.ann_index.enabled
+                and not self._ivf.is_built
+                and len(self._offsets) >= self.ann_index.min_vectors
+            ):
+                self.build_index()
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if not ids:
+            return False
+        with self._lock:
+            self._refresh()
+            row_by_id = self._get_row_by_id()
+            rows = [row_by_id.pop(str(id_)) for id_ in ids if str(id_) in row_by_id]
+            if rows:
+                self._append_deleted(rows)
+                self._refresh()
+            if (
+                self.compaction_threshold is not None
+                and len(self._offsets)
+                and self._deleted.mean() >= self.compaction_threshold
+            ):
+                self.compact()
+        return True
+
+    def get_by_ids(self, ids: List[str], /) -> List[Document]:
+        with self._lock:
+            self._refresh()
+            row_by_id = self._get_row_by_id()
+            rows = [row_by_id[str(id_)] for id_ in ids if str(id_) in row_by_id]
+            return self._read_documents(rows)
+
+    def similarity_search(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        vector = self.embedding.embed_query(query)
+        return self.similarity_search_by_vector_with_score(vector, k, **kwargs)
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        results = self.similarity_search_by_vector_with_score(embedding, k, **kwargs)
+        return [doc for doc, _ in results]
+
+    def similarity_search_by_vector_with_score(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vectors_with_score([embedding], k, **kwargs)[0]
+
+    def similarity_search_by_vectors_with_score(
+        self, embeddings: List[List[float]], k: int = 4, **kwargs: Any
+    ) -> List[List[Tuple[Document, float]]]:
+        """Searches the `k` nearest documents of several query vectors at once.
+
+        Without an IVF index, the index is scanned once for all the queries. With a
+        filter, only the rows matching it are scored. The IVF index is then only used
+        if they outnumber the rows of the clusters it would scan.
+
+        Args:
+            embeddings (List[List[float]]): The query vectors.
+            k (int): Number of documents returned per query.
+            filter (dict): Only documents whose metadata match it are returned.
+            nprobe (int): Clusters of the IVF index scanned per query, defaults to
+                `ann_index.nprobe`.
+            exact (bool): Scores every row even if an IVF index is built.
+        """
+        queries = _normalize(np.asarray(embeddings, dtype=np.float32))
+        with self._lock:
+            self._refresh()
+            allowed_rows = None
+            if kwargs.get("filter"):
+                allowed_rows = self._filter_rows(kwargs["filter"])
+            nprobe = kwargs.get("nprobe") or self.ann_index.nprobe
+            use_ivf = self._ivf and self._ivf.is_built and not kwargs.get("exact")
+            if use_ivf and allowed_rows is not None:
+                scanned_rows = len(self._offsets) * min(nprobe, self._ivf.nlist)
+                use_ivf = len(allowed_rows) * self._ivf.nlist > scanned_rows
+            if use_ivf:
+                rows, scores = self._search_ivf(queries, k, nprobe, allowed_rows)
+            else:
+                rows, scores = self._search(queries, k, allowed_rows)
+            results = []
+            for query_rows, query_scores in zip(rows, scores):
+                documents = self._read_documents(query_rows)
+                results.append(list(zip(documents, map(float, query_scores))))
+        return results
+
+    def compact(self) -> None:
+        """Rewrites the live rows in a new generation, without the deleted ones."""
+        with self._lock:
+            self._refresh()
+            if self._dim is None or not self._deleted.any():
+                return
+            old_path = self._generation_path()
+            live_rows = np.flatnonzero(~self._deleted)
+            new_generation = uuid.uuid4().hex
+            new_path = self.path / new_generation
+            new_path.mkdir()
+
+            if self._ivf and self._ivf.is_built:
+                # Rows of a cluster become contiguous, queries read fewer pages
+                lists = self._ivf.get_lists(live_rows, self._get_rows)
+                order = np.argsort(lists, kind="stable")
+                live_rows = live_rows[order]
+                IVFIndex.write(new_path, self._ivf.centroids, lists[order])
+
+            with (new_path / "vectors.bin").open("wb") as file:
+                for block in _blocks(live_rows, self.block_size):
+                    file.write(np.ascontiguousarray(self._vectors[block]).tobytes())
+            if self._scales is not None:
+                self._scales[live_rows].tofile(new_path / "scales.bin")
+
+            offsets = []
+            source_path = old_path / "records.jsonl"
+            records_path = new_path / "records.jsonl"
+            with source_path.open("rb") as source, records_path.open("wb") as records:
+                offset = 0
+                for row in live_rows:
+                    source.seek(self._offsets[row])
+                    line = source.readline()
+                    records.write(line)
+                    offsets.append(offset)
+                    offset += len(line)
+            np.asarray(offsets, dtype=np.int64).tofile(new_path / "offsets.bin")
+            (new_path / "deleted.bin").touch()
+            (new_path / "meta.json").write_text(
+                json.dumps({"dim": self._dim, "dtype": self.dtype})
+            )
+
+            current_tmp = self.path / f"CURRENT.{os.getpid()}.tmp"
+            current_tmp.write_text(new_generation)
+            current_tmp.replace(self.path / "CURRENT")
+            self.logger.info(
+                f"Compacted {self.collection_name}: {len(self._offsets)} rows down to"
+                f" {len(live_rows)}"
+            )
+            self._row_by_id = None
+            self._refresh()
+            # Mapped files stay readable by other processes until they remap
+            shutil.rmtree(old_path, ignore_errors=True)
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> "LocalVectorStore":
+        store = cls(embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
+
+    def build_index(self, nlist: Optional[int] = None) -> None:
+        """Trains the clusters of the IVF index on the current vectors and assigns
+        every row to one. Rebuilding an index that grew a lot restores its recall."""
+        with self._lock:
+            self._refresh()
+            if not len(self._offsets):
+                return
+            if self._ivf is None:
+                self._ivf = IVFIndex(self._generation_path())
+            self._ivf.build(
+                self._vectors,
+                self._get_rows,
+                nlist=nlist or self.ann_index.nlist,
+                training_sample_size=self.ann_index.training_sample_size,
+                training_iterations=self.ann_index.training_iterations,
+                block_size=self.block_size,
+            )
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        # Scores are cosine similarities already
+        return lambda score: score
+
+    def _search(
+        self, queries: np.ndarray, k: int, rows: Optional[np.ndarray] = None
+    ) -> Tuple[List, List]:
+        """Scores every live row against the queries, or only the given live rows,
+        one block of rows at a time, and keeps the `k` best of each query."""
+        num_rows = len(self._offsets)
+        if self._vectors is None or num_rows == 0 or k <= 0:
+            return [[] for _ in queries], [[] for _ in queries]
+
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for block_rows, scores in self._score_blocks(queries, rows):
+            block_rows = np.broadcast_to(block_rows, scores.shape)
+            best_rows = np.concatenate([best_rows, block_rows], axis=1)
+            best_scores = np.concatenate([best_scores, scores], axis=1)
+            if best_scores.shape[1] > k:
+                top = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_rows = np.take_along_axis(best_rows, top, axis=1)
+                best_scores = np.take_along_axis(best_scores, top, axis=1)
+
+        order = np.argsort(-best_scores, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        live = np.isfinite(best_scores)
+        return (
+            [rows[mask].tolist() for rows, mask in zip(best_rows, live)],
+            [scores[mask].tolist() for scores, mask in zip(best_scores, live)],
+        )
+
+    def _score_blocks(
+        self, queries: np.ndarray, rows: Optional[np.ndarray]
+    ) -> Iterable[Tuple[np.ndarray, np.ndarray]]:
+        """Yields blocks of rows and their scores against the queries, deleted rows
+        and rows not given scored -inf."""
+        num_rows = len(self._offsets)
+        excluded = self._deleted
+        if rows is not None:
+            if len(rows) < DENSE_FILTER_RATIO * num_rows:
+                # Only reads the pages of the given rows
+                for block_rows in _blocks(rows, self.block_size):
+                    yield block_rows, queries @ self._get_rows(block_rows).T
+                return
+            excluded = np.ones(num_rows, dtype=bool)
+            excluded[rows] = False
+
+        for start in range(0, num_rows, self.block_size):
+            end = min(start + self.block_size, num_rows)
+            block = np.asarray(self._vectors[start:end], dtype=np.float32)
+            scores = queries @ block.T
+            if self._scales is not None:
+                scores *= self._scales[start:end]
+            scores[:, excluded[start:end]] = -np.inf
+            yield np.arange(start, end), scores
+
+    def _search_ivf(
+        self,
+        queries: np.ndarray,
+        k: int,
+        nprobe: int,
+        allowed_rows: Optional[np.ndarray] = None,
+    ) -> Tuple[List, List]:
+        """Scores the rows of the `nprobe` clusters nearest to each query, among the
+        allowed rows if given."""
+        num_rows = len(self._offsets)
+        all_rows, all_scores = [], []
+        for query in queries:
+            rows = self._ivf.candidates(query, nprobe, num_rows)
+            if allowed_rows is not None:
+                rows = np.intersect1d(rows, allowed_rows, assume_unique=True)
+            rows = rows[~self._deleted[rows]]
+            scores = self._get_rows(rows) @ query
+            if len(rows) > k:
+                top = np.argpartition(-scores, k - 1)[:k]
+                rows, scores = rows[top], scores[top]
+            order = np.argsort(-scores)
+            all_rows.append(rows[order].tolist())
+            all_scores.append(scores[order].tolist())
+        return all_rows, all_scores
+
+    def _get_rows(self, rows: np.ndarray) -> np.ndarray:
+        """Returns the stored vectors of the given rows as float32."""
+        matrix = np.asarray(self._vectors[rows], dtype=np.float32)
+        if self._scales is not None:
+            matrix *= self._scales[rows][:, None]
+        return matrix
+
+    def _filter_rows(self, filter: dict) -> np.ndarray:
+        """Returns the sorted live rows whose metadata match the filter."""
+        num_rows = len(self._offsets)
+        if self._attributes is None:
+            self._attributes = AttributeIndex()
+        if self._attributes.num_rows < num_rows:
+            # Rows added since, by this process or another
+            new_rows = range(self._attributes.num_rows, num_rows)
+            self._attributes.add(
+                record["metadata"] for record in self._read_records(new_rows)
+            )
+        rows = self._attributes.rows(filter)
+        rows = rows[rows < num_rows]
+        return rows[~self._deleted[rows]]
+
+    def _read_documents(self, rows: List[int]) -> List[Document]:
+        return [
+            Document(
+                page_content=record["text"],
+                metadata=record["metadata"],
+                id=record["id"],
+            )
+            for record in self._read_records(rows)
+        ]
+
+    def _read_records(self, rows: Iterable[int]) -> Iterator[dict]:
+        with (self._generation_path() / "records.jsonl").open("rb") as file:
+            for row in rows:
+                file.seek(self._offsets[row])
+                yield json.loads(file.readline())
+
+    def _quantize(self, matrix: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        if self.dtype != "int8":
+            return matrix.astype(DTYPES[self.dtype]), None
+        scales = np.abs(matrix).max(axis=1) / INT8_MAX
+        scales[scales == 0] = 1.0
+        quantized = np.round(matrix / scales[:, None]).astype(np.int8)
+        return quantized, scales.astype(np.float32)
+
+    def _get_row_by_id(self) -> Dict[str, int]:
+        if self._row_by_id is None:
+            self._row_by_id = {}
+            if self._generation and len(self._offsets):
+                live_rows = np.flatnonzero(~self._deleted)
+                for row, document in zip(live_rows, self._read_documents(live_rows)):
+                    self._row_by_id[document.id] = int(row)
+        return self._row_by_id
+
+    def _append_rows(self, path: Path, rows: np.ndarray, first_row: int) -> None:
+        with path.open("ab") as file:
+            file.truncate(first_row * rows[0].nbytes)
+            file.write(rows.tobytes())
+
+    def _append_deleted(self, rows: List[int]) -> None:
+        with (self._generation_path() / "deleted.bin").open("ab") as file:
+            file.write(np.asarray(rows, dtype=np.int64).tobytes())
+
+    def _create_generation(self, dim: int) -> None:
+        generation = uuid.uuid4().hex
+        generation_path = self.path / generation
+        generation_path.mkdir()
+        (generation_path / "meta.json").write_text(
+            json.dumps({"dim": dim, "dtype": self.dtype})
+        )
+        for name in ("vectors.bin", "offsets.bin", "deleted.bin"):
+            (generation_path / name).touch()
+        (self.path / "CURRENT").write_text(generation)
+        self._refresh()
+
+    def _generation_path(self) -> Path:
+        return self.path / self._generation
+
+    def _refresh(self) -> None:
+        """Maps the files again if another process or thread changed them."""
+        current_path = self.path / "CURRENT"
+        if not current_path.exists():
+            return
+        generation = current_path.read_text().strip()
+        generation_path = self.path / generation
+        try:
+            version = (
+                generation,
+                (generation_path / "offsets.bin").stat().st_size,
+                (generation_path / "deleted.bin").stat().st_size,
+            )
+        except FileNotFoundError:
+            return  # A compaction is switching generations, keep the current mapping
+        if version == self._version:
+            if self._ivf is not None:
+                self._ivf.refresh(len(self._offsets))  # Picks up a new build
+            return
+
+        if generation != self._generation:
+            meta = json.loads((generation_path / "meta.json").read_text())
+            if meta["dtype"] != self.dtype:
+                self.logger.warning(
+                    f"{self.collection_name} is stored as {meta['dtype']}, ignoring"
+                    f" dtype {self.dtype}"
+                )
+                self.dtype = meta["dtype"]
+            self._dim = meta["dim"]
+            self._generation = generation
+            self._row_by_id = None
+            self._attributes = None
+            self._ivf = IVFIndex(generation_path) if self.ann_index.enabled else None
+
+        # Rows and deletions are only ever appended within a generation
+        _, offsets_size, deleted_size = version
+        if self._version and self._version[0] == generation:
+            _, known_offsets_size, known_deleted_size = self._version
+        else:
+            known_offsets_size, known_deleted_size = 0, 0
+            self._offsets = np.zeros(0, dtype=np.int64)
+            self._deleted = np.zeros(0, dtype=bool)
+        new_offsets = np.fromfile(
+            generation_path / "offsets.bin",
+            dtype=np.int64,
+            count=(offsets_size - known_offsets_size) // 8,
+            offset=known_offsets_size,
+        )
+        self._offsets = np.concatenate([self._offsets, new_offsets])
+        num_rows = len(self._offsets)
+        self._deleted = np.concatenate(
+            [self._deleted, np.zeros(num_rows - len(self._deleted), dtype=bool)]
+        )
+        deleted_rows = np.fromfile(
+            generation_path / "deleted.bin",
+            dtype=np.int64,
+            count=(deleted_size - known_deleted_size) // 8,
+            offset=known_deleted_size,
+        )
+        self._deleted[deleted_rows[deleted_rows < num_rows]] = True
+
+        self._vectors, self._scales = None, None
+        if num_rows:
+            self._vectors = np.memmap(
+                generation_path / "vectors.bin",
+                dtype=DTYPES[self.dtype],
+                mode="r",
+                shape=(num_rows, self._dim),
+            )
+            if self.dtype == "int8":
+                self._scales = np.memmap(
+                    generation_path / "scales.bin",
+                    dtype=np.float32,
+                    mode="r",
+                    shape=(num_rows,),
+                )
+        if self._ivf is not None:
+            self._ivf.refresh(num_rows)
+        self._version = version
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _blocks(rows: np.ndarray, size: int) -> Iterable[np.ndarray]:
+    for start in range(0, len(rows), size):
+        yield rows[start : start + size]
@@ -0,0 +1,429 @@
+"""Restricts retrieval to the documents whose metadata match a filter.
+
+Filters use the syntax of Chroma and MongoDB. A filter maps metadata keys to a value,
+or to conditions on the value, and matches the documents satisfying all of them:
+
+    {"source": "report.pdf", "year": {"$gte": 2020}, "type": {"$in": ["pdf", "md"]}}
+
+Conditions are `$eq`, `$ne`, `$in`, `$nin`, `$gt`, `$gte`, `$lt`, `$lte` and
+`$exists`, and filters can be combined with `$and` and `$or`. A metadata value that is
+a list matches when one of its items does.
+
+A filter is given per request in the `filter` of the `configurable` section of the
+config, or in the `filter` of the chain input, next to the question.
+"""
+
+from datetime import date
+from functools import reduce
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Union
+
+import numpy as np
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables.base import Input, Output, RunnableBindingBase
+from langchain_core.runnables.config import patch_config
+from langchain_core.runnables.utils import (
+    ConfigurableFieldSpec,
+    get_unique_config_specs,
+)
+from pydantic import BaseModel, create_model
+
+# Key of the filter in the chain input and in the `configurable` section of a config
+FILTER_KEY = "filter"
+
+RANGE_OPERATORS = ("$gt", "$gte", "$lt", "$lte")
+FIELD_OPERATORS = ("$eq", "$ne", "$in", "$nin", "$exists", *RANGE_OPERATORS)
+
+# Sizes of a Python int and of a list slot, to estimate the memory of AttributeIndex
+_BYTES_PER_INT = 28
+_BYTES_PER_SLOT = 8
+
+
+def get_filter(config: Optional[RunnableConfig]) -> Optional[dict]:
+    """Returns the filter of a request's config, if any."""
+    return ((config or {}).get("configurable") or {}).get(FILTER_KEY) or None
+
+
+def combine_filters(*filters: Optional[dict]) -> Optional[dict]:
+    """Returns a filter matching the documents matched by all of the filters given.
+
+    Filters of several keys are split into an `$and` of one key each, the form Chroma
+    expects.
+    """
+    clauses = []
+    for filter in filters:
+        if not filter:
+            continue
+        for key, condition in filter.items():
+            if key == "$and":
+                clauses.extend(condition)
+            else:
+                clauses.append({key: condition})
+    if not clauses:
+        return None
+    if len(clauses) == 1:
+        return clauses[0]
+    return {"$and": clauses}
+
+
+def matches(metadata: dict, filter: Optional[dict]) -> bool:
+    """Whether document metadata match a filter, for the stores without index."""
+    if not filter:
+        return True
+    for key, condition in filter.items():
+        if key == "$and":
+            if not all(matches(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(metadata, clause) for clause in condition):
+                return False
+        elif key.startswith("$"):
+            raise ValueError(f"Unsupported filter operator {key}")
+        elif not _matches_condition(metadata, key, condition):
+            return False
+    return True
+
+
+def _matches_condition(metadata: dict, key: str, condition: Any) -> bool:
+    if key not in metadata:
+        return isinstance(condition, dict) and condition.get("$exists") is False
+    values = metadata[key] if isinstance(metadata[key], list) else [metadata[key]]
+    values = [_value_key(value) for value in values]
+    for operator, operand in _conditions(condition):
+        if operator == "$exists":
+            satisfied = bool(operand)
+        elif operator == "$eq":
+            satisfied = _value_key(operand) in values
+        elif operator == "$ne":
+            satisfied = _value_key(operand) not in values
+        elif operator == "$in":
+            satisfied = any(_value_key(item) in values for item in operand)
+        elif operator == "$nin":
+            satisfied = not any(_value_key(item) in values for item in operand)
+        else:
+            kind, bound = _value_key(operand)
+            satisfied = any(
+                value_kind == kind and _compare(operator, value, bound)
+                for value_kind, value in values
+            )
+        if not satisfied:
+            return False
+    return True
+
+
+class AttributeIndex:
+    """Index of the metadata of the rows of a vector store, to find the rows matching a
+    filter without reading the metadata of every row.
+
+    Each value of a key has the sorted array of the rows that have it, so that
+    equality and `$in` conditions cost the number of rows matching them. Range
+    conditions binary search the values of the key, sorted with their rows, and cost
+    the number of rows in the range. Strings, such as ISO dates, are ordered as
+    strings, and only compared to strings.
+
+    Rows are numbered in the order they are added. Deleted rows are not tracked, the
+    caller removes them from the results.
+
+    Attributes:
+        num_rows (int): Number of rows indexed.
+    """
+
+    def __init__(self):
+        self.num_rows = 0
+        self._postings: Dict[str, Dict[tuple, List[int]]] = {}
+        self._present: Dict[str, List[int]] = {}
+        # Arrays built from the lists above on first use, until rows are added
+        self._arrays: Dict[tuple, np.ndarray] = {}
+        self._sorted: Dict[tuple, tuple] = {}
+
+    def add(self, metadatas: Iterable[dict]) -> None:
+        """Indexes the metadata of the next rows."""
+        for row, metadata in enumerate(metadatas, start=self.num_rows):
+            for key, value in metadata.items():
+                if isinstance(value, list):
+                    value_keys = {_value_key(v) for v in value if _is_scalar(v)}
+                    if not value_keys:
+                        continue
+                elif _is_scalar(value):
+                    value_keys = (_value_key(value),)
+                else:
+                    continue
+                postings = self._postings.setdefault(key, {})
+                for value_key in value_keys:
+                    postings.setdefault(value_key, []).append(row)
+                self._present.setdefault(key, []).append(row)
+            self.num_rows = row + 1
+        self._arrays.clear()
+        self._sorted.clear()
+
+    def memory_usage(self) -> int:
+        """Estimates the bytes held by the index: one int object per row, a list slot
+        per posting, and the arrays built from the lists."""
+        num_postings = sum(
+            len(rows)
+            for postings in self._postings.values()
+            for rows in postings.values()
+        )
+        num_postings += sum(len(rows) for rows in self._present.values())
+        arrays = [*self._arrays.values()]
+        for sorted_arrays in self._sorted.values():
+            arrays.extend(sorted_arrays)
+        return (
+            self.num_rows * _BYTES_PER_INT
+            + num_postings * _BYTES_PER_SLOT
+            + sum(array.nbytes for array in arrays if isinstance(array, np.ndarray))
+        )
+
+    def rows(self, filter: dict) -> np.ndarray:
+        """Returns the sorted rows matching the filter."""
+        clauses = []
+        for key, condition in filter.items():
+            if key == "$and":
+                clauses.extend(self.rows(clause) for clause in condition)
+            elif key == "$or":
+                clauses.append(_union(self.rows(clause) for clause in condition))
+            elif key.startswith("$"):
+                raise ValueError(f"Unsupported filter operator {key}")
+            else:
+                clauses.append(self._field_rows(key, condition))
+        if not clauses:
+            return np.arange(self.num_rows)
+        return _intersection(clauses)
+
+    def _field_rows(self, key: str, condition: Any) -> np.ndarray:
+        clauses = []
+        bounds = {}
+        for operator, operand in _conditions(condition):
+            if operator == "$eq":
+                clauses.append(self._posting(key, _value_key(operand)))
+            elif operator == "$in":
+                clauses.append(
+                    _union(self._posting(key, _value_key(item)) for item in operand)
+                )
+            elif operator == "$ne":
+                excluded = self._posting(key, _value_key(operand))
+                clauses.append(np.setdiff1d(self._present_rows(key), excluded, True))
+            elif operator == "$nin":
+                excluded = _union(self._posting(key, _value_key(i)) for i in operand)
+                clauses.append(np.setdiff1d(self._present_rows(key), excluded, True))
+            elif operator == "$exists":
+                present = self._present_rows(key)
+                if not operand:
+                    present = np.setdiff1d(np.arange(self.num_rows), present, True)
+                clauses.append(present)
+            else:
+                bounds[operator] = _value_key(operand)
+        if bounds:
+            clauses.append(self._range(key, bounds))
+        if not clauses:
+            return self._present_rows(key)
+        return _intersection(clauses)
+
+    def _posting(self, key: str, value_key: tuple) -> np.ndarray:
+        cache_key = (key, value_key)
+        if cache_key not in self._arrays:
+            rows = self._postings.get(key, {}).get(value_key, [])
+            self._arrays[cache_key] = np.asarray(rows, dtype=np.int64)
+        return self._arrays[cache_key]
+
+    def _present_rows(self, key: str) -> np.ndarray:
+        cache_key = (key, None)
+        if cache_key not in self._arrays:
+            rows = self._present.get(key, [])
+            self._arrays[cache_key] = np.asarray(rows, dtype=np.int64)
+        return self._arrays[cache_key]
+
+    def _range(self, key: str, bounds: Dict[str, tuple]) -> np.ndarray:
+        kinds = {kind for kind, _ in bounds.values()}
+        if len(kinds) > 1 or not kinds <= {"number", "string"}:
+            return np.zeros(0, dtype=np.int64)  # Bounds that can not be ordered
+        kind = kinds.pop()
+        values, rows = self._sorted_values(key, kind)
+        start, end = 0, len(values)
+        for operator, (_, bound) in bounds.items():
+            if operator == "$gt":
+                start = max(start, np.searchsorted(values, bound, side="right"))
+            elif operator == "$gte":
+                start = max(start, np.searchsorted(values, bound, side="left"))
+            elif operator == "$lt":
+                end = min(end, np.searchsorted(values, bound, side="left"))
+            else:
+                end = min(end, np.searchsorted(values, bound, side="right"))
+        if start >= end:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(rows[start:end])
+
+    def _sorted_values(self, key: str, kind: str) -> tuple:
+        """Returns the values of a key of the given kind, sorted, and their rows."""
+        cache_key = (key, kind)
+        if cache_key not in self._sorted:
+            values, rows = [], []
+            for (value_kind, value), value_rows in self._postings.get(key, {}).items():
+                if value_kind == kind:
+                    values.extend([value] * len(value_rows))
+                    rows.extend(value_rows)
+            values = np.asarray(values, dtype=np.float64 if kind == "number" else str)
+            order = np.argsort(values, kind="stable")
+            self._sorted[cache_key] = (
+                values[order],
+                np.asarray(rows, dtype=np.int64)[order],
+            )
+        return self._sorted[cache_key]
+
+
+class MetadataFilterRunnable(RunnableBindingBase[Input, Output]):
+    """Lets the callers of a chain restrict the documents it retrieves.
+
+    The chain accepts a `filter` next to its question: a string input becomes a
+    `{"question", "filter"}` dict, and a dict input gets a `filter` key. The filter is
+    moved to the `configurable` section of the config, where the retrievers and the
+    batch answering read it, and where it can be given directly too. A filter given
+    in both places is combined.
+
+    Attributes:
+        question_only (bool): Whether the bound chain takes the question as a string,
+            rather than a dict.
+    """
+
+    question_only: bool = False
+
+    def __init__(self, bound: Runnable[Input, Output], **kwargs: Any) -> None:
+        question_only = bound.InputType is str
+        super().__init__(
+            bound=bound,
+            question_only=question_only,
+            custom_input_type=_input_type(bound, question_only),
+            custom_output_type=bound.OutputType,
+            **kwargs,
+        )
+
+    @property
+    def config_specs(self) -> List[ConfigurableFieldSpec]:
+        return get_unique_config_specs(
+            [
+                *super().config_specs,
+                ConfigurableFieldSpec(
+                    id=FILTER_KEY,
+                    annotation=Optional[dict],
+                    name="Metadata filter",
+                    description="Restricts retrieval to documents matching it.",
+                    default=None,
+                ),
+            ]
+        )
+
+    def invoke(
+        self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Output:
+        return self.bound.invoke(*self._split(input, config), **kwargs)
+
+    async def ainvoke(
+        self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Output:
+        return await self.bound.ainvoke(*self._split(input, config), **kwargs)
+
+    def batch(self, inputs: List[Input], config=None, **kwargs: Any) -> List[Output]:
+        return Runnable.batch(self, inputs, config, **kwargs)
+
+    async def abatch(
+        self, inputs: List[Input], config=None, **kwargs: Any
+    ) -> List[Output]:
+        return await Runnable.abatch(self, inputs, config, **kwargs)
+
+    def stream(
+        self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Iterator[Output]:
+        yield from self.bound.stream(*self._split(input, config), **kwargs)
+
+    async def astream(
+        self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> AsyncIterator[Output]:
+        async for chunk in self.bound.astream(*self._split(input, config), **kwargs):
+            yield chunk
+
+    async def astream_events(self, input: Input, config=None, **kwargs: Any):
+        # RunnableBindingBase forwards events to the bound runnable, which would skip
+        # moving the filter. The default implementation goes through astream.
+        async for event in Runnable.astream_events(self, input, config, **kwargs):
+            yield event
+
+    def _split(self, input: Input, config: Optional[RunnableConfig]) -> tuple:
+        """Moves the filter of the input to the config."""
+        config = self._merge_configs(config)
+        if not isinstance(input, dict):
+            return input, config
+        input = dict(input)
+        filter = input.pop(FILTER_KEY, None)
+        if self.question_only:
+            input = input["question"]
+        if filter:
+            filter = combine_filters(get_filter(config), filter)
+            configurable = {**config.get("configurable", {}), FILTER_KEY: filter}
+            config = patch_config(config, configurable=configurable)
+        return input, config
+
+
+def _input_type(bound: Runnable, question_only: bool) -> type:
+    if question_only:
+
+        class QuestionWithFilter(BaseModel):
+            question: str
+            filter: Optional[dict] = None
+
+        return Union[str, QuestionWithFilter]
+    schema = bound.get_input_schema()
+    return create_model(
+        f"{schema.__name__}WithFilter", __base__=schema, filter=(Optional[dict], None)
+    )
+
+
+def _conditions(condition: Any) -> Iterator[tuple]:
+    """Yields the (operator, operand) pairs of the condition on a key."""
+    if not isinstance(condition, dict):
+        yield "$eq", condition
+        return
+    for operator, operand in condition.items():
+        if operator not in FIELD_OPERATORS:
+            raise ValueError(f"Unsupported filter operator {operator}")
+        if operator in ("$in", "$nin") and not isinstance(operand, list):
+            raise ValueError(f"{operator} expects a list, got {operand!r}")
+        yield operator, operand
+
+
+def _value_key(value: Any) -> tuple:
+    """Tags values with their kind, so that True does not equal 1, nor "1" equal 1."""
+    if isinstance(value, bool):
+        return "bool", value
+    if isinstance(value, (int, float)):
+        return "number", value
+    if isinstance(value, date):
+        return "string", value.isoformat()
+    if value is None:
+        return "null", None
+    return "string", str(value)
+
+
+def _is_scalar(value: Any) -> bool:
+    return value is None or isinstance(value, (str, int, float, bool, date))
+
+
+def _compare(operator: str, value: Any, bound: Any) -> bool:
+    if operator == "$gt":
+        return value > bound
+    if operator == "$gte":
+        return value >= bound
+    if operator == "$lt":
+        return value < bound
+    return value <= bound
+
+
+def _intersection(arrays: Iterable[np.ndarray]) -> np.ndarray:
+    # Smallest first, every intersection is then at most as large as it
+    arrays = sorted(arrays, key=len)
+    return reduce(lambda a, b: np.intersect1d(a, b, assume_unique=True), arrays)
+
+
+def _union(arrays: Iterable[np.ndarray]) -> np.ndarray:
+    arrays = list(arrays)
+    if not arrays:
+        return np.zeros(0, dtype=np.int64)
+    return np.unique(np.concatenate(arrays))
@@ -1,25 +1,46 @@
 from pathlib import Path
-from typing import List, Union
+from typing import TYPE_CHECKING, Iterable, Optional, Tuple, Union
 
 from langchain.chat_models.base import BaseChatModel
 from langchain.docstore.document import Document
-from langchain.indexes import SQLRecordManager, index
 from langchain.schema.embeddings import Embeddings
 from langchain.vectorstores import VectorStore
-from langchain_community.vectorstores.utils import filter_complex_metadata
 from langchain_core.retrievers import BaseRetriever
 
 from backend.config import RagConfig
 from backend.database import Database
 from backend.logger import get_logger
+from backend.rag_components.bm25_index import BM25Index
 from backend.rag_components.chain_links.rag_basic import rag_basic
 from backend.rag_components.chain_links.rag_with_history import rag_with_history_chain
-from backend.rag_components.document_loader import get_documents
-from backend.rag_components.embedding import get_embedding_model
+from backend.rag_components.context_packing import get_context_packer
+from backend.rag_components.embedding import PrefetchedEmbeddings, get_embedding_model
 from backend.rag_components.llm import get_llm_model
+from backend.rag_components.metadata_filter import MetadataFilterRunnable
+from backend.rag_components.reranker import Reranker, get_reranker
 from backend.rag_components.retriever import get_retriever
+from backend.rag_components.semantic_cache import (
+    SemanticCache,
+    bump_index_generation,
+    get_index_generation,
+)
+from backend.rag_components.startup import (
+    PENDING,
+    READY,
+    LazyComponents,
+    LazyEmbeddings,
+    LazyRetriever,
+)
+from backend.rag_components.tenancy import (
+    TenantIndex,
+    TenantIndexes,
+    TenantRetriever,
+)
 from backend.rag_components.vector_store import get_vector_store
 
+if TYPE_CHECKING:
+    from backend.rag_components.ingestion import IngestionPipeline
+
 
 class RAG:
     """
@@ -42,6 +63,17 @@ class RAG:
             representations of text.
         vector_store (VectorStore): The vector store that holds and allows for searching
             of embeddings.
+        lexical_index (BM25Index): Inverted index of the documents searched alongside
+            the vector store, None unless hybrid search is enabled.
+        reranker (Reranker): Cross-encoder reranking the retrieved documents, None
+            unless reranking is enabled.
+        semantic_cache (SemanticCache): Cache replaying answers to near-duplicate
+            questions, None unless enabled in the configuration.
+        tenants (TenantIndexes): The indexes of the tenants, loaded on demand, None
+            unless tenancy is enabled. Documents loaded in a namespace other than
+            "default" go to the indexes of the tenant of that name.
+        components (LazyComponents): Builds the components above on first use, and
+            reports their status. See `RagConfig.startup` for when they are built.
         logger (Logger): Logger for logging information, warnings, and errors.
     """
 
@@ -52,53 +84,235 @@ class RAG:
             self.config = RagConfig.from_yaml(config)
 
         self.logger = get_logger()
+        self.components = LazyComponents()
+        self.components.register("database", self._create_tables)
+        self.components.register("llm", lambda: get_llm_model(self.config))
+        self.components.register("embedding_model", self._load_embedding_model)
+        self.components.register(
+            "vector_store", lambda: get_vector_store(self.embeddings, self.config)
+        )
+        self.components.register("lexical_index", self._load_lexical_index)
+        self.components.register("reranker", lambda: get_reranker(self.config))
+        self.components.register(
+            "retriever",
+            lambda: get_retriever(
+                self.vector_store, self.config, self.lexical_index, self.reranker
+            ),
+        )
+
+        self.embeddings: Embeddings = PrefetchedEmbeddings(
+            LazyEmbeddings(lambda: self.components.get("embedding_model"))
+        )
+        self.semantic_cache: Optional[SemanticCache] = None
+        if self.config.semantic_cache.enabled:
+            self.semantic_cache = SemanticCache(
+                self.embeddings,
+                similarity_threshold=self.config.semantic_cache.similarity_threshold,
+                ttl_seconds=self.config.semantic_cache.ttl_seconds,
+                max_entries=self.config.semantic_cache.max_entries,
+                index_generation=self._get_index_generation,
+                index_check_seconds=self.config.semantic_cache.index_check_seconds,
+            )
+
+        self.tenants: Optional[TenantIndexes] = None
+        if self.config.tenancy.enabled:
+            self.tenants = TenantIndexes(
+                self._load_tenant,
+                memory_budget_mb=self.config.tenancy.memory_budget_mb,
+                max_loaded_tenants=self.config.tenancy.max_loaded_tenants,
+            )
+
+        # The tables are cheap to create, and plugins registered right after the RAG
+        # use them, so they are created in every startup mode.
+        self.components.get("database")
+        startup_mode = self.config.startup.mode
+        if startup_mode == "eager":
+            for name in ("llm", "embedding_model", "retriever"):
+                self.components.get(name)
+        elif startup_mode == "background":
+            self.components.warm_up()
+        elif startup_mode != "lazy":
+            raise ValueError(f"Unknown startup mode: {startup_mode}")
+
+    @property
+    def llm(self) -> BaseChatModel:
+        return self.components.get("llm")
+
+    @property
+    def vector_store(self) -> VectorStore:
+        return self.components.get("vector_store")
+
+    @property
+    def lexical_index(self) -> Optional[BM25Index]:
+        return self.components.get("lexical_index")
+
+    @property
+    def reranker(self) -> Optional[Reranker]:
+        return self.components.get("reranker")
+
+    @property
+    def retriever(self) -> BaseRetriever:
+        return self.components.get("retriever")
+
+    @property
+    def is_ready(self) -> bool:
+        """Whether queries can be answered without waiting for a component to load.
+
+        In lazy mode, components that were never used do not make the RAG unready.
+        """
+        statuses = self.components.statuses()
+        if self.config.startup.mode == "lazy":
+            return all(status in (READY, PENDING) for status in statuses)
+        return all(status == READY for status in statuses)
+
+    def get_indexes(
+        self, tenant: Optional[str] = None
+    ) -> Tuple[VectorStore, Optional[BM25Index]]:
+        """Returns the vector store and the lexical index of a tenant, or those of the
+        documents loaded without a namespace when `tenant` is None."""
+        if tenant is None:
+            return self.vector_store, self.lexical_index
+        if self.tenants is None:
+            raise ValueError("Tenancy is not enabled in the configuration")
+        index = self.tenants.get(tenant)
+        return index.vector_store, index.lexical_index
+
+    def _create_tables(self) -> None:
         with Database() as connection:
             connection.run_script(Path(__file__).parent / "rag_tables.sql")
+            # Indexes are not portable across dialects as scripts
+            connection.create_index(
+                "message_history",
+                "idx_message_history_session_id_timestamp",
+                ["session_id", "timestamp"],
+                prefix_lengths={"session_id": 255},
+            )
+
+    def _get_index_generation(self) -> int:
+        self.components.get("database")
+        return get_index_generation()
+
+    def _load_embedding_model(self) -> Embeddings:
+        if self.config.embedding_model.cache == "database":
+            self.components.get("database")
+        return get_embedding_model(self.config)
+
+    def _load_lexical_index(self) -> Optional[BM25Index]:
+        if not self.config.hybrid_search.enabled:
+            return None
+        return BM25Index(
+            self.config.hybrid_search.index_path,
+            k1=self.config.hybrid_search.bm25_k1,
+            b=self.config.hybrid_search.bm25_b,
+        )
 
-        self.llm: BaseChatModel = get_llm_model(self.config)
-        self.embeddings: Embeddings = get_embedding_model(self.config)
-        self.vector_store: VectorStore = get_vector_store(self.embeddings, self.config)
-        self.retriever: BaseRetriever = get_retriever(self.vector_store)
+    def _load_tenant(self, tenant: str) -> TenantIndex:
+        vector_store = get_vector_store(self.embeddings, self.config, tenant)
+        lexical_index = None
+        if self.config.hybrid_search.enabled:
+            lexical_index = BM25Index(
+                Path(self.config.hybrid_search.index_path) / "tenants" / tenant,
+                k1=self.config.hybrid_search.bm25_k1,
+                b=self.config.hybrid_search.bm25_b,
+            )
+        retriever = get_retriever(
+            vector_store, self.config, lexical_index, self.reranker
+        )
+        return TenantIndex(tenant, vector_store, lexical_index, retriever)
 
     def get_chain(self, memory: bool = False):
+        # The vector store is only opened by the first query, or by the warm-up
+        if self.config.startup.mode == "eager":
+            retriever = self.retriever
+        else:
+            retriever = LazyRetriever(load=lambda: self.retriever)
+
+        if self.tenants is not None:
+            retriever = TenantRetriever(tenants=self.tenants, default=retriever)
+
         if memory:
-            chain = rag_with_history_chain(self.config, self.llm, self.retriever)
+            self.components.get("database")
+            chain = rag_with_history_chain(self.config, self.llm, retriever)
         else:
-            chain = rag_basic(self.llm, self.retriever)
-        return chain
+            chain = rag_basic(
+                self.llm,
+                retriever,
+                semantic_cache=self.semantic_cache,
+                streaming=self.config.response_mode == "stream",
+                context_packer=get_context_packer(self.config),
+            )
+        # Callers can restrict the documents retrieved, see metadata_filter
+        return MetadataFilterRunnable(chain)
+
+    def load_file(
+        self,
+        file_path: Path,
+        insertion_mode: str = None,
+        namespace: str = "default",
+    ) -> dict:
+        pipeline = self._ingestion_pipeline(
+            insertion_mode=insertion_mode or self.config.vector_store.insertion_mode,
+            namespace=namespace,
+        )
+        return self._log_indexing(pipeline.run_files([file_path]))
+
+    def load_directory(
+        self,
+        directory: Path,
+        pattern: str = "**/*",
+        insertion_mode: str = None,
+        namespace: str = "default",
+    ) -> dict:
+        """Loads every file of a directory tree matching `pattern`.
 
-    def load_file(self, file_path: Path) -> List[Document]:
-        documents = get_documents(file_path, self.llm)
-        filtered_documents = filter_complex_metadata(documents)
-        return self.load_documents(filtered_documents)
+        Files are streamed through the ingestion pipeline, so the documents of the
+        whole tree are never held in memory at once. Files that can not be loaded are
+        logged and skipped, as are files unchanged since they were last loaded. With
+        the incremental insertion mode, the documents of files removed from the
+        directory are deleted.
+        """
+        pipeline = self._ingestion_pipeline(
+            insertion_mode=insertion_mode or self.config.vector_store.insertion_mode,
+            namespace=namespace,
+            skip_errors=True,
+        )
+        file_paths = (path for path in Path(directory).glob(pattern) if path.is_file())
+        return self._log_indexing(pipeline.run_files(file_paths, directory))
 
     def load_documents(
         self,
-        documents: List[Document],
+        documents: Iterable[Document],
         insertion_mode: str = None,
         namespace: str = "default",
-    ):
-        insertion_mode = insertion_mode or self.config.vector_store.insertion_mode
-
-        record_manager = SQLRecordManager(
-            namespace=namespace, db_url=self.config.database.database_url
+    ) -> dict:
+        pipeline = self._ingestion_pipeline(
+            insertion_mode=insertion_mode or self.config.vector_store.insertion_mode,
+            namespace=namespace,
         )
+        return self._log_indexing(pipeline.run_documents(documents))
 
-        record_manager.create_schema()
+    def _ingestion_pipeline(self, **kwargs) -> "IngestionPipeline":
+        # Document loaders are only imported by the processes that ingest documents
+        from backend.rag_components.ingestion import IngestionPipeline
 
-        self.logger.info(f"Indexing {len(documents)} documents.")
+        self.components.get("database")
+        return IngestionPipeline(self, **kwargs)
 
-        batch_size = 100
-        for batch in range(0, len(documents), batch_size):
-            self.logger.info(
-                f"Indexing batch {batch} to {min(len(documents), batch + batch_size)}."
-            )
+    def _log_indexing(self, indexing_output: dict) -> dict:
+        index_changed = any(
+            indexing_output[key] for key in ("num_added", "num_updated", "num_deleted")
+        )
+        if index_changed:
+            # Cached answers may rely on documents that changed, in this process and
+            # in the other ones serving the same index
+            index_generation = bump_index_generation()
+            if self.semantic_cache:
+                self.semantic_cache.clear(index_generation)
 
-            indexing_output = index(
-                documents[batch : min(len(documents), batch + batch_size)],
-                record_manager,
-                self.vector_store,
-                cleanup=insertion_mode,
-                source_id_key="source",
-            )
-            self.logger.info({"event": "load_documents", **indexing_output})
+        self.logger.info(
+            {
+                "event": "load_documents",
+                **{k: v for k, v in indexing_output.items() if k != "stages"},
+            }
+        )
+        return indexing_output
@@ -7,3 +7,39 @@ CREATE TABLE IF NOT EXISTS "message_history" (
     "session_id" TEXT,
     "message" TEXT
 );
+
+CREATE TABLE IF NOT EXISTS "document_loaders" (
+    "file_extension" VARCHAR(255) PRIMARY KEY,
+    "loader_class_name" VARCHAR(255)
+);
+
+-- Extensions the LLM found no loader for, and when it was asked.
+CREATE TABLE IF NOT EXISTS "document_loader_misses" (
+    "file_extension" VARCHAR(255) PRIMARY KEY,
+    "checked_at" DOUBLE PRECISION
+);
+
+-- One row per conversation, kept up to date when messages are added, so that
+-- sessions can be listed without scanning message_history.
+CREATE TABLE IF NOT EXISTS "session_summary" (
+    "session_id" VARCHAR(255) PRIMARY KEY,
+    "first_message" TEXT,
+    "last_activity" DATETIME,
+    "message_count" INTEGER DEFAULT 0
+);
+
+-- Rolling summary of the messages of a conversation that are older than the history
+-- window, and id of the last message it covers.
+CREATE TABLE IF NOT EXISTS "message_history_summary" (
+    "session_id" VARCHAR(255) PRIMARY KEY,
+    "summary" TEXT,
+    "summarized_until" INTEGER,
+    "updated_at" DATETIME
+);
+
+-- Incremented every time documents are loaded and the index changes, so that the
+-- processes serving the RAG invalidate their semantic cache.
+CREATE TABLE IF NOT EXISTS "index_generation" (
+    "name" VARCHAR(255) PRIMARY KEY,
+    "generation" INTEGER DEFAULT 0
+);
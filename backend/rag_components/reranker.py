@@ -0,0 +1,225 @@
+"""Reranks retrieved documents with a cross-encoder.
+
+Embedding similarity ranks documents with vectors computed independently of the
+question. A cross-encoder reads the question and a document together, and scores
+their relevance much more accurately, but has to run once per pair. The retriever
+therefore fetches more candidates than needed, and the cross-encoder picks the best
+of them.
+"""
+
+import asyncio
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from importlib import import_module
+from threading import Lock
+from typing import Any, List, Optional, Tuple
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from backend.config import RagConfig
+from backend.rag_components.context_packing import SCORE_METADATA_KEY
+
+# Registry mapping cross-encoder names to their import paths. A cross-encoder has a
+# `score(text_pairs)` method returning a relevance score per (query, text) pair.
+CROSS_ENCODER_PROVIDERS = {
+    "HuggingFaceCrossEncoder": (
+        "langchain_community.cross_encoders.HuggingFaceCrossEncoder"
+    ),
+    # Add more providers as needed
+}
+
+
+def get_reranker(config: RagConfig) -> Optional["Reranker"]:
+    rerank_config = config.rerank
+    if not rerank_config.enabled:
+        return None
+
+    source = rerank_config.source
+    # If the source is already an instance, use it directly
+    if isinstance(source, str):
+        provider_path = CROSS_ENCODER_PROVIDERS.get(source)
+        if not provider_path:
+            raise ValueError(f"Unknown cross-encoder provider: {source}")
+        module_path, class_name = provider_path.rsplit(".", 1)
+        module = import_module(module_path)
+        source = getattr(module, class_name)(**rerank_config.source_config)
+
+    return Reranker(
+        source,
+        k=rerank_config.k,
+        min_score=rerank_config.min_score,
+        max_workers=rerank_config.max_workers,
+        cache_max_entries=rerank_config.cache_max_entries,
+    )
+
+
+class Reranker:
+    """Scores documents against a query with a cross-encoder, and keeps the best.
+
+    The pairs that are not cached are scored in a single call to the cross-encoder,
+    which batches its forward pass, on a thread pool of `max_workers` threads. Scores
+    are cached by query and document, so that documents retrieved again for the same
+    question are not scored again.
+
+    Attributes:
+        cross_encoder: Model with a `score(text_pairs)` method.
+        k (int): Number of documents kept.
+        min_score (float): Documents scored below it are dropped, if set.
+        cache_max_entries (int): Number of scores kept in the cache.
+    """
+
+    def __init__(
+        self,
+        cross_encoder: Any,
+        k: int = 5,
+        min_score: Optional[float] = None,
+        max_workers: int = 1,
+        cache_max_entries: int = 10_000,
+    ):
+        self.cross_encoder = cross_encoder
+        self.k = k
+        self.min_score = min_score
+        self.cache_max_entries = cache_max_entries
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="reranker"
+        )
+        self._cache: OrderedDict[Tuple[str, str], float] = OrderedDict()
+        self._lock = Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def rerank(self, query: str, documents: List[Document]) -> List[Document]:
+        """Returns the `k` best documents, best first, with their score in their
+        `relevance_score` metadata."""
+        scores, pending = self._lookup(query, documents)
+        if pending is not None:
+            self._store(query, documents, scores, pending.result())
+        return self._select(documents, scores)
+
+    async def arerank(self, query: str, documents: List[Document]) -> List[Document]:
+        scores, pending = self._lookup(query, documents)
+        if pending is not None:
+            self._store(query, documents, scores, await asyncio.wrap_future(pending))
+        return self._select(documents, scores)
+
+    def stats(self) -> dict:
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "hit_rate": self.cache_hits / lookups if lookups else None,
+            "cache_entries": len(self._cache),
+        }
+
+    def _lookup(
+        self, query: str, documents: List[Document]
+    ) -> Tuple[List[Optional[float]], Optional[Future]]:
+        """Returns the cached scores, and the scoring of the others if any."""
+        query_hash = _hash(query)
+        with self._lock:
+            scores = []
+            for document in documents:
+                key = (query_hash, get_chunk_id(document))
+                score = self._cache.get(key)
+                if score is not None:
+                    self._cache.move_to_end(key)
+                scores.append(score)
+            misses = sum(score is None for score in scores)
+            self.cache_hits += len(scores) - misses
+            self.cache_misses += misses
+
+        pairs = [
+            (query, document.page_content)
+            for document, score in zip(documents, scores)
+            if score is None
+        ]
+        if not pairs:
+            return scores, None
+        return scores, self._executor.submit(self.cross_encoder.score, pairs)
+
+    def _store(
+        self,
+        query: str,
+        documents: List[Document],
+        scores: List[Optional[float]],
+        new_scores: List[float],
+    ) -> None:
+        query_hash = _hash(query)
+        new_scores = iter(new_scores)
+        with self._lock:
+            for index, document in enumerate(documents):
+                if scores[index] is not None:
+                    continue
+                scores[index] = float(next(new_scores))
+                self._cache[(query_hash, get_chunk_id(document))] = scores[index]
+            while len(self._cache) > self.cache_max_entries:
+                self._cache.popitem(last=False)
+
+    def _select(self, documents: List[Document], scores: List[float]) -> List[Document]:
+        ranked = sorted(zip(documents, scores), key=lambda pair: pair[1], reverse=True)
+        return [
+            Document(
+                page_content=document.page_content,
+                metadata={**document.metadata, SCORE_METADATA_KEY: score},
+                id=document.id,
+            )
+            for document, score in ranked[: self.k]
+            if self.min_score is None or score >= self.min_score
+        ]
+
+
+class RerankingRetriever(BaseRetriever):
+    """Fetches candidates with a retriever, and keeps the best according to a
+    cross-encoder.
+
+    Attributes:
+        retriever (BaseRetriever): Fetches the candidate documents.
+        reranker (Reranker): Scores and selects the candidates.
+    """
+
+    retriever: BaseRetriever
+    reranker: Any
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun,
+        filter: Optional[dict] = None,
+    ) -> List[Document]:
+        candidates = self.retriever.invoke(
+            query, {"callbacks": run_manager.get_child()}, filter=filter
+        )
+        return self.reranker.rerank(query, candidates)
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: AsyncCallbackManagerForRetrieverRun,
+        filter: Optional[dict] = None,
+    ) -> List[Document]:
+        candidates = await self.retriever.ainvoke(
+            query, {"callbacks": run_manager.get_child()}, filter=filter
+        )
+        return await self.reranker.arerank(query, candidates)
+
+
+def get_chunk_id(document: Document) -> str:
+    """Identifies a chunk by its id, or by its source and text if it has none."""
+    if document.id:
+        return document.id
+    return _hash(f"{document.metadata.get('source')}\0{document.page_content}")
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
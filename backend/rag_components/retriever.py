@@ -1,8 +1,174 @@
-from langchain_core.vectorstores import VectorStore
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
 
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore, VectorStoreRetriever
 
-def get_retriever(vector_store: VectorStore):
-    return vector_store.as_retriever(
-        search_type="similarity_score_threshold",
-        search_kwargs={"score_threshold": 0.5, "k": 5},
+from backend.config import RagConfig
+from backend.rag_components.bm25_index import BM25Index
+from backend.rag_components.metadata_filter import combine_filters, matches
+from backend.rag_components.reranker import Reranker, RerankingRetriever
+
+
+def get_retriever(
+    vector_store: VectorStore,
+    config: RagConfig,
+    lexical_index: Optional[BM25Index] = None,
+    reranker: Optional[Reranker] = None,
+) -> BaseRetriever:
+    search_type = config.vector_store.retriever_search_type
+    search_kwargs = dict(config.vector_store.retriever_config)
+    hybrid_config = config.hybrid_search
+    k = hybrid_config.k if hybrid_config.enabled else search_kwargs.get("k", 4)
+    if reranker is not None:
+        # Candidates are over-fetched regardless of their similarity, the
+        # cross-encoder decides which are relevant
+        search_type = "similarity"
+        search_filter = search_kwargs.get("filter")
+        search_kwargs = {"filter": search_filter} if search_filter else {}
+        k = search_kwargs["k"] = config.rerank.fetch_k
+    if hybrid_config.enabled:
+        # Each retriever fetches more candidates than returned, for the fusion
+        search_kwargs["k"] = max(hybrid_config.fetch_k, k)
+
+    retriever = FilteredVectorStoreRetriever(
+        vectorstore=vector_store,
+        search_type=search_type,
+        search_kwargs=search_kwargs,
+        tags=vector_store._get_retriever_tags(),
     )
+    if hybrid_config.enabled:
+        if lexical_index is None:
+            raise ValueError("Hybrid search requires a lexical index")
+        retriever = HybridRetriever(
+            vector_retriever=retriever,
+            lexical_index=lexical_index,
+            k=k,
+            fetch_k=max(hybrid_config.fetch_k, k),
+            rrf_k=hybrid_config.rrf_k,
+        )
+    if reranker is not None:
+        retriever = RerankingRetriever(retriever=retriever, reranker=reranker)
+    return retriever
+
+
+class FilteredVectorStoreRetriever(VectorStoreRetriever):
+    """Vector store retriever taking a metadata filter per search, on top of the
+    `filter` of its search kwargs, which both apply."""
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun,
+        filter: Optional[dict] = None,
+    ) -> List[Document]:
+        return VectorStoreRetriever._get_relevant_documents(
+            self._with_filter(filter), query, run_manager=run_manager
+        )
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: AsyncCallbackManagerForRetrieverRun,
+        filter: Optional[dict] = None,
+    ) -> List[Document]:
+        return await VectorStoreRetriever._aget_relevant_documents(
+            self._with_filter(filter), query, run_manager=run_manager
+        )
+
+    def _with_filter(self, filter: Optional[dict]) -> VectorStoreRetriever:
+        if not filter:
+            return self
+        search_filter = combine_filters(self.search_kwargs.get("filter"), filter)
+        return self.copy(
+            update={"search_kwargs": {**self.search_kwargs, "filter": search_filter}}
+        )
+
+
+class HybridRetriever(BaseRetriever):
+    """Runs a vector search and a BM25 search concurrently, and fuses their results
+    with reciprocal rank fusion.
+
+    Attributes:
+        vector_retriever (BaseRetriever): Retrieves documents by embedding similarity.
+        lexical_index (BM25Index): Retrieves documents sharing terms with the query.
+        k (int): Number of documents returned.
+        fetch_k (int): Number of documents fetched from the lexical index.
+        rrf_k (int): Rank offset of reciprocal rank fusion, higher values give more
+            weight to documents ranked low by one of the searches.
+    """
+
+    vector_retriever: BaseRetriever
+    lexical_index: Any
+    k: int = 5
+    fetch_k: int = 20
+    rrf_k: int = 60
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun,
+        filter: Optional[dict] = None,
+    ) -> List[Document]:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            lexical_results = executor.submit(self._lexical_search, query, filter)
+            vector_results = self.vector_retriever.invoke(
+                query, {"callbacks": run_manager.get_child()}, filter=filter
+            )
+            return self._fuse(vector_results, lexical_results.result())
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: AsyncCallbackManagerForRetrieverRun,
+        filter: Optional[dict] = None,
+    ) -> List[Document]:
+        vector_results, lexical_results = await asyncio.gather(
+            self.vector_retriever.ainvoke(
+                query, {"callbacks": run_manager.get_child()}, filter=filter
+            ),
+            asyncio.to_thread(self._lexical_search, query, filter),
+        )
+        return self._fuse(vector_results, lexical_results)
+
+    def _lexical_search(self, query: str, filter: Optional[dict]) -> List[Document]:
+        # The lexical index has no attribute index, its results are filtered
+        return [
+            doc
+            for doc, _ in self.lexical_index.search(query, self.fetch_k)
+            if matches(doc.metadata, filter)
+        ]
+
+    def _fuse(self, *rankings: Sequence[Document]) -> List[Document]:
+        return reciprocal_rank_fusion(rankings, self.rrf_k)[: self.k]
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[Document]], k: int = 60
+) -> List[Document]:
+    """Orders documents by the sum of 1 / (k + rank) over the rankings they are in.
+
+    Documents are identified by their text and source, as the ids given by the vector
+    store and by the lexical index may differ.
+    """
+    scores: Dict[tuple, float] = {}
+    documents: Dict[tuple, Document] = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking, start=1):
+            key = (document.page_content, document.metadata.get("source"))
+            scores[key] = scores.get(key, 0.0) + 1 / (k + rank)
+            documents.setdefault(key, document)
+    return [documents[key] for key in sorted(scores, key=scores.get, reverse=True)]
@@ -0,0 +1,413 @@
+"""Semantic response cache that replays answers to near-duplicate questions.
+
+Incoming questions are embedded and compared to the questions answered before. When one
+is similar enough, its answer is replayed instead of running the retriever and the LLM.
+"""
+
+import re
+import time
+from threading import Lock
+from typing import Any, AsyncIterator, Callable, Iterator, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables.base import RunnableBindingBase
+from langchain_core.runnables.utils import Input, Output
+
+from backend.database import Database
+from backend.logger import get_logger
+from backend.rag_components.metadata_filter import get_filter
+from backend.rag_components.tenancy import get_tenant
+
+# Increments the index generation, in a single statement
+BUMP_GENERATION_QUERIES = {
+    None: (
+        "INSERT INTO index_generation (name, generation) VALUES (?, 1)"
+        " ON CONFLICT (name) DO UPDATE SET generation ="
+        " index_generation.generation + 1"
+    ),
+    "mysql": (
+        "INSERT INTO index_generation (name, generation) VALUES (?, 1)"
+        " ON DUPLICATE KEY UPDATE generation = generation + 1"
+    ),
+}
+
+
+class SemanticCache:
+    """In-memory store of answered questions, searched by embedding similarity.
+
+    Entries live in a fixed-size matrix of normalized question embeddings. Lookups are
+    a single matrix-vector product. Entries expire after `ttl_seconds`, and the least
+    recently used entry is replaced when the cache is full. The whole cache is
+    invalidated when the indexed documents change. Documents may be loaded by another
+    process: the index generation it bumps is polled by the lookups, at most once
+    every `index_check_seconds`.
+
+    Attributes:
+        embeddings (Embeddings): The model used to embed the questions.
+        similarity_threshold (float): Minimum cosine similarity between two questions
+            for the cached answer to be replayed.
+        ttl_seconds (float): Time after which an entry expires.
+        max_entries (int): Maximum number of cached answers.
+        index_generation (Callable[[], int]): Returns the generation of the index
+            shared by the processes, such as `get_index_generation`. None when only
+            the loads of this process invalidate the cache.
+        index_check_seconds (float): Minimum time between two calls to
+            `index_generation`.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        similarity_threshold: float = 0.95,
+        ttl_seconds: float = 3600,
+        max_entries: int = 1000,
+        index_generation: Optional[Callable[[], int]] = None,
+        index_check_seconds: float = 5,
+    ):
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.index_generation = index_generation
+        self.index_check_seconds = index_check_seconds
+        self.logger = get_logger()
+
+        self._lock = Lock()
+        self._vectors: Optional[np.ndarray] = None  # Allocated on the first insert
+        self._answers = [None] * max_entries
+        self._created_at = np.zeros(max_entries)
+        self._last_used_at = np.zeros(max_entries)
+        self._valid = np.zeros(max_entries, dtype=bool)
+
+        self.generation = 0  # Incremented every time the cache is invalidated
+        self._index_generation: Optional[int] = None  # Last one seen by this process
+        self._index_checked_at = -np.inf
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def embed(self, question: str) -> np.ndarray:
+        return _normalize(self.embeddings.embed_query(question))
+
+    async def aembed(self, question: str) -> np.ndarray:
+        return _normalize(await self.embeddings.aembed_query(question))
+
+    def lookup(self, vector: np.ndarray) -> Optional[str]:
+        self._check_index_generation()
+        with self._lock:
+            self._expire()
+            if self._vectors is None or not self._valid.any():
+                self.misses += 1
+                return None
+
+            similarities = np.where(self._valid, self._vectors @ vector, -np.inf)
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._last_used_at[best] = time.monotonic()
+            self.logger.debug(
+                f"Semantic cache hit with similarity {similarities[best]:.3f}"
+            )
+            return self._answers[best]
+
+    def add(
+        self, vector: np.ndarray, answer: str, generation: Optional[int] = None
+    ) -> None:
+        if not answer:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return  # Answered from documents that were replaced since then
+            if self._vectors is None:
+                self._vectors = np.zeros(
+                    (self.max_entries, vector.shape[0]), dtype=np.float32
+                )
+            self._expire()
+
+            free_slots = np.flatnonzero(~self._valid)
+            if len(free_slots):
+                slot = int(free_slots[0])
+            else:
+                slot = int(np.argmin(self._last_used_at))
+                self.evictions += 1
+
+            now = time.monotonic()
+            self._vectors[slot] = vector
+            self._answers[slot] = answer
+            self._created_at[slot] = now
+            self._last_used_at[slot] = now
+            self._valid[slot] = True
+
+    def clear(self, index_generation: Optional[int] = None) -> None:
+        """Drops every entry. `index_generation` is the generation of the index the
+        next answers come from, when known, so that it is not mistaken for a change
+        made by another process."""
+        with self._lock:
+            if index_generation is not None:
+                self._index_generation = index_generation
+            self._valid[:] = False
+            self._answers = [None] * self.max_entries
+            self.generation += 1
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else None,
+            "size": int(self._valid.sum()),
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def _check_index_generation(self) -> None:
+        if self.index_generation is None:
+            return
+        now = time.monotonic()
+        if now - self._index_checked_at < self.index_check_seconds:
+            return
+        self._index_checked_at = now
+
+        try:
+            index_generation = self.index_generation()
+        except Exception as e:
+            self.logger.warning(f"Could not check the index generation: {e}")
+            return
+        if self._index_generation is None:
+            self._index_generation = index_generation
+        elif index_generation != self._index_generation:
+            self.logger.info("Index changed, clearing the semantic cache")
+            self.clear(index_generation)
+
+    def _expire(self) -> None:
+        expired = self._valid & (self._created_at < time.monotonic() - self.ttl_seconds)
+        for slot in np.flatnonzero(expired):
+            self._answers[slot] = None
+        self._valid &= ~expired
+
+
+class SemanticCacheRunnable(RunnableBindingBase[Input, Output]):
+    """Replays cached answers in front of a chain that answers questions.
+
+    On a miss, the bound chain runs as usual and its answer is cached once complete.
+    On a hit, the cached answer is returned as an AIMessage, or streamed back as
+    AIMessageChunks word by word when `streaming` is set.
+    Questions asked with a metadata filter, or on behalf of a tenant, bypass the cache.
+
+    Attributes:
+        cache (SemanticCache): Where answers are looked up and stored.
+        streaming (bool): Whether cached answers are replayed as a stream of chunks
+            or as a single chunk.
+    """
+
+    cache: Any
+    streaming: bool = True
+
+    def __init__(
+        self,
+        bound: Runnable[Input, Output],
+        cache: SemanticCache,
+        streaming: bool = True,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(
+            bound=bound,
+            cache=cache,
+            streaming=streaming,
+            custom_input_type=bound.InputType,
+            custom_output_type=bound.OutputType,
+            **kwargs,
+        )
+
+    def invoke(
+        self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Output:
+        return self._call_with_config(self._invoke, input, config, **kwargs)
+
+    async def ainvoke(
+        self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Output:
+        return await self._acall_with_config(self._ainvoke, input, config, **kwargs)
+
+    def stream(
+        self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Iterator[Output]:
+        yield from self.transform(iter([input]), config, **kwargs)
+
+    async def astream(
+        self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> AsyncIterator[Output]:
+        async def input_aiter() -> AsyncIterator[Input]:
+            yield input
+
+        async for chunk in self.atransform(input_aiter(), config, **kwargs):
+            yield chunk
+
+    def transform(
+        self,
+        input: Iterator[Input],
+        config: Optional[RunnableConfig] = None,
+        **kwargs: Any,
+    ) -> Iterator[Output]:
+        yield from self._transform_stream_with_config(
+            input, self._transform, config, **kwargs
+        )
+
+    async def atransform(
+        self,
+        input: AsyncIterator[Input],
+        config: Optional[RunnableConfig] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[Output]:
+        async for chunk in self._atransform_stream_with_config(
+            input, self._atransform, config, **kwargs
+        ):
+            yield chunk
+
+    async def astream_events(self, input: Input, config=None, **kwargs: Any):
+        # RunnableBindingBase forwards events to the bound runnable, which would
+        # bypass the cache. The default implementation goes through astream.
+        async for event in Runnable.astream_events(self, input, config, **kwargs):
+            yield event
+
+    def _invoke(self, input: Input, config: RunnableConfig, **kwargs: Any) -> Output:
+        question = _get_question(input, config)
+        if question is None:
+            return self.bound.invoke(input, config, **kwargs)
+
+        vector, generation = self.cache.embed(question), self.cache.generation
+        answer = self.cache.lookup(vector)
+        if answer is not None:
+            return AIMessage(content=answer)
+
+        output = self.bound.invoke(input, config, **kwargs)
+        self.cache.add(vector, _get_content(output), generation)
+        return output
+
+    async def _ainvoke(
+        self, input: Input, config: RunnableConfig, **kwargs: Any
+    ) -> Output:
+        question = _get_question(input, config)
+        if question is None:
+            return await self.bound.ainvoke(input, config, **kwargs)
+
+        vector, generation = await self.cache.aembed(question), self.cache.generation
+        answer = self.cache.lookup(vector)
+        if answer is not None:
+            return AIMessage(content=answer)
+
+        output = await self.bound.ainvoke(input, config, **kwargs)
+        self.cache.add(vector, _get_content(output), generation)
+        return output
+
+    def _transform(
+        self, input: Iterator[Input], config: RunnableConfig, **kwargs: Any
+    ) -> Iterator[Output]:
+        final = None
+        for chunk in input:
+            final = chunk if final is None else final + chunk
+
+        question = _get_question(final, config)
+        if question is None:
+            yield from self.bound.stream(final, config, **kwargs)
+            return
+
+        vector, generation = self.cache.embed(question), self.cache.generation
+        answer = self.cache.lookup(vector)
+        if answer is not None:
+            yield from self._replay(answer)
+            return
+
+        chunks = []
+        for chunk in self.bound.stream(final, config, **kwargs):
+            chunks.append(_get_content(chunk))
+            yield chunk
+        self.cache.add(vector, "".join(chunks), generation)
+
+    async def _atransform(
+        self, input: AsyncIterator[Input], config: RunnableConfig, **kwargs: Any
+    ) -> AsyncIterator[Output]:
+        final = None
+        async for chunk in input:
+            final = chunk if final is None else final + chunk
+
+        question = _get_question(final, config)
+        if question is None:
+            async for chunk in self.bound.astream(final, config, **kwargs):
+                yield chunk
+            return
+
+        vector, generation = await self.cache.aembed(question), self.cache.generation
+        answer = self.cache.lookup(vector)
+        if answer is not None:
+            for chunk in self._replay(answer):
+                yield chunk
+            return
+
+        chunks = []
+        async for chunk in self.bound.astream(final, config, **kwargs):
+            chunks.append(_get_content(chunk))
+            yield chunk
+        self.cache.add(vector, "".join(chunks), generation)
+
+    def _replay(self, answer: str) -> Iterator[AIMessageChunk]:
+        if not self.streaming:
+            yield AIMessageChunk(content=answer)
+            return
+        for token in re.findall(r"\s*\S+|\s+$", answer):
+            yield AIMessageChunk(content=token)
+
+
+def get_index_generation(name: str = "default") -> int:
+    """Returns the generation of an index, 0 until documents are loaded in it."""
+    with Database() as connection:
+        row = connection.fetchone(
+            "SELECT generation FROM index_generation WHERE name = ?", (name,)
+        )
+    return row[0] if row else 0
+
+
+def bump_index_generation(name: str = "default") -> int:
+    """Increments the generation of an index after its documents changed, and
+    returns the new one."""
+    with Database() as connection:
+        connection.execute(
+            BUMP_GENERATION_QUERIES.get(
+                connection.dialect, BUMP_GENERATION_QUERIES[None]
+            ),
+            (name,),
+        ).close()
+        row = connection.fetchone(
+            "SELECT generation FROM index_generation WHERE name = ?", (name,)
+        )
+    return row[0]
+
+
+def _get_question(input: Any, config: RunnableConfig) -> Optional[str]:
+    if get_filter(config):
+        return None  # The answer depends on the documents the filter lets through
+    if get_tenant(config):
+        return None  # Cached answers come from the documents of another tenant
+    if isinstance(input, str):
+        return input
+    if isinstance(input, dict) and isinstance(input.get("question"), str):
+        return input["question"]
+    return None
+
+
+def _get_content(output: Any) -> str:
+    return output if isinstance(output, str) else getattr(output, "content", "")
+
+
+def _normalize(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
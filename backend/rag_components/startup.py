@@ -0,0 +1,172 @@
+"""Deferred initialization of the RAG components, for fast process startup.
+
+Loading the embedding model, opening the vector store or creating the tables can take
+tens of seconds. Components are registered with the function that builds them, and
+built the first time they are needed, or ahead of time by a background warm-up. Their
+status can be reported by a readiness probe meanwhile.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+from backend.logger import get_logger
+
+PENDING, LOADING, READY, FAILED = "pending", "loading", "ready", "failed"
+
+
+@dataclass
+class ComponentState:
+    """Status of a deferred component.
+
+    Attributes:
+        status (str): "pending", "loading", "ready" or "failed".
+        seconds (float): Time its initialization took, once done.
+        error (str): Why its initialization failed, if it did.
+    """
+
+    status: str = PENDING
+    seconds: Optional[float] = None
+    error: Optional[str] = None
+
+
+class LazyComponents:
+    """Components built once, on first access.
+
+    Concurrent accesses to a component that is being built wait for it. A component
+    that failed to build is built again on its next access.
+    """
+
+    def __init__(self):
+        self.logger = get_logger()
+        self._loaders: Dict[str, Callable[[], Any]] = {}
+        self._values: Dict[str, Any] = {}
+        self._states: Dict[str, ComponentState] = {}
+        self._locks: Dict[str, Lock] = {}
+        self._warm_up_thread: Optional[Thread] = None
+
+    def register(self, name: str, loader: Callable[[], Any]) -> None:
+        self._loaders[name] = loader
+        self._states[name] = ComponentState()
+        self._locks[name] = Lock()
+
+    def get(self, name: str) -> Any:
+        if self._states[name].status == READY:
+            return self._values[name]
+        with self._locks[name]:
+            state = self._states[name]
+            if state.status == READY:
+                return self._values[name]
+            state.status, state.error = LOADING, None
+            start = time.perf_counter()
+            try:
+                value = self._loaders[name]()
+            except Exception as e:
+                state.status, state.error = FAILED, str(e)
+                state.seconds = time.perf_counter() - start
+                raise
+            self._values[name] = value
+            state.seconds = time.perf_counter() - start
+            state.status = READY
+            self.logger.info(f"Loaded {name} in {state.seconds:.2f}s")
+            return value
+
+    def load_all(self, names: Optional[Iterable[str]] = None) -> None:
+        """Builds the components in registration order, or in the order given.
+
+        Failures are logged and recorded in the status, so that the components that
+        do not depend on the failing one are still built.
+        """
+        for name in names or list(self._loaders):
+            try:
+                self.get(name)
+            except Exception:
+                self.logger.exception(f"Failed to load {name}")
+
+    def warm_up(self, names: Optional[Iterable[str]] = None) -> Thread:
+        """Builds the components in a background thread, see `load_all`."""
+        if self._warm_up_thread is None:
+            self._warm_up_thread = Thread(
+                target=self.load_all, args=(names,), name="rag-warm-up", daemon=True
+            )
+            self._warm_up_thread.start()
+        return self._warm_up_thread
+
+    def status(self) -> Dict[str, dict]:
+        return {name: vars(state).copy() for name, state in self._states.items()}
+
+    def statuses(self) -> List[str]:
+        return [state.status for state in self._states.values()]
+
+
+class LazyEmbeddings(Embeddings):
+    """Embedding model that is only loaded when a text is first embedded.
+
+    Attributes:
+        load (Callable): Returns the embedding model, called on every use. It is
+            expected to cache the model, as `LazyComponents.get` does.
+    """
+
+    def __init__(self, load: Callable[[], Embeddings]):
+        self.load = load
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.load().embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.load().embed_query(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        embeddings = await asyncio.to_thread(self.load)
+        return await embeddings.aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        embeddings = await asyncio.to_thread(self.load)
+        return await embeddings.aembed_query(text)
+
+
+class LazyRetriever(BaseRetriever):
+    """Retriever whose vector store and indexes are only opened on first retrieval.
+
+    Attributes:
+        load (Callable): Returns the retriever to delegate to, called on every
+            retrieval. It is expected to cache it, as `LazyComponents.get` does.
+    """
+
+    load: Callable[[], BaseRetriever]
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun,
+        filter: Optional[dict] = None,
+    ) -> List[Document]:
+        return self.load().invoke(
+            query, {"callbacks": run_manager.get_child()}, filter=filter
+        )
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: AsyncCallbackManagerForRetrieverRun,
+        filter: Optional[dict] = None,
+    ) -> List[Document]:
+        retriever = await asyncio.to_thread(self.load)
+        return await retriever.ainvoke(
+            query, {"callbacks": run_manager.get_child()}, filter=filter
+        )
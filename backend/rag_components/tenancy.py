@@ -0,0 +1,209 @@
+"""Per-tenant document indexes, loaded on demand and evicted under a memory budget.
+
+Every tenant gets a collection of its own in the vector store, and a lexical index of
+its own when hybrid search is enabled. The tenant of a query is read from the
+`configurable` section of its config, where the tenancy API plugin puts it from the
+authenticated user or from a header. It is not a configurable field of the chain, so
+that clients can not pick another tenant than their own.
+
+Hosting hundreds of small corpora, most of them idle at any time, the indexes of a
+tenant are opened on its first query and kept in memory while it is active. The least
+recently used tenants are closed once the loaded indexes exceed the memory budget.
+"""
+
+import asyncio
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import RunnableConfig
+from langchain_core.vectorstores import VectorStore
+
+from backend.logger import get_logger
+from backend.rag_components.bm25_index import BM25Index
+
+# Key of the tenant in the `configurable` section of a config
+TENANT_KEY = "tenant"
+
+# Tenant names are used in collection names and paths
+TENANT_PATTERN = re.compile(r"[A-Za-z0-9](?:[A-Za-z0-9_.-]{0,46}[A-Za-z0-9])?")
+
+
+def get_tenant(config: Optional[RunnableConfig]) -> Optional[str]:
+    """Returns the tenant of the `configurable` section of a config, if any."""
+    return ((config or {}).get("configurable") or {}).get(TENANT_KEY)
+
+
+def validate_tenant(tenant: str) -> str:
+    if not TENANT_PATTERN.fullmatch(tenant) or ".." in tenant:
+        raise ValueError(
+            f"Invalid tenant {tenant!r}: use up to 48 letters, digits, '.', '-' or"
+            " '_', starting and ending with a letter or a digit"
+        )
+    return tenant
+
+
+@dataclass
+class TenantIndex:
+    """The documents of a tenant, and the retriever searching them."""
+
+    tenant: str
+    vector_store: VectorStore
+    lexical_index: Optional[BM25Index]
+    retriever: BaseRetriever
+
+    def memory_usage(self) -> int:
+        """Bytes held by the indexes, 0 for stores that do not report it."""
+        usage = 0
+        for index in (self.vector_store, self.lexical_index):
+            if hasattr(index, "memory_usage"):
+                usage += index.memory_usage()
+        return usage
+
+
+class TenantIndexes:
+    """Least recently used cache of the indexes of the tenants.
+
+    Indexes are loaded on the first `get` of their tenant. Other tenants are served
+    meanwhile, and concurrent requests of the loading tenant wait for it. After each
+    load, the least recently used tenants are evicted until the memory used by the
+    others fits in `memory_budget_mb` and at most `max_loaded_tenants` are loaded.
+    The tenant just loaded is never evicted, even alone above the budget. Evicted
+    indexes are freed once the queries using them complete.
+
+    Attributes:
+        load (Callable[[str], TenantIndex]): Opens the indexes of a tenant.
+        memory_budget_mb (float): Memory above which tenants are evicted.
+        max_loaded_tenants (int): Number of tenants above which they are evicted.
+    """
+
+    def __init__(
+        self,
+        load: Callable[[str], TenantIndex],
+        memory_budget_mb: float = 1024,
+        max_loaded_tenants: int = 64,
+    ):
+        self.load = load
+        self.memory_budget_mb = memory_budget_mb
+        self.max_loaded_tenants = max_loaded_tenants
+        self.logger = get_logger()
+
+        self._lock = Lock()
+        self._loaded: "OrderedDict[str, TenantIndex]" = OrderedDict()
+        self._loading: Dict[str, Lock] = {}
+
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def __contains__(self, tenant: str) -> bool:
+        return tenant in self._loaded
+
+    def get(self, tenant: str) -> TenantIndex:
+        with self._lock:
+            index = self._get_loaded(tenant)
+            if index is not None:
+                return index
+            loading = self._loading.setdefault(validate_tenant(tenant), Lock())
+
+        with loading:
+            with self._lock:
+                index = self._get_loaded(tenant)
+                if index is not None:
+                    return index
+            index = self.load(tenant)
+            with self._lock:
+                self._loaded[tenant] = index
+                self._loading.pop(tenant, None)
+                self.loads += 1
+                self._evict()
+            self.logger.debug(f"Loaded the indexes of tenant {tenant}")
+            return index
+
+    def evict(self, tenant: str) -> None:
+        with self._lock:
+            if self._loaded.pop(tenant, None) is not None:
+                self.evictions += 1
+
+    def memory_usage(self) -> int:
+        with self._lock:
+            indexes = list(self._loaded.values())
+        return sum(index.memory_usage() for index in indexes)
+
+    def stats(self) -> dict:
+        return {
+            "loaded": len(self._loaded),
+            "memory_mb": self.memory_usage() / 2**20,
+            "hits": self.hits,
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
+
+    def _get_loaded(self, tenant: str) -> Optional[TenantIndex]:
+        index = self._loaded.get(tenant)
+        if index is not None:
+            self._loaded.move_to_end(tenant)
+            self.hits += 1
+        return index
+
+    def _evict(self) -> None:
+        usages = {
+            tenant: index.memory_usage() for tenant, index in self._loaded.items()
+        }
+        budget = self.memory_budget_mb * 2**20
+        used = sum(usages.values())
+        while len(self._loaded) > 1 and (
+            used > budget or len(self._loaded) > self.max_loaded_tenants
+        ):
+            tenant, _ = self._loaded.popitem(last=False)
+            used -= usages[tenant]
+            self.evictions += 1
+            self.logger.debug(f"Evicted the indexes of tenant {tenant}")
+
+
+class TenantRetriever(BaseRetriever):
+    """Delegates retrieval to the retriever of the tenant of the config.
+
+    Queries without a tenant are answered by `default`, the retriever of the
+    documents loaded without a namespace.
+
+    Attributes:
+        tenants (TenantIndexes): The indexes of the tenants.
+        default (BaseRetriever): The retriever of queries without a tenant.
+    """
+
+    tenants: Any
+    default: BaseRetriever
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def invoke(
+        self, input: str, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> List[Document]:
+        tenant = get_tenant(config)
+        if tenant is None:
+            return self.default.invoke(input, config, **kwargs)
+        return self.tenants.get(tenant).retriever.invoke(input, config, **kwargs)
+
+    async def ainvoke(
+        self, input: str, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> List[Document]:
+        tenant = get_tenant(config)
+        if tenant is None:
+            return await self.default.ainvoke(input, config, **kwargs)
+        if tenant in self.tenants:
+            index = self.tenants.get(tenant)
+        else:
+            index = await asyncio.to_thread(self.tenants.get, tenant)
+        return await index.retriever.ainvoke(input, config, **kwargs)
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self.default.invoke(query, {"callbacks": run_manager.get_child()})
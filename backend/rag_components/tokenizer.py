@@ -0,0 +1,62 @@
+"""Token counters used to keep prompts within a token budget.
+
+Counting tokens exactly requires the tokenizer of the model in use, which is not
+always available. The default counter approximates it from the text length, which
+is fast and good enough to bound prompt sizes. A tokenizer is any callable that maps
+a text to its number of tokens.
+"""
+
+import math
+from typing import Callable, Dict, Sequence
+
+from langchain_core.messages import BaseMessage
+
+Tokenizer = Callable[[str], int]
+
+# Rough number of characters per token for English text with BPE tokenizers
+CHARACTERS_PER_TOKEN = 4
+
+# Tokens added by chat models around the content of every message
+TOKENS_PER_MESSAGE = 4
+
+
+def count_approximate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARACTERS_PER_TOKEN)
+
+
+class TiktokenTokenizer:
+    """Exact token counts for OpenAI models, requires the `tiktoken` package."""
+
+    def __init__(self, encoding_name: str = "cl100k_base"):
+        import tiktoken
+
+        self.encoding = tiktoken.get_encoding(encoding_name)
+
+    def __call__(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+
+# Registry mapping tokenizer names to their factories
+TOKENIZERS: Dict[str, Callable[[], Tokenizer]] = {
+    "approximate": lambda: count_approximate_tokens,
+    "tiktoken": TiktokenTokenizer,
+}
+
+
+def get_tokenizer(tokenizer: Tokenizer | str = "approximate") -> Tokenizer:
+    # If the tokenizer is already a callable, return it directly
+    if not isinstance(tokenizer, str):
+        return tokenizer
+
+    factory = TOKENIZERS.get(tokenizer)
+    if not factory:
+        raise ValueError(f"Unknown tokenizer: {tokenizer}")
+    return factory()
+
+
+def count_message_tokens(messages: Sequence[BaseMessage], tokenizer: Tokenizer) -> int:
+    return sum(
+        tokenizer(message.content if isinstance(message.content, str) else "")
+        + TOKENS_PER_MESSAGE
+        for message in messages
+    )
@@ -8,11 +8,18 @@ VECTOR_STORE_PROVIDERS = {
     "Chroma": "langchain_chroma.Chroma",
     "FAISS": "langchain_community.vectorstores.FAISS",
     "PineconeVectorStore": "langchain_pinecone.PineconeVectorStore",
+    "LocalVectorStore": "backend.rag_components.local_vector_store.LocalVectorStore",
     # Ajoute d'autres providers ici si besoin
 }
 
 
-def get_vector_store(embedding_model, config: RagConfig):
+def get_vector_store(embedding_model, config: RagConfig, tenant: str = None):
+    """Instantiates the vector store of the configuration.
+
+    With a `tenant`, the store is opened on a collection of its own: the configured
+    collection name suffixed with the tenant, or the tenant's namespace for stores
+    that partition a single index in namespaces.
+    """
     source = config.vector_store.source
     source_config = config.vector_store.source_config
 
@@ -41,5 +48,17 @@ def get_vector_store(embedding_model, config: RagConfig):
     # Préparation des kwargs
     kwargs = {k: v for k, v in source_config.items() if k in signature.parameters}
     kwargs[embedding_param.name] = embedding_model
+    if "ann_index" in signature.parameters:
+        kwargs["ann_index"] = config.vector_store.ann_index
+    if tenant is not None:
+        if "collection_name" in signature.parameters:
+            collection_name = kwargs.get(
+                "collection_name", signature.parameters["collection_name"].default
+            )
+            kwargs["collection_name"] = f"{collection_name}-{tenant}"
+        elif "namespace" in signature.parameters:
+            kwargs["namespace"] = tenant
+        else:
+            raise ValueError(f"{source} does not support tenant collections")
 
     return vector_store_class(**kwargs)
@@ -0,0 +1,115 @@
+"""Measures the recall and latency of the IVF index of LocalVectorStore against exact
+search, for several values of nprobe.
+
+Queries are stored vectors with some noise added, so that their exact neighbours are
+not trivially themselves. Evaluate the collection of a configuration:
+
+    python -m benchmarks.ann_recall --config backend/config.yaml --nprobe 4 16 64
+
+or a synthetic collection of clustered vectors built in a temporary directory:
+
+    python -m benchmarks.ann_recall --synthetic 1000000 --dim 768
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from backend.config import AnnIndexConfig, RagConfig
+from backend.rag_components.local_vector_store import LocalVectorStore
+from backend.rag_components.vector_store import get_vector_store
+
+# Relative norm of the noise added to the stored vectors to make queries
+QUERY_NOISE = 0.3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--config", type=Path, help="RagConfig YAML file to evaluate")
+    parser.add_argument("--synthetic", type=int, help="Number of synthetic vectors")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.synthetic:
+            store = build_synthetic_store(Path(directory), args.synthetic, args.dim)
+        elif args.config:
+            store = get_vector_store(None, RagConfig.from_yaml(args.config))
+            if not isinstance(store, LocalVectorStore):
+                parser.error("The configured vector store is not a LocalVectorStore")
+        else:
+            parser.error("Pass either --config or --synthetic")
+
+        store._refresh()
+        if store._ivf is None or not store._ivf.is_built or args.nlist:
+            start = time.perf_counter()
+            store.build_index(nlist=args.nlist)
+            print(f"Index built in {time.perf_counter() - start:.1f}s")
+        evaluate(store, args.queries, args.k, args.nprobe)
+
+
+def build_synthetic_store(directory: Path, num_vectors: int, dim: int):
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((max(num_vectors // 1000, 1), dim))
+    store = LocalVectorStore(
+        None,
+        persist_directory=directory,
+        ann_index=AnnIndexConfig(enabled=True, min_vectors=num_vectors),
+    )
+    batch_size = 100_000
+    for start in range(0, num_vectors, batch_size):
+        size = min(batch_size, num_vectors - start)
+        vectors = centers[rng.integers(0, len(centers), size)]
+        vectors += rng.standard_normal((size, dim))
+        ids = [str(i) for i in range(start, start + size)]
+        store.add_vectors(vectors.astype(np.float32), ids, ids=ids)
+    return store
+
+
+def evaluate(store: LocalVectorStore, num_queries: int, k: int, nprobes: list):
+    rng = np.random.default_rng(1)
+    live_rows = np.flatnonzero(~store._deleted)
+    rows = np.sort(rng.choice(live_rows, min(num_queries, len(live_rows)), False))
+    queries = store._get_rows(rows)
+    queries += QUERY_NOISE * rng.standard_normal(queries.shape) / np.sqrt(store._dim)
+
+    exact_ids, exact_latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results = store.similarity_search_by_vector_with_score(query, k, exact=True)
+        exact_latencies.append(time.perf_counter() - start)
+        exact_ids.append({document.id for document, _ in results})
+    print(
+        f"{len(store)} vectors, {len(queries)} queries, k={k},"
+        f" {store._ivf.nlist} clusters"
+    )
+    print(f"{'search':>12} {'recall':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    print(_format_row("exact", 1.0, exact_latencies))
+
+    for nprobe in nprobes:
+        hits, latencies = 0, []
+        for query, expected_ids in zip(queries, exact_ids):
+            start = time.perf_counter()
+            results = store.similarity_search_by_vector_with_score(
+                query, k, nprobe=nprobe
+            )
+            latencies.append(time.perf_counter() - start)
+            hits += len(expected_ids & {document.id for document, _ in results})
+        recall = hits / sum(len(ids) for ids in exact_ids)
+        print(_format_row(f"nprobe={nprobe}", recall, latencies))
+
+
+def _format_row(name: str, recall: float, latencies: list) -> str:
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    return f"{name:>12} {recall:>8.3f} {p50:>8.2f} {p99:>8.2f}"
+
+
+if __name__ == "__main__":
+    main()
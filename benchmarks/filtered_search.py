@@ -0,0 +1,94 @@
+"""Measures the latency of metadata-filtered searches of LocalVectorStore, for several
+collection sizes and filter selectivities.
+
+Synthetic collections are built in a temporary directory, with a categorical
+attribute taking 1000 values evenly and a numeric one numbering the vectors. Filters
+select a share of the collection with `$in` on the first, or with a range on the
+second:
+
+    python -m benchmarks.filtered_search --sizes 100000 400000 --dim 384
+
+A filtered search only scores the vectors matching its filter, so its latency should
+follow the number of matching vectors rather than the size of the collection. The
+time to index the attributes, paid by the first filtered search, is reported apart.
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from backend.rag_components.local_vector_store import LocalVectorStore
+
+# Number of values of the categorical attribute
+NUM_VALUES = 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 400_000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument(
+        "--selectivities", type=float, nargs="+", default=[0.001, 0.01, 0.1, 1.0]
+    )
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'vectors':>9} {'filter':>16} {'matching':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            store = build_synthetic_store(Path(directory), size, args.dim)
+            queries = np.random.default_rng(1).standard_normal((args.queries, args.dim))
+            print(_format_row(size, "none", size, _time(store, queries, args.k)))
+
+            start = time.perf_counter()
+            store.similarity_search_by_vector(queries[0], args.k, filter={"value": 0})
+            print(f"Attributes indexed in {time.perf_counter() - start:.1f}s")
+
+            for selectivity in args.selectivities:
+                num_values = max(int(NUM_VALUES * selectivity), 1)
+                values = {"value": {"$in": list(range(num_values))}}
+                matching = size * num_values // NUM_VALUES
+                latencies = _time(store, queries, args.k, values)
+                print(_format_row(size, f"$in {selectivity:g}", matching, latencies))
+
+                matching = max(int(size * selectivity), 1)
+                rank = {"rank": {"$lt": matching}}
+                latencies = _time(store, queries, args.k, rank)
+                print(_format_row(size, f"range {selectivity:g}", matching, latencies))
+
+
+def build_synthetic_store(directory: Path, num_vectors: int, dim: int):
+    rng = np.random.default_rng(0)
+    store = LocalVectorStore(None, persist_directory=directory)
+    batch_size = 100_000
+    for start in range(0, num_vectors, batch_size):
+        size = min(batch_size, num_vectors - start)
+        vectors = rng.standard_normal((size, dim)).astype(np.float32)
+        ids = [str(i) for i in range(start, start + size)]
+        metadatas = [
+            {"value": i % NUM_VALUES, "rank": i} for i in range(start, start + size)
+        ]
+        store.add_vectors(vectors, ids, metadatas, ids=ids)
+    return store
+
+
+def _time(store: LocalVectorStore, queries: np.ndarray, k: int, filter=None) -> list:
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        store.similarity_search_by_vector(query, k, filter=filter)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def _format_row(size: int, name: str, matching: int, latencies: list) -> str:
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    return f"{size:>9} {name:>16} {matching:>9} {p50:>8.2f} {p99:>8.2f}"
+
+
+if __name__ == "__main__":
+    main()
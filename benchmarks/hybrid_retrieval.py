@@ -0,0 +1,94 @@
+"""Compares the latency and the hit rate of hybrid retrieval against vector search.
+
+By default, queries are sampled from the indexed documents: each one is made of the
+rarest term of a document, such as a product code, and of a few other of its words.
+A hit is a query whose document is retrieved. Queries can be given instead as a JSON
+lines file of {"question": ..., "expected": ...}, where a hit is a retrieved document
+containing the expected text.
+
+    python -m benchmarks.hybrid_retrieval --config backend/config.yaml --queries 200
+
+The documents must have been loaded with hybrid search enabled, so that they are in
+the lexical index too.
+"""
+
+import argparse
+import json
+import random
+import time
+from pathlib import Path
+
+import numpy as np
+
+from backend.config import RagConfig
+from backend.rag_components.bm25_index import BM25Index, tokenize
+from backend.rag_components.embedding import get_embedding_model
+from backend.rag_components.retriever import get_retriever
+from backend.rag_components.vector_store import get_vector_store
+
+# Words of the document added to its rarest term to make a query
+CONTEXT_WORDS = 3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--config", type=Path, default=Path("backend/config.yaml"))
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--queries-file", type=Path)
+    args = parser.parse_args()
+
+    config = RagConfig.from_yaml(args.config)
+    hybrid_config = config.hybrid_search
+    lexical_index = BM25Index(
+        hybrid_config.index_path, k1=hybrid_config.bm25_k1, b=hybrid_config.bm25_b
+    )
+    vector_store = get_vector_store(get_embedding_model(config), config)
+
+    if args.queries_file:
+        with args.queries_file.open() as file:
+            queries = [json.loads(line) for line in file if line.strip()]
+    else:
+        queries = sample_queries(lexical_index, args.queries)
+    print(f"{len(queries)} queries over {len(lexical_index)} documents")
+
+    hybrid_config.enabled = False
+    config.vector_store.retriever_config["k"] = hybrid_config.k
+    vector_retriever = get_retriever(vector_store, config)
+    hybrid_config.enabled = True
+    hybrid_retriever = get_retriever(vector_store, config, lexical_index)
+
+    print(f"{'retriever':>10} {'hit rate':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, retriever in (("vector", vector_retriever), ("hybrid", hybrid_retriever)):
+        hits, latencies = 0, []
+        for query in queries:
+            start = time.perf_counter()
+            documents = retriever.invoke(query["question"])
+            latencies.append(time.perf_counter() - start)
+            hits += any(query["expected"] in doc.page_content for doc in documents)
+        p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+        print(f"{name:>10} {hits / len(queries):>9.3f} {p50:>8.2f} {p99:>8.2f}")
+
+
+def sample_queries(lexical_index: BM25Index, num_queries: int) -> list:
+    random.seed(0)
+    lexical_index._refresh()
+    live_docs = np.flatnonzero(~lexical_index._deleted).tolist()
+    docs = random.sample(live_docs, min(num_queries, len(live_docs)))
+    queries = []
+    for document in lexical_index._read_documents(docs):
+        terms = list(dict.fromkeys(tokenize(document.page_content)))
+        if not terms:
+            continue
+        rarest = min(terms, key=lexical_index.document_frequency)
+        words = random.sample(terms, min(CONTEXT_WORDS, len(terms)))
+        queries.append(
+            {
+                "question": " ".join([rarest, *words]),
+                "expected": document.page_content,
+            }
+        )
+    return queries
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Compares the quality and the latency of retrieval with and without reranking.
+
+Queries are given as a JSON lines file of {"question": ..., "expected": ...}, where
+a retrieved document is relevant when it contains the expected text. Without a file,
+queries are sampled from the lexical index as in `benchmarks.hybrid_retrieval`,
+which requires documents loaded with hybrid search enabled.
+
+    python -m benchmarks.rerank --config backend/config.yaml --queries-file q.jsonl
+
+The hit rate is the share of queries with a relevant document among the `k`
+returned, and MRR the mean of 1 / rank of the first relevant one. The reranked
+retriever is timed twice: with a cold score cache, then with the scores of the first
+pass cached.
+"""
+
+import argparse
+import json
+import time
+from dataclasses import replace
+from pathlib import Path
+
+import numpy as np
+
+from backend.config import RagConfig
+from backend.rag_components.bm25_index import BM25Index
+from backend.rag_components.embedding import get_embedding_model
+from backend.rag_components.reranker import get_reranker
+from backend.rag_components.retriever import get_retriever
+from backend.rag_components.vector_store import get_vector_store
+from benchmarks.hybrid_retrieval import sample_queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--config", type=Path, default=Path("backend/config.yaml"))
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--queries-file", type=Path)
+    args = parser.parse_args()
+
+    config = RagConfig.from_yaml(args.config)
+    rerank_config = replace(config.rerank, enabled=True)
+    config = replace(config, rerank=rerank_config)
+    lexical_index = None
+    if config.hybrid_search.enabled or not args.queries_file:
+        hybrid_config = config.hybrid_search
+        lexical_index = BM25Index(
+            hybrid_config.index_path, k1=hybrid_config.bm25_k1, b=hybrid_config.bm25_b
+        )
+    vector_store = get_vector_store(get_embedding_model(config), config)
+
+    if args.queries_file:
+        with args.queries_file.open() as file:
+            queries = [json.loads(line) for line in file if line.strip()]
+    else:
+        queries = sample_queries(lexical_index, args.queries)
+    print(f"{len(queries)} queries, k={rerank_config.k}")
+
+    # The baseline returns as many documents as the reranker keeps
+    baseline_config = replace(
+        config,
+        vector_store=replace(
+            config.vector_store,
+            retriever_config={
+                **config.vector_store.retriever_config,
+                "k": rerank_config.k,
+            },
+        ),
+        hybrid_search=replace(config.hybrid_search, k=rerank_config.k),
+    )
+    baseline = get_retriever(vector_store, baseline_config, lexical_index)
+    start = time.perf_counter()
+    reranker = get_reranker(config)
+    print(f"Cross-encoder loaded in {time.perf_counter() - start:.1f}s")
+    reranked = get_retriever(vector_store, config, lexical_index, reranker)
+
+    print(f"{'retriever':>16} {'hit rate':>9} {'MRR':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, retriever in (
+        ("baseline", baseline),
+        ("reranked", reranked),
+        ("reranked cached", reranked),
+    ):
+        print(evaluate(name, retriever, queries))
+    print(f"Score cache: {reranker.stats()}")
+
+
+def evaluate(name: str, retriever, queries: list) -> str:
+    hits, reciprocal_ranks, latencies = 0, [], []
+    for query in queries:
+        start = time.perf_counter()
+        documents = retriever.invoke(query["question"])
+        latencies.append(time.perf_counter() - start)
+        ranks = [
+            rank
+            for rank, document in enumerate(documents, start=1)
+            if query["expected"] in document.page_content
+        ]
+        hits += bool(ranks)
+        reciprocal_ranks.append(1 / ranks[0] if ranks else 0.0)
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    return (
+        f"{name:>16} {hits / len(queries):>9.3f} {np.mean(reciprocal_ranks):>7.3f}"
+        f" {p50:>8.2f} {p99:>8.2f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
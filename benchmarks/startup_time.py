@@ -0,0 +1,163 @@
+"""Breaks down the startup time of the API into import and initialization costs.
+
+Each measurement runs in a new interpreter, so that modules are imported cold. Module
+imports are timed cumulatively, in the order the API imports them: a module's time
+excludes the modules measured before it. Components are then initialized one by one,
+with the import of their provider module timed separately:
+
+    python -m benchmarks.startup_time --config backend/config.yaml --runs 3
+
+The time `backend.main` takes to import, which includes the initialization of the
+RAG, is measured for the startup mode of the configuration, unless `--modes` lists
+others to compare.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import replace
+from importlib import import_module
+from pathlib import Path
+
+# Heavy dependencies first, then the modules of the API that import them
+MODULES = [
+    "numpy",
+    "sqlalchemy",
+    "sqlglot",
+    "langchain_core.runnables",
+    "langchain",
+    "langchain.chat_models",
+    "langchain.indexes",
+    "langchain_community.vectorstores",
+    "fastapi",
+    "langserve",
+    "backend.config",
+    "backend.database",
+    "backend.api_plugins",
+    "backend.rag_components.rag",
+    "backend.rag_components.ingestion",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--config", type=Path, default=Path("backend/config.yaml"))
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--modes", nargs="+", help="Startup modes of backend.main")
+    parser.add_argument("--child", choices=["imports", "components", "main"])
+    args = parser.parse_args()
+
+    if args.child == "imports":
+        print(json.dumps(time_imports(MODULES)))
+        return
+    if args.child == "components":
+        print(json.dumps(time_components(args.config)))
+        return
+    if args.child == "main":
+        print(json.dumps(time_main(args.config, args.modes[0])))
+        return
+
+    print(f"Imports, median of {args.runs} runs")
+    _print_table(_run(["--child", "imports"], args.runs))
+    print(f"\nComponents of {args.config}, initialized in order")
+    _print_table(_run(["--child", "components", "--config", str(args.config)], 1))
+    for mode in args.modes or [None]:
+        child_args = ["--child", "main", "--config", str(args.config)]
+        results = _run([*child_args, "--modes", str(mode)], args.runs)
+        print(f"\nImport of backend.main, startup mode {results.pop('mode')}")
+        _print_table(results)
+
+
+def time_imports(modules: list) -> dict:
+    timings = {}
+    for module in modules:
+        start = time.perf_counter()
+        try:
+            import_module(module)
+        except ImportError:
+            continue
+        timings[module] = time.perf_counter() - start
+    return timings
+
+
+def time_components(config_path: Path) -> dict:
+    from backend.config import RagConfig, StartupConfig
+    from backend.rag_components.embedding import EMBEDDING_PROVIDERS
+    from backend.rag_components.llm import LLM_PROVIDERS
+    from backend.rag_components.rag import RAG
+    from backend.rag_components.vector_store import VECTOR_STORE_PROVIDERS
+
+    config = RagConfig.from_yaml(config_path)
+    timings = {}
+    # Provider modules are imported by the components, time them apart
+    for name, registry, source in (
+        ("llm", LLM_PROVIDERS, config.llm.source),
+        ("embedding_model", EMBEDDING_PROVIDERS, config.embedding_model.source),
+        ("vector_store", VECTOR_STORE_PROVIDERS, config.vector_store.source),
+    ):
+        if not isinstance(source, str) or source not in registry:
+            continue
+        start = time.perf_counter()
+        try:
+            import_module(registry[source].rsplit(".", 1)[0])
+        except ImportError:
+            continue
+        timings[f"import {name} provider"] = time.perf_counter() - start
+
+    rag = RAG(replace(config, startup=StartupConfig(mode="lazy")))
+    rag.components.load_all()
+    for name, status in rag.components.status().items():
+        label = name if status["status"] == "ready" else f"{name} ({status['status']})"
+        timings[label] = status["seconds"] or 0.0
+
+    start = time.perf_counter()
+    rag.get_chain()
+    timings["get_chain"] = time.perf_counter() - start
+    return timings
+
+
+def time_main(config_path: Path, mode: str) -> dict:
+    start = time.perf_counter()
+    import backend.config
+    from backend.config import RagConfig, StartupConfig
+
+    # backend.main reads the configuration from its own directory
+    config = RagConfig.from_yaml(config_path)
+    if mode != "None":
+        config = replace(config, startup=StartupConfig(mode=mode))
+    backend.config.RagConfig.from_yaml = classmethod(lambda cls, *_, **__: config)
+    import_module("backend.main")
+    return {"mode": config.startup.mode, "backend.main": time.perf_counter() - start}
+
+
+def _run(child_args: list, runs: int) -> dict:
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.startup_time", *child_args],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        key: (
+            statistics.median(result[key] for result in results)
+            if isinstance(results[0][key], float)
+            else results[0][key]
+        )
+        for key in results[0]
+    }
+
+
+def _print_table(timings: dict) -> None:
+    for name, seconds in timings.items():
+        print(f"{name:>40} {seconds * 1000:>10.1f} ms")
+    print(f"{'total':>40} {sum(timings.values()) * 1000:>10.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Measures the latency of queries spread over many tenants under a memory budget.
+
+Synthetic tenant collections are built in a temporary directory, and queries pick
+their tenant with a Zipf distribution, as a few customers make most of the traffic:
+
+    python -m benchmarks.tenants --tenants 200 --vectors 5000 --budgets 64 256
+
+Queries whose tenant is loaded only pay the search, the others also pay opening its
+collection and evicting others. The hit rate is the share of queries whose tenant
+was loaded.
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from backend.rag_components.local_vector_store import LocalVectorStore
+from backend.rag_components.tenancy import TenantIndex, TenantIndexes
+from benchmarks.filtered_search import build_synthetic_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--tenants", type=int, default=200)
+    parser.add_argument("--vectors", type=int, default=5000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--budgets", type=float, nargs="+", default=[64, 256, 1024])
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--zipf", type=float, default=1.2)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        for tenant in range(args.tenants):
+            build_synthetic_store(directory / f"t{tenant}", args.vectors, args.dim)
+        size_mb = args.vectors * args.dim * 4 / 2**20
+        print(f"{args.tenants} tenants of {args.vectors} vectors, {size_mb:.1f} MB")
+
+        rng = np.random.default_rng(2)
+        tenants = (rng.zipf(args.zipf, args.queries) - 1) % args.tenants
+        queries = rng.standard_normal((args.queries, args.dim))
+
+        print(
+            f"{'budget MB':>9} {'hit rate':>9} {'loaded':>7} {'p50 ms':>8}"
+            f" {'p99 ms':>8}"
+        )
+        for budget in args.budgets:
+            indexes = TenantIndexes(
+                lambda tenant: _load(directory, tenant),
+                memory_budget_mb=budget,
+                max_loaded_tenants=args.tenants,
+            )
+            latencies = []
+            for tenant, query in zip(tenants, queries):
+                start = time.perf_counter()
+                store = indexes.get(f"t{tenant}").vector_store
+                store.similarity_search_by_vector(query, args.k)
+                latencies.append(time.perf_counter() - start)
+            stats = indexes.stats()
+            p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+            print(
+                f"{budget:>9g} {stats['hits'] / args.queries:>9.3f}"
+                f" {stats['loaded']:>7} {p50:>8.2f} {p99:>8.2f}"
+            )
+
+
+def _load(directory: Path, tenant: str) -> TenantIndex:
+    store = LocalVectorStore(None, persist_directory=directory / tenant)
+    return TenantIndex(tenant, store, None, None)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,11 +8,12 @@ from backend.rag_components.rag import RAG
 
 rag = RAG(config=Path(__file__).parents[1] / "backend" / "config.yaml")
 
-chain = rag.get_chain(memory=False)
+# The chains are wrapped to take metadata filters, their documentation is inside
+chain = rag.get_chain(memory=False).bound
 with (Path(__file__).parent / "backend" / "chains" / "basic_chain.md").open("w") as f:
     f.write(chain.documentation.to_markdown())
 
-chain = rag.get_chain(memory=True)
+chain = rag.get_chain(memory=True).bound
 doc_chain = DocumentedRunnable(
     chain,
     chain_name="RAG with persistant memory",
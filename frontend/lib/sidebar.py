@@ -6,6 +6,8 @@ import streamlit as st
 from frontend.lib.backend_interface import query
 from frontend.lib.session_chat import Message
 
+SESSIONS_PAGE_SIZE = 50
+
 
 def sidebar():
     with st.sidebar:
@@ -21,7 +23,9 @@ def sidebar():
             st.session_state["messages"] = []
 
         with st.empty():
-            chat_list = list_sessions()
+            chat_list, next_cursor = list_sessions(
+                st.session_state.get("sessions_limit")
+            )
             chats_by_time_ago = {}
             for chat in chat_list:
                 chat_id, timestamp = chat["id"], chat["timestamp"]
@@ -54,13 +58,52 @@ def sidebar():
                         ]
                         st.session_state["messages"] = messages
 
+            if next_cursor and st.sidebar.button(
+                "Older chats", use_container_width=True, key="older_chats_button"
+            ):
+                st.session_state["sessions_limit"] = len(chat_list) + SESSIONS_PAGE_SIZE
+                st.rerun()
+
 
-def list_sessions():
-    return query("get", "/session/list").json()
+def list_sessions(limit: int = None):
+    """Fetch the most recent sessions, one page at a time, until `limit` are listed."""
+    limit = limit or SESSIONS_PAGE_SIZE
+    sessions, cursor = [], None
+    while len(sessions) < limit:
+        params = {"limit": min(limit - len(sessions), SESSIONS_PAGE_SIZE)}
+        if cursor:
+            params["cursor"] = cursor
+        page = query("get", "/session/list", params=params).json()
+        sessions.extend(page["sessions"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    return sessions, cursor
 
 
 def get_session(session_id: str):
-    session = query("get", f"/session/{session_id}").json()
+    """Fetch the full history of a session, reusing the cached copy if unchanged.
+
+    The latest page is requested with the ETag of the cached copy, older pages are
+    only downloaded when the backend reports a change.
+    """
+    cache = st.session_state.setdefault("session_histories", {})
+    etag, cached_session = cache.get(session_id, (None, None))
+    headers = {"If-None-Match": etag} if etag else {}
+
+    response = query("get", f"/session/{session_id}", headers=headers)
+    if response.status_code == 304:
+        return cached_session
+
+    session = response.json()
+    cursor = session.get("next_cursor")
+    while cursor:
+        page = query("get", f"/session/{session_id}", params={"before": cursor}).json()
+        session["messages"] = page["messages"] + session["messages"]
+        cursor = page["next_cursor"]
+
+    if response.headers.get("ETag"):
+        cache[session_id] = (response.headers["ETag"], session)
     return session
 
 
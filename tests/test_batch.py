@@ -0,0 +1,85 @@
+from types import SimpleNamespace
+from typing import List, Optional
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import FakeEmbeddings
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import InMemoryVectorStore
+
+from backend.config import (
+    DatabaseConfig,
+    EmbeddingModelConfig,
+    LLMConfig,
+    RagConfig,
+    VectorStoreConfig,
+)
+from backend.rag_components.batch import BatchAnswerer, search_by_vectors
+
+
+class RecordingRetriever(BaseRetriever):
+    queries: list = []
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager, filter: Optional[dict] = None
+    ) -> List[Document]:
+        self.queries.append((query, filter))
+        return [Document(page_content=query)]
+
+
+class FaissLikeVectorStore(InMemoryVectorStore):
+    """Searches one vector with scores under the name FAISS gives it."""
+
+    def _select_relevance_score_fn(self):
+        return lambda score: score  # Cosine similarity
+
+
+def make_rag(search_type: str, retriever_config: dict):
+    embeddings = FakeEmbeddings(size=8)
+    store = FaissLikeVectorStore(embeddings)
+    store.add_texts([f"document {i}" for i in range(10)])
+    config = RagConfig(
+        llm=LLMConfig(source="FakeListChatModel", source_config={}),
+        embedding_model=EmbeddingModelConfig(source="FakeEmbeddings", source_config={}),
+        vector_store=VectorStoreConfig(
+            source="InMemoryVectorStore",
+            source_config={},
+            insertion_mode=None,
+            retriever_search_type=search_type,
+            retriever_config=retriever_config,
+        ),
+        database=DatabaseConfig(database_url="sqlite://"),
+    )
+    return SimpleNamespace(
+        config=config,
+        embeddings=embeddings,
+        llm=FakeListChatModel(responses=["answer"]),
+        reranker=None,
+        retriever=RecordingRetriever(),
+        get_indexes=lambda tenant=None: (store, None),
+    )
+
+
+def test_search_types_other_than_similarity_use_the_retriever():
+    rag = make_rag("mmr", {"k": 3, "fetch_k": 10})
+
+    results = BatchAnswerer(rag).retrieve(
+        ["first question", "second question"], [None, {"source": "a"}]
+    )
+    assert [documents[0].page_content for documents in results] == [
+        "first question",
+        "second question",
+    ]
+    assert sorted(rag.retriever.queries) == [
+        ("first question", None),
+        ("second question", {"source": "a"}),
+    ]
+
+
+def test_score_threshold_applies_to_stores_named_like_faiss():
+    rag = make_rag("similarity_score_threshold", {"k": 10})
+    store, _ = rag.get_indexes()
+    vector = rag.embeddings.embed_query("question")
+
+    assert len(search_by_vectors(store, [vector], 10)[0]) == 10
+    assert search_by_vectors(store, [vector], 10, score_threshold=1.1) == [[]]
@@ -0,0 +1,50 @@
+import json
+
+from langchain_core.documents import Document
+
+from backend.rag_components.bm25_index import BM25Index
+
+
+def test_documents_buffered_by_a_crashed_writer_are_not_lost(tmp_path):
+    writer = BM25Index(tmp_path)
+    writer.add_documents(
+        [Document(page_content=f"product XK-{i}") for i in range(3)],
+        ["a", "b", "c"],
+    )
+    writer.delete(["b"])
+    with (tmp_path / "buffer.jsonl").open("ab") as log:
+        log.write(b'{"id": "d", "te')  # Interrupted while appending
+    del writer  # Crashed before flushing
+
+    index = BM25Index(tmp_path)
+    index.add_documents([Document(page_content="product XK-4")], ["e"])
+    index.flush()
+    assert sorted(doc.id for doc, _ in index.search("product", k=10)) == [
+        "a",
+        "c",
+        "e",
+    ]
+    assert (tmp_path / "buffer.jsonl").stat().st_size == 0
+
+
+def test_terms_of_deleted_documents_still_match(tmp_path):
+    index = BM25Index(tmp_path)
+    ids = [str(i) for i in range(10)]
+    index.add_documents([Document(page_content=f"name {i}") for i in range(10)], ids)
+    index.flush()
+    index.delete(ids[:6])
+
+    assert index.document_frequency("name") == 4
+    assert sorted(doc.id for doc, _ in index.search("name", k=10)) == ids[6:]
+
+
+def test_segments_of_the_same_level_are_merged(tmp_path):
+    index = BM25Index(tmp_path, merge_factor=4)
+    for i in range(20):
+        index.add_documents([Document(page_content=f"page {i}")], [str(i)])
+        index.flush()
+
+    manifest = json.loads((tmp_path / "segments.json").read_text())
+    assert [segment["level"] for segment in manifest["segments"]] == [2, 1]
+    assert [segment["num_docs"] for segment in manifest["segments"]] == [16, 4]
+    assert len(index.search("page", k=30)) == 20
@@ -0,0 +1,15 @@
+from backend.database import Database
+
+
+def test_create_index_is_idempotent(tmp_path):
+    with Database(f"sqlite:///{tmp_path}/test.sqlite3") as connection:
+        connection.execute('CREATE TABLE "events" ("session_id" TEXT, "at" INTEGER)')
+        for _ in range(2):
+            connection.create_index(
+                "events",
+                "idx_events_session_id",
+                ["session_id", "at"],
+                prefix_lengths={"session_id": 255},
+            )
+        assert connection.index_exists("events", "idx_events_session_id")
+        assert not connection.index_exists("events", "idx_events_at")
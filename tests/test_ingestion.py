@@ -0,0 +1,99 @@
+from types import SimpleNamespace
+from typing import Iterator, List
+
+import pytest
+from langchain.docstore.document import Document
+from langchain_core.embeddings import FakeEmbeddings
+from langchain_core.vectorstores import InMemoryVectorStore
+
+from backend.config import IngestionConfig
+from backend.rag_components.bm25_index import BM25Index
+from backend.rag_components.embedding import PrefetchedEmbeddings
+from backend.rag_components.ingestion import IngestionPipeline, _IndexDestination
+
+
+class CountingEmbeddings(FakeEmbeddings):
+    num_embedded: int = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.num_embedded += len(texts)
+        return super().embed_documents(texts)
+
+
+def make_rag(tmp_path, embeddings=None):
+    embeddings = embeddings or FakeEmbeddings(size=8)
+    store = InMemoryVectorStore(embeddings)
+    config = SimpleNamespace(
+        ingestion=IngestionConfig(
+            batch_size=2, loader_workers=0, embedding_workers=1, queue_size=2
+        ),
+        database=SimpleNamespace(database_url=f"sqlite:///{tmp_path}/rag.sqlite3"),
+    )
+    return SimpleNamespace(
+        config=config,
+        embeddings=embeddings,
+        llm=None,
+        tenants=None,
+        get_indexes=lambda tenant=None: (store, None),
+    )
+
+
+def make_documents(n: int) -> List[Document]:
+    return [
+        Document(page_content=f"document {i}", metadata={"source": f"source {i}"})
+        for i in range(n)
+    ]
+
+
+def test_full_cleanup_is_skipped_when_the_input_fails(tmp_path):
+    rag = make_rag(tmp_path)
+    store, _ = rag.get_indexes()
+    IngestionPipeline(rag, insertion_mode="full").run_documents(make_documents(6))
+    assert len(store.store) == 6
+
+    def failing_documents() -> Iterator[Document]:
+        yield from make_documents(3)
+        raise RuntimeError("Loader failed")
+
+    with pytest.raises(RuntimeError, match="Loader failed"):
+        IngestionPipeline(rag, insertion_mode="full").run_documents(failing_documents())
+    assert len(store.store) == 6
+
+
+def test_indexed_documents_are_not_embedded_again(tmp_path):
+    embeddings = CountingEmbeddings(size=8)
+    rag = make_rag(tmp_path, PrefetchedEmbeddings(embeddings))
+    documents = make_documents(10)
+    IngestionPipeline(rag, insertion_mode="incremental").run_documents(documents)
+    assert embeddings.num_embedded == 10
+
+    output = IngestionPipeline(rag, insertion_mode="incremental").run_documents(
+        documents + make_documents(12)[10:]
+    )
+    assert output["num_skipped"] == 10
+    assert embeddings.num_embedded == 12
+
+
+def test_write_stage_counts_the_documents_written(tmp_path):
+    rag = make_rag(tmp_path)
+    documents = make_documents(10)
+    IngestionPipeline(rag, insertion_mode="incremental").run_documents(documents)
+
+    pipeline = IngestionPipeline(rag, insertion_mode="incremental")
+    output = pipeline.run_documents(documents + make_documents(12)[10:])
+    write = next(stage for stage in output["stages"] if stage["stage"] == "write")
+    assert write["documents"] == 2  # The others are skipped by index()
+
+
+def test_destination_can_be_created_from_texts(tmp_path):
+    lexical_index = BM25Index(tmp_path)
+    destination = _IndexDestination.from_texts(
+        ["first text", "second text"],
+        FakeEmbeddings(size=8),
+        vector_store_cls=InMemoryVectorStore,
+        lexical_index=lexical_index,
+    )
+    lexical_index.flush()
+
+    assert len(destination.vector_store.store) == 2
+    assert len(lexical_index.search("second", k=2)) == 1
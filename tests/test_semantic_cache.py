@@ -0,0 +1,20 @@
+from langchain_core.embeddings import FakeEmbeddings
+
+from backend.rag_components.semantic_cache import SemanticCache
+
+
+def test_cache_is_cleared_when_another_process_changes_the_index():
+    index = {"generation": 0}
+    cache = SemanticCache(
+        FakeEmbeddings(size=8),
+        index_generation=lambda: index["generation"],
+        index_check_seconds=0,
+    )
+    vector = cache.embed("What is RAG?")
+    assert cache.lookup(vector) is None
+    cache.add(vector, "Retrieval augmented generation")
+    assert cache.lookup(vector) == "Retrieval augmented generation"
+
+    index["generation"] += 1  # Documents loaded by another process
+    assert cache.lookup(vector) is None
+    assert cache.stats()["invalidations"] == 1
@@ -0,0 +1,20 @@
+import pytest
+
+from backend.api_plugins.sessions.sessions import etag_matches
+
+
+@pytest.mark.parametrize(
+    "if_none_match, expected",
+    [
+        (None, False),
+        ('"abc"', True),
+        ('W/"abc"', True),
+        ('"other", "abc"', True),
+        ("*", True),
+        ('"abcd"', False),
+        ('"ab"', False),
+        ('"a,b", "ab"', False),
+    ],
+)
+def test_if_none_match_lists_the_exact_etag(if_none_match, expected):
+    assert etag_matches('"abc"', if_none_match) is expected